@@ -0,0 +1,65 @@
+"""In-process stand-in for clickhouse_driver.Client used by the benchmarks."""
+
+from houseplant.testing import RecordingClient
+
+
+class FakeClient(RecordingClient):
+    """Answer the queries houseplant issues from in-memory state.
+
+    Every query is recorded so the benchmarks can report how many round
+    trips each command would make against a real server.
+    """
+
+    def __init__(self, database="benchmark", tables=None, applied=None):
+        super().__init__(database=database)
+        self.tables = list(tables or [])
+        self.applied = set(applied or [])
+
+        self.respond(r"^SELECT version FROM schema_migrations", self._applied_rows)
+        self.respond(r"FROM local_migrations", self._diff_rows)
+        self.respond(r"^INSERT INTO schema_migrations", self._mark)
+        self.respond(
+            r"FROM system\.tables .*position\('MergeTree' IN engine\) > 0",
+            lambda query, params: [(table,) for table in sorted(self.tables)],
+        )
+        self.respond(
+            r"^SHOW CREATE (TABLE|VIEW|MATERIALIZED VIEW|DICTIONARY) ",
+            self._show_create,
+        )
+        self.respond(r"formatQuery\(create_table_query\)", self._create_statements)
+
+    def _applied_rows(self, query, params):
+        return [(version,) for version in sorted(self.applied)]
+
+    def _diff_rows(self, query, params):
+        [table] = self.queries[-1]["external_tables"]
+        local = {row["version"] for row in table["data"]}
+        return [(version, "pending") for version in sorted(local - self.applied)] + [
+            (version, "missing") for version in sorted(self.applied - local)
+        ]
+
+    def _mark(self, query, params):
+        if isinstance(params, dict):
+            active = "VALUES (%(version)s, 1" in query
+            params = [(params["version"], int(active))]
+        for version, active, *_ in params:
+            if active:
+                self.applied.add(version)
+            else:
+                self.applied.discard(version)
+        return []
+
+    def _create_statement(self, name):
+        return (
+            f"CREATE TABLE {self.connection.database}.{name}\n"
+            "(\n    `id` UInt32\n)\nENGINE = MergeTree\nORDER BY id"
+        )
+
+    def _show_create(self, query, params):
+        return [(self._create_statement(query.split()[-1]),)]
+
+    def _create_statements(self, query, params):
+        return [
+            (table, "tables", self._create_statement(table))
+            for table in sorted(self.tables)
+        ]
@@ -0,0 +1,221 @@
+"""Benchmark houseplant commands against synthetic migration trees.
+
+Generates ``ch/migrations`` directories with 100, 1k and 10k migrations,
+runs every command against an in-process fake ClickHouse client and
+records wall time, peak memory and query count for each one.
+
+Usage::
+
+    $ python benchmarks/run.py
+    $ python benchmarks/run.py --sizes 100 1000 --output results.json
+    $ python benchmarks/run.py --update-baseline
+
+The results are compared against ``benchmarks/baseline.json``. Any command
+that issues more queries than the baseline, or that is slower or uses more
+memory than the baseline allows for, is reported and the script exits with
+a non-zero status.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+from rich.console import Console
+
+from houseplant import Houseplant
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fake_client import FakeClient  # noqa: E402
+
+DEFAULT_SIZES = [100, 1000, 10000]
+DEFAULT_BASELINE = Path(__file__).parent / "baseline.json"
+
+MIGRATION_TEMPLATE = """version: "{version}"
+name: create_table_{index}
+table: table_{index}
+
+development: &development
+  up: |
+    CREATE TABLE {{table}} (
+        id UInt32,
+        name String
+    ) ENGINE = MergeTree()
+    ORDER BY id
+  down: |
+    DROP TABLE {{table}}
+
+test:
+  <<: *development
+
+production:
+  <<: *development
+"""
+
+
+def generate_migrations(root: Path, size: int) -> list[str]:
+    """Write ``size`` migration files into ``root/ch/migrations``."""
+    migrations_dir = root / "ch" / "migrations"
+    migrations_dir.mkdir(parents=True)
+    (root / "ch" / "schema.sql").touch()
+
+    versions = []
+    for index in range(size):
+        version = f"{20240101000000 + index}"
+        versions.append(version)
+        migration_file = migrations_dir / f"{version}_create_table_{index}.yml"
+        migration_file.write_text(
+            MIGRATION_TEMPLATE.format(version=version, index=index)
+        )
+    return versions
+
+
+def all_applied(versions):
+    return {
+        "tables": [f"table_{index}" for index in range(len(versions))],
+        "applied": versions,
+    }
+
+
+def none_applied(versions):
+    return {"tables": [], "applied": []}
+
+
+COMMANDS = {
+    "migrate_status": (all_applied, lambda hp: hp.migrate_status()),
+    "migrate_up": (none_applied, lambda hp: hp.migrate_up()),
+    "migrate_down": (all_applied, lambda hp: hp.migrate_down()),
+    "db_schema_load": (none_applied, lambda hp: hp.db_schema_load()),
+    "update_schema": (all_applied, lambda hp: hp.update_schema()),
+}
+
+
+def make_houseplant(state) -> Houseplant:
+    houseplant = Houseplant()
+    houseplant.console = Console(file=open(os.devnull, "w"))
+    houseplant.db.client = FakeClient(**state)
+    return houseplant
+
+
+def run_command(versions, setup, command):
+    """Run a command twice: once for wall time and once under tracemalloc."""
+    houseplant = make_houseplant(setup(versions))
+    start = time.perf_counter()
+    command(houseplant)
+    seconds = time.perf_counter() - start
+    query_count = houseplant.db.client.query_count
+
+    houseplant = make_houseplant(setup(versions))
+    tracemalloc.start()
+    command(houseplant)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "seconds": round(seconds, 4),
+        "peak_memory_bytes": peak_memory,
+        "queries": query_count,
+    }
+
+
+def run_benchmarks(sizes, commands):
+    console = Console(stderr=True)
+    results = {}
+    cwd = os.getcwd()
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            versions = generate_migrations(Path(tmp_dir), size)
+            os.chdir(tmp_dir)
+            try:
+                for name in commands:
+                    setup, command = COMMANDS[name]
+                    result = run_command(versions, setup, command)
+                    results.setdefault(str(size), {})[name] = result
+                    console.print(
+                        f"{size:>6} {name:<16} {result['seconds']:>9.4f}s "
+                        f"{result['peak_memory_bytes'] / 1024 / 1024:>9.2f} MiB "
+                        f"{result['queries']:>7} queries"
+                    )
+            finally:
+                os.chdir(cwd)
+
+    return results
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    """Return a list of human readable regressions against the baseline."""
+    regressions = []
+    for size, commands in results.items():
+        for name, result in commands.items():
+            expected = baseline.get(size, {}).get(name)
+            if expected is None:
+                continue
+
+            if result["queries"] > expected["queries"]:
+                regressions.append(
+                    f"{name} ({size} migrations): {result['queries']} queries, "
+                    f"baseline {expected['queries']}"
+                )
+            if result["seconds"] > expected["seconds"] * (1 + time_tolerance):
+                regressions.append(
+                    f"{name} ({size} migrations): {result['seconds']}s, "
+                    f"baseline {expected['seconds']}s"
+                )
+            if result["peak_memory_bytes"] > expected["peak_memory_bytes"] * (
+                1 + memory_tolerance
+            ):
+                regressions.append(
+                    f"{name} ({size} migrations): "
+                    f"{result['peak_memory_bytes']} bytes, "
+                    f"baseline {expected['peak_memory_bytes']} bytes"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES)
+    parser.add_argument(
+        "--commands", nargs="+", choices=sorted(COMMANDS), default=list(COMMANDS)
+    )
+    parser.add_argument("--output", type=Path, help="Write results to this file.")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--update-baseline",
+        action="store_true",
+        help="Store the results as the new baseline instead of comparing.",
+    )
+    parser.add_argument("--time-tolerance", type=float, default=0.5)
+    parser.add_argument("--memory-tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.commands)
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(results, indent=2) + "\n")
+        return 0
+
+    if not args.baseline.exists():
+        return 0
+
+    baseline = json.loads(args.baseline.read_text())
+    regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+
+    console = Console(stderr=True)
+    for regression in regressions:
+        console.print(f"[red]Regression:[/red] {regression}")
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,4 +3,12 @@
 __all__ = ["__version__", "Houseplant"]
 
 from .__version__ import __version__
-from .houseplant import Houseplant
+
+
+def __getattr__(name):
+    # Imported on first use so houseplant-remote starts without the driver
+    if name == "Houseplant":
+        from .houseplant import Houseplant
+
+        return Houseplant
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,148 @@
+"""Asyncio interface for embedding houseplant in async services."""
+
+import asyncio
+
+from .clickhouse_client import ClickHouseClient
+from .houseplant import Houseplant
+
+
+def _delegate(name):
+    """Async wrapper of the ``ClickHouseClient`` method ``name``."""
+    method = getattr(ClickHouseClient, name)
+
+    async def wrapper(self, *args, **kwargs):
+        return await self.run(method, *args, **kwargs)
+
+    wrapper.__name__ = name
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+async def _in_thread(release, func, *args, **kwargs):
+    """Call ``func`` in a thread and ``release()`` once the thread is done.
+
+    Cancelling the caller can't stop the thread, so whatever it uses is only
+    released when it returns, not when the caller stops waiting.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(func, *args, **kwargs))
+
+    def done(task):
+        # Errors of a thread nobody waits for anymore are dropped
+        if not task.cancelled():
+            task.exception()
+        release()
+
+    task.add_done_callback(done)
+    return await asyncio.shield(task)
+
+
+class AsyncClickHouseClient:
+    """Run ``ClickHouseClient`` methods without blocking the event loop.
+
+    Each call runs in a worker thread on a connection borrowed from a pool,
+    so up to ``pool_size`` calls are in flight at once. Connections are
+    opened as they are needed. Other arguments are passed to
+    ``ClickHouseClient``.
+    """
+
+    def __init__(self, *args, client=None, pool_size=None, **kwargs):
+        self.sync = client or ClickHouseClient(*args, **kwargs)
+        self.pool_size = pool_size or self.sync.pool_size
+        self._pool = asyncio.LifoQueue()
+        self._clients = []
+
+    async def _acquire(self):
+        if self._pool.empty() and len(self._clients) < self.pool_size:
+            client = self.sync if not self._clients else self.sync.clone()
+            self._clients.append(client)
+            return client
+        return await self._pool.get()
+
+    async def run(self, func, *args, **kwargs):
+        """Call ``func(client, *args, **kwargs)`` in a thread on a pooled client."""
+        client = await self._acquire()
+        return await _in_thread(
+            lambda: self._pool.put_nowait(client), func, client, *args, **kwargs
+        )
+
+    async def close(self):
+        """Close every pooled connection."""
+        for client in self._clients:
+            await asyncio.to_thread(client.client.disconnect)
+        self._clients = []
+        self._pool = asyncio.LifoQueue()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    get_database_schema = _delegate("get_database_schema")
+    get_create_statements = _delegate("get_create_statements")
+    get_latest_migration = _delegate("get_latest_migration")
+    get_database_tables = _delegate("get_database_tables")
+    get_database_materialized_views = _delegate("get_database_materialized_views")
+    get_database_dictionaries = _delegate("get_database_dictionaries")
+    get_applied_migrations = _delegate("get_applied_migrations")
+    get_migration_diff = _delegate("get_migration_diff")
+    get_table_sizes = _delegate("get_table_sizes")
+    init_migrations_table = _delegate("init_migrations_table")
+    execute_migration = _delegate("execute_migration")
+    mark_migration_applied = _delegate("mark_migration_applied")
+    mark_migrations_applied = _delegate("mark_migrations_applied")
+    mark_migration_rolled_back = _delegate("mark_migration_rolled_back")
+
+
+class AsyncHouseplant:
+    """Run houseplant commands on one database without blocking the event loop.
+
+    Commands on the same instance run one at a time on the migration
+    connection, while ``db`` answers introspection queries concurrently over
+    its own pool. Create one instance per target database to migrate several
+    databases from a single process.
+    """
+
+    def __init__(self, database=None, pool_size=None, root=None):
+        self.houseplant = Houseplant(
+            db=ClickHouseClient(database=database, root=root), root=root
+        )
+        self.db = AsyncClickHouseClient(
+            database=database, pool_size=pool_size, root=root
+        )
+        self._lock = asyncio.Lock()
+
+    async def _run(self, method, *args):
+        await self._lock.acquire()
+        return await _in_thread(self._lock.release, method, *args)
+
+    async def migrate_status(self):
+        """Show the status of every migration."""
+        return await self._run(self.houseplant.migrate_status)
+
+    async def migrate_up(self, version: str | None = None):
+        """Run migrations up to specified version."""
+        return await self._run(self.houseplant.migrate_up, version)
+
+    async def migrate_down(self, version: str | None = None, step: int | None = None):
+        """Roll back migrations to specified version."""
+        return await self._run(self.houseplant.migrate_down, version, step)
+
+    async def migrate(self, version: str | None = None):
+        """Run migrations up to specified version."""
+        return await self._run(self.houseplant.migrate, version)
+
+    async def migrate_check(self) -> bool:
+        """Check that every pending migration would apply cleanly."""
+        return await self._run(self.houseplant.migrate_check)
+
+    async def close(self):
+        """Close the migration connection and the introspection pool."""
+        await self.db.close()
+        await asyncio.to_thread(self.houseplant.db.client.disconnect)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -1,6 +1,8 @@
 """Console script for houseplant."""
 
 import os
+import sys
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Optional
 
@@ -9,6 +11,9 @@ from dotenv import load_dotenv
 from rich.console import Console
 
 from houseplant import Houseplant, __version__
+from houseplant.houseplant import target_drifted
+from houseplant.output import OutputFormat, RecordWriter
+from houseplant.server import serve as serve_commands
 
 # Load environment variables from .env file in current directory
 load_dotenv(Path.cwd() / ".env")
@@ -27,6 +32,31 @@ def get_houseplant() -> Houseplant:
     return houseplant
 
 
+@contextmanager
+def structured_output(hp: Houseplant, output_format: OutputFormat):
+    """Stream the records of a command to stdout in a machine-readable format.
+
+    Progress and messages go to stderr so stdout only holds records.
+    """
+    if output_format == OutputFormat.text:
+        yield
+        return
+
+    hp.console = Console(stderr=True)
+    with RecordWriter(output_format, sys.stdout) as writer:
+        hp.on_record = writer.write
+        yield
+
+
+def format_option():
+    return typer.Option(
+        OutputFormat.text,
+        "--format",
+        "-f",
+        help="Output format, json and ndjson stream one record per migration.",
+    )
+
+
 def version_callback(value: bool):
     if value:
         console = Console()
@@ -63,40 +93,133 @@ def generate(name: str):
 
 
 @app.command(name="migrate:status")
-def migrate_status():
+def migrate_status(output_format: OutputFormat = format_option()):
     """Show status of database migrations."""
     hp = get_houseplant()
-    hp.migrate_status()
+    with structured_output(hp, output_format):
+        hp.migrate_status()
 
 
 @app.command(name="migrate")
-def migrate(version: Optional[str] = typer.Argument(None)):
+def migrate(
+    version: Optional[str] = typer.Argument(None),
+    plan: Optional[Path] = typer.Option(
+        None, "--plan", help="Apply a plan written by migrate:plan."
+    ),
+    output_format: OutputFormat = format_option(),
+):
     """Run migrations up to specified version."""
     hp = get_houseplant()
-    hp.migrate(version)
+    with structured_output(hp, output_format):
+        if plan:
+            hp.apply_plan(plan)
+        else:
+            hp.migrate(version)
+
+
+@app.command(name="migrate:plan")
+def migrate_plan(
+    output: Optional[Path] = typer.Option(
+        None, "--output", "-o", help="Write the plan to this file."
+    ),
+):
+    """Estimate the cost of pending migrations."""
+    hp = get_houseplant()
+    hp.migrate_plan(output)
 
 
 @app.command(name="migrate:up")
-def migrate_up(version: Optional[str] = typer.Argument(None)):
+def migrate_up(
+    version: Optional[str] = typer.Argument(None),
+    output_format: OutputFormat = format_option(),
+):
     """Run migrations up to specified version."""
     hp = get_houseplant()
     version = version or os.getenv("VERSION")
-    hp.migrate_up(version)
+    with structured_output(hp, output_format):
+        hp.migrate_up(version)
 
 
 @app.command(name="migrate:down")
-def migrate_down(version: Optional[str] = typer.Argument(None)):
+def migrate_down(
+    version: Optional[str] = typer.Argument(None),
+    step: Optional[str] = typer.Option(
+        None, "--step", "-s", help="Number of migrations to roll back."
+    ),
+    output_format: OutputFormat = format_option(),
+):
     """Roll back migrations to specified version."""
     hp = get_houseplant()
     version = version or os.getenv("VERSION")
-    hp.migrate_down(version)
+    step = step or os.getenv("STEP")
+    # Accept STEP=n as the argument, like VERSION=...
+    if version and version.startswith("STEP="):
+        version, step = None, version
+    with structured_output(hp, output_format):
+        hp.migrate_down(version, step)
+
+
+@app.command(name="migrate:check")
+def migrate_check():
+    """Validate all pending migrations without applying them."""
+    hp = get_houseplant()
+    if not hp.migrate_check():
+        raise typer.Exit(1)
+
+
+@app.command(name="migrate:squash")
+def migrate_squash(before: Optional[str] = typer.Argument(None)):
+    """Squash migrations up to specified version into a baseline."""
+    hp = get_houseplant()
+    before = before or os.getenv("BEFORE")
+    hp.migrate_squash(before)
 
 
 @app.command(name="db:schema:load")
-def db_schema_load():
+def db_schema_load(
+    bootstrap: bool = typer.Option(
+        False,
+        "--bootstrap",
+        help="Create the objects in ch/schema.sql before loading migrations.",
+    ),
+):
     """Load the schema migrations from migrations directory."""
     hp = get_houseplant()
-    hp.db_schema_load()
+    hp.db_schema_load(bootstrap=bootstrap)
+
+
+@app.command(name="schema:diff")
+def schema_diff():
+    """Compare the database schema with ch/schema.sql."""
+    hp = get_houseplant()
+    if any(hp.schema_diff().values()):
+        raise typer.Exit(1)
+
+
+@app.command(name="schema:fingerprint")
+def schema_fingerprint(
+    databases: Optional[list[str]] = typer.Argument(
+        None, help="Databases to check, '*' matches any characters."
+    ),
+):
+    """Compare the schema of many databases on every host with ch/schema.sql."""
+    hp = get_houseplant()
+    result = hp.schema_fingerprint(databases)
+    if any(target_drifted(target) for target in result["targets"]):
+        raise typer.Exit(1)
+
+
+@app.command(name="serve")
+def serve(
+    socket: Optional[Path] = typer.Option(
+        None,
+        "--socket",
+        help="Unix socket to listen on (default: ch/.houseplant.sock).",
+    ),
+):
+    """Answer commands from houseplant-remote over a Unix socket."""
+    hp = get_houseplant()
+    serve_commands(hp, socket)
 
 
 @app.command(hidden=True)
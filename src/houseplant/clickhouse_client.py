@@ -1,11 +1,95 @@
 """ClickHouse database operations module."""
 
+import copy
 import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
 
 from clickhouse_driver import Client
-from clickhouse_driver.errors import NetworkError, ServerException
+from clickhouse_driver.errors import (
+    NetworkError,
+    ServerException,
+    UnknownCompressionMethod,
+)
 from rich.console import Console
 
+from .lock import LOCK_TABLE
+from .retry import RetryPolicy
+from .sql import iter_statements, like_pattern
+from .throttle import Throttle
+from .transport import HttpClient
+from .utils import project_env
+
+TRANSPORTS = ("native", "http")
+
+# Default (plain, secure) ports of each transport
+DEFAULT_PORTS = {"native": (9000, 9440), "http": (8123, 8443)}
+
+# NO_SUCH_COLUMN_IN_TABLE and UNKNOWN_IDENTIFIER
+MISSING_COLUMN_CODES = (16, 47)
+
+# Tables houseplant keeps for itself, never part of the schema
+INTERNAL_TABLES = f"('schema_migrations', '{LOCK_TABLE}')"
+
+
+# Normalizes create_table_query like sql.normalize_create, then hashes it
+SCHEMA_OBJECTS_QUERY = rf"""
+    SELECT
+        database,
+        name,
+        multiIf(
+            engine = 'MaterializedView', 'materialized_views',
+            engine = 'Dictionary', 'dictionaries',
+            'tables'
+        ) AS category,
+        lower(hex(SHA256(trimBoth(replaceRegexpAll(
+            replaceRegexpAll(
+                replaceAll(
+                    replaceAll(create_table_query, concat('`', database, '`.'), ''),
+                    concat(database, '.'),
+                    ''
+                ),
+                '\\s+',
+                ' '
+            ),
+            ' ?([(),]) ?',
+            '\\1'
+        ))))) AS digest
+    FROM system.tables
+    WHERE {{where}}
+        AND (
+            position('MergeTree' IN engine) > 0
+            OR engine IN ('MaterializedView', 'Dictionary')
+        )
+        AND NOT startsWith(name, '.inner')
+        AND name NOT IN {INTERNAL_TABLES}
+    ORDER BY database, name
+"""
+
+# Formats create_table_query the way SHOW CREATE does, in a single query
+CREATE_STATEMENTS_QUERY = f"""
+    SELECT
+        name,
+        multiIf(
+            engine = 'MaterializedView', 'materialized_views',
+            engine = 'Dictionary', 'dictionaries',
+            'tables'
+        ) AS category,
+        {{statement}}
+    FROM system.tables
+    WHERE database = currentDatabase()
+        AND (
+            position('MergeTree' IN engine) > 0
+            OR engine IN ('MaterializedView', 'Dictionary')
+        )
+        AND NOT startsWith(name, '.inner')
+        AND name NOT IN {INTERNAL_TABLES}
+    ORDER BY name
+"""
+
+# formatQuery only exists since ClickHouse 23.10
+UNKNOWN_FUNCTION = 46
+
 
 class RichFormattedError:
     """Mixin for exceptions that use Rich formatting."""
@@ -41,41 +125,239 @@ class ClickHouseDatabaseNotFoundError(RichFormattedError, Exception):
 
 class ClickHouseClient:
     def __init__(
-        self, host=None, port=None, database=None, user=None, password=None, secure=None
+        self,
+        host=None,
+        port=None,
+        database=None,
+        user=None,
+        password=None,
+        secure=None,
+        root=None,
     ):
-        self.host = host or os.getenv("CLICKHOUSE_HOST", "localhost")
+        # Settings not given as arguments are read from the environment, and
+        # from the .env file of the project at ``root`` if there is one
+        self.root = root
+        self._env = None
+
+        self.transport = self._getenv("CLICKHOUSE_TRANSPORT", "native").lower()
+        if self.transport not in TRANSPORTS:
+            raise ValueError(
+                f"Unknown CLICKHOUSE_TRANSPORT '{self.transport}', "
+                f"expected one of: {', '.join(TRANSPORTS)}"
+            )
+        default_port, secure_port = DEFAULT_PORTS[self.transport]
+
+        # The first host is the primary, the others are replicas to fail over to
+        hosts = host or self._getenv("CLICKHOUSE_HOST", "localhost")
+        hosts = [entry.strip() for entry in hosts.split(",") if entry.strip()]
+        self.host = hosts[0]
         # Parse port from host:port string if present, otherwise use port parameter or default
         if ":" in self.host:
             self.host, port_str = self.host.split(":")
             self.port = int(port_str)
         else:
-            self.port = int(port or os.getenv("CLICKHOUSE_PORT", 9000))
+            self.port = int(port or self._getenv("CLICKHOUSE_PORT", default_port))
 
-        self.database = database or os.getenv("CLICKHOUSE_DB", "development")
+        self.database = database or self._getenv("CLICKHOUSE_DB", "development")
 
-        self.user = user or os.getenv("CLICKHOUSE_USER", "default")
-        self.password = password or os.getenv("CLICKHOUSE_PASSWORD", "")
+        self.user = user or self._getenv("CLICKHOUSE_USER", "default")
+        self.password = password or self._getenv("CLICKHOUSE_PASSWORD", "")
 
         # Use SSL port by default if secure
-        self.secure = secure or os.getenv("CLICKHOUSE_SECURE", "n").lower()
+        self.secure = secure or self._getenv("CLICKHOUSE_SECURE", "n").lower()
         self.secure = self.secure in ("true", "t", "yes", "y", "1")
-        self.port = 9440 if self.secure else self.port
+        self.port = secure_port if self.secure else self.port
+
+        self.hosts = [(self.host, self.port)]
+        for entry in hosts[1:]:
+            alt_host, _, alt_port = entry.partition(":")
+            self.hosts.append((alt_host, int(alt_port or self.port)))
 
         # Disable verification unless specified otherwise
-        self.verify = os.getenv("CLICKHOUSE_VERIFY", "n").lower()
+        self.verify = self._getenv("CLICKHOUSE_VERIFY", "n").lower()
         self.verify = self.verify in ("true", "t", "yes", "y", "1")
 
-        self.client = Client(
-            host=self.host,
-            port=self.port,
+        self.pool_size = int(self._getenv("HOUSEPLANT_POOL_SIZE", 4))
+
+        # Pause between statements while the server is busy
+        throttle = self._getenv("HOUSEPLANT_THROTTLE", "n").lower()
+        self.throttle = (
+            Throttle(env=self._environ())
+            if throttle in ("true", "t", "yes", "y", "1")
+            else None
+        )
+
+        # Retry transient failures of statements that are safe to run twice
+        self.retry = RetryPolicy(env=self._environ())
+
+        # Migration lock whose lease must still be held before each statement
+        self.lock = None
+
+        self.client = self._connect()
+
+        self._cluster = None
+        self._reader = None
+        self._written = False
+
+    def _environ(self):
+        """Return the process environment, or the project's with a root."""
+        if self.root is None:
+            return os.environ
+        if self._env is None:
+            self._env = project_env(self.root)
+        return self._env
+
+    def _getenv(self, name, default=None):
+        return self._environ().get(name, default)
+
+    def _connect(self, hosts=None, compression=False):
+        """Connect to the first of ``hosts``, failing over to the others.
+
+        With ``compression`` native connections compress the blocks they send
+        with LZ4. HTTP connections always compress large request bodies.
+        """
+        (host, port), *alternates = hosts or self.hosts
+        alt_hosts = ",".join(
+            f"{alt_host}:{alt_port}" for alt_host, alt_port in alternates
+        )
+
+        if self.transport == "http":
+            return HttpClient(
+                host=host,
+                port=port,
+                database=self.database,
+                user=self.user,
+                password=self.password,
+                secure=self.secure,
+                verify=self.verify,
+                pool_size=self.pool_size,
+                alt_hosts=alt_hosts or None,
+            )
+        return Client(
+            host=host,
+            port=port,
             database=self.database,
             user=self.user,
             password=self.password,
             secure=self.secure,
             verify=self.verify,
+            alt_hosts=alt_hosts or None,
+            compression=compression,
         )
 
-        self._cluster = None
+    def clone(self):
+        """Return a client with the same settings over a new connection."""
+        other = copy.copy(self)
+        other.client = self._connect()
+        other._reader = None
+        return other
+
+    @property
+    def reader(self):
+        """Connection used for read-only introspection.
+
+        With several hosts configured, reads go to the least loaded healthy
+        replica so a busy primary doesn't slow down ``migrate:status``. Once
+        this client has written anything, reads stay on the primary so they
+        always see their own writes.
+        """
+        if self._written or len(self.hosts) == 1:
+            return self.client
+        if self._reader is None:
+            self._reader = self._least_loaded_replica()
+        return self._reader
+
+    def _least_loaded_replica(self):
+        """Connect to the replica running the fewest queries and merges."""
+        loads = []
+        for host in self.hosts:
+            client = self.client if host == self.hosts[0] else self._connect([host])
+            try:
+                load = client.execute("""
+                    SELECT toFloat64(sum(value))
+                    FROM system.metrics
+                    WHERE metric IN ('Query', 'Merge', 'PartMutation')
+                """)[0][0]
+            except (NetworkError, ServerException, OSError, EOFError):
+                if client is not self.client:
+                    client.disconnect()
+                continue
+            loads.append((load, host, client))
+
+        if not loads:
+            return self.client
+
+        loads.sort(key=lambda entry: entry[0])
+        for _, _, client in loads[1:]:
+            if client is not self.client:
+                client.disconnect()
+        return loads[0][2]
+
+    def mark_written(self):
+        """Route subsequent reads to the primary."""
+        if self._reader is not None and self._reader is not self.client:
+            self._reader.disconnect()
+        self._reader = None
+        self._written = True
+
+    def map_parallel(self, func, items, workers=None):
+        """Call ``func(client, item)`` for every item over a pool of connections.
+
+        Connections are not thread-safe, so each worker borrows its own
+        client from the pool. Results are returned in the order of ``items``.
+        """
+        items = list(items)
+        workers = min(workers or self.pool_size, len(items))
+        if workers <= 1:
+            return [func(self, item) for item in items]
+
+        pool = queue.Queue()
+        clients = [self.clone() for _ in range(workers)]
+        for client in clients:
+            pool.put(client)
+
+        def run(item):
+            client = pool.get()
+            try:
+                return func(client, item)
+            finally:
+                pool.put(client)
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(run, items))
+        finally:
+            for client in clients:
+                client.client.disconnect()
+
+    def map_hosts(self, func):
+        """Call ``func(client)`` with a client for each host, concurrently.
+
+        Returns ``{"host:port": result}`` in the order of the hosts. A host
+        that can't be reached maps to the exception raised for it.
+        """
+
+        def run(host):
+            client = copy.copy(self)
+            client.hosts = [host]
+            client._reader = None
+            try:
+                client.client = self._connect([host])
+                return func(client)
+            except (NetworkError, ServerException, OSError, EOFError) as e:
+                return e
+            finally:
+                if client.client is not self.client:
+                    client.client.disconnect()
+
+        with ThreadPoolExecutor(
+            max_workers=min(self.pool_size, len(self.hosts))
+        ) as executor:
+            results = list(executor.map(run, self.hosts))
+        return {
+            f"{host}:{port}": result
+            for (host, port), result in zip(self.hosts, results)
+        }
 
     def _check_clickhouse_connection(self):
         """Check connection to ClickHouse and raise appropriate errors."""
@@ -88,7 +370,7 @@ class ClickHouseClient:
         except ServerException as e:
             if "Authentication failed" in str(e):
                 raise ClickHouseAuthenticationError(
-                    f"Authentication failed for user {os.getenv('CLICKHOUSE_USER', 'default')}"
+                    f"Authentication failed for user {self.user}"
                 )
             elif "Database" in str(e) and "does not exist" in str(e):
                 raise ClickHouseDatabaseNotFoundError(self.database)
@@ -98,7 +380,7 @@ class ClickHouseClient:
     @property
     def cluster(self):
         if self._cluster is None:
-            self._cluster = os.getenv("CLICKHOUSE_CLUSTER")
+            self._cluster = self._getenv("CLICKHOUSE_CLUSTER")
         return self._cluster
 
     @cluster.setter
@@ -111,6 +393,7 @@ class ClickHouseClient:
             CREATE TABLE IF NOT EXISTS schema_migrations {cluster} (
                 version LowCardinality(String),
                 active UInt8 NOT NULL DEFAULT 1,
+                checksum String NOT NULL DEFAULT '',
                 created_at DateTime64(6, 'UTC') NOT NULL DEFAULT now64()
             )
             ENGINE = {engine}
@@ -128,8 +411,37 @@ class ClickHouseClient:
         return table_definition.format(cluster=cluster_clause, engine=engine)
 
     def init_migrations_table(self):
+        self.mark_written()
         self.client.execute(self.init_migrations_table_query())
 
+    def upgrade_migrations_table(self):
+        """Add the columns of newer versions to an existing schema_migrations."""
+        self.mark_written()
+        cluster_clause = "ON CLUSTER '{cluster}'" if self.cluster is not None else ""
+        self.client.execute(f"""
+            ALTER TABLE schema_migrations {cluster_clause}
+            ADD COLUMN IF NOT EXISTS checksum String NOT NULL DEFAULT '' AFTER active
+        """)
+
+    def _upgrading(self, func, *args, **kwargs):
+        """Call ``func``, upgrading schema_migrations if a column is missing.
+
+        Tables created by older versions have no ``checksum`` column, so the
+        first query that uses it fails and is run again after the upgrade.
+        """
+        try:
+            return func(*args, **kwargs)
+        except ServerException as e:
+            if not self._missing_checksum(e):
+                raise
+        self.upgrade_migrations_table()
+        return func(*args, **kwargs)
+
+    @staticmethod
+    def _missing_checksum(error: ServerException) -> bool:
+        """Return whether ``error`` is about the checksum column of older tables."""
+        return error.code in MISSING_COLUMN_CODES and "checksum" in error.message
+
     def get_database_schema(self):
         """Get the database schema organized by object type and sorted by migration date."""
         # Get all applied migrations in order
@@ -151,19 +463,19 @@ class ClickHouseClient:
 
         for table in tables:
             table_name = table[0]
-            create_stmt = self.client.execute(f"SHOW CREATE TABLE {table_name}")[0][0]
+            create_stmt = self.reader.execute(f"SHOW CREATE TABLE {table_name}")[0][0]
             schema["tables"].append(create_stmt)
 
         for materialized_view in materialized_views:
             materialized_view_name = materialized_view[0]
-            create_stmt = self.client.execute(
+            create_stmt = self.reader.execute(
                 f"SHOW CREATE MATERIALIZED VIEW {materialized_view_name}"
             )[0][0]
             schema["materialized_views"].append(create_stmt)
 
         for dictionary in dictionaries:
             dictionary_name = dictionary[0]
-            create_stmt = self.client.execute(
+            create_stmt = self.reader.execute(
                 f"SHOW CREATE DICTIONARY {dictionary_name}"
             )[0][0]
             schema["dictionaries"].append(create_stmt)
@@ -177,7 +489,7 @@ class ClickHouseClient:
     def get_latest_migration(self):
         """Get the latest migration version."""
         # First check if the table exists
-        table_exists = self.client.execute("""
+        table_exists = self.reader.execute("""
             SELECT name
             FROM system.tables
             WHERE database = currentDatabase()
@@ -187,83 +499,399 @@ class ClickHouseClient:
         if not table_exists:
             return None
 
-        result = self.client.execute("""
+        result = self.reader.execute("""
             SELECT MAX(version) FROM schema_migrations WHERE active = 1
         """)
         return result[0][0] if result else None
 
     def get_database_tables(self):
         """Get the database tables with their engines, indexes and partitioning."""
-        return self.client.execute("""
+        return self.reader.execute(f"""
             SELECT
                 name
             FROM system.tables
             WHERE database = currentDatabase()
                 AND position('MergeTree' IN engine) > 0
                 AND engine NOT IN ('MaterializedView', 'Dictionary')
-                AND name != 'schema_migrations'
+                AND name NOT IN {INTERNAL_TABLES}
             ORDER BY name
         """)
 
     def get_database_materialized_views(self):
         """Get the database materialized views."""
-        return self.client.execute("""
+        return self.reader.execute(f"""
             SELECT
                 name
             FROM system.tables
             WHERE database = currentDatabase()
                 AND engine = 'MaterializedView'
-                AND name != 'schema_migrations'
+                AND name NOT IN {INTERNAL_TABLES}
             ORDER BY name
         """)
 
     def get_database_dictionaries(self):
         """Get the database dictionaries."""
-        return self.client.execute("""
+        return self.reader.execute(f"""
             SELECT
                 name
             FROM system.tables
             WHERE database = currentDatabase()
                 AND engine = 'Dictionary'
-                AND name != 'schema_migrations'
+                AND name NOT IN {INTERNAL_TABLES}
             ORDER BY name
         """)
 
+    def get_schema_hashes(self, database: str | None = None):
+        """Hash the CREATE statement of every schema object on the server.
+
+        Statements are normalized like ``sql.normalize_create`` before they
+        are hashed, so only names and hashes are transferred. Returns
+        ``{name: (category, hash)}`` with the categories of ch/schema.sql.
+        """
+        if database is None:
+            query = SCHEMA_OBJECTS_QUERY.format(where="database = currentDatabase()")
+            rows = self.reader.execute(query)
+        else:
+            query = SCHEMA_OBJECTS_QUERY.format(where="database = %(database)s")
+            rows = self.reader.execute(query, {"database": database})
+        return {name: (category, digest) for _, name, category, digest in rows}
+
+    def get_schema_fingerprints(self, databases):
+        """Fingerprint the schema of every database matching ``databases``.
+
+        ``databases`` are names that may contain ``*`` wildcards. Objects are
+        hashed and the hashes are combined on the server, like
+        ``sql.schema_fingerprint``, so one digest per database is returned.
+        """
+        objects = SCHEMA_OBJECTS_QUERY.format(
+            where="arrayExists(pattern -> database LIKE pattern, %(patterns)s)"
+        )
+        rows = self.reader.execute(
+            rf"""
+            SELECT
+                database,
+                lower(hex(SHA256(arrayStringConcat(
+                    arraySort(groupArray(concat(name, ' ', digest))),
+                    '\n'
+                ))))
+            FROM ({objects})
+            GROUP BY database
+            ORDER BY database
+            """,
+            {"patterns": [like_pattern(database) for database in databases]},
+        )
+        return dict(rows)
+
+    def get_create_statement(
+        self, name: str, category: str = "tables", database: str | None = None
+    ):
+        """Get the CREATE statement of a table, materialized view or dictionary."""
+        kind = {
+            "tables": "TABLE",
+            "materialized_views": "VIEW",
+            "dictionaries": "DICTIONARY",
+        }[category]
+        if database:
+            name = f"{database}.{name}"
+        return self.reader.execute(f"SHOW CREATE {kind} {name}")[0][0]
+
+    def get_create_statements(self):
+        """Get ``{name: (category, statement)}`` of every schema object.
+
+        The statements are formatted on the server like ``SHOW CREATE`` and
+        read in one query. Servers without ``formatQuery`` fall back to one
+        ``SHOW CREATE`` per object.
+        """
+        try:
+            rows = self.reader.execute(
+                CREATE_STATEMENTS_QUERY.format(
+                    statement="formatQuery(create_table_query)"
+                )
+            )
+        except ServerException as e:
+            if e.code != UNKNOWN_FUNCTION:
+                raise
+            rows = [
+                (name, category, self.get_create_statement(name, category))
+                for name, category, _ in self.reader.execute(
+                    CREATE_STATEMENTS_QUERY.format(statement="''")
+                )
+            ]
+        return {name: (category, statement) for name, category, statement in rows}
+
+    def explain_ast(self, statement: str):
+        """Parse a statement on the server without running it.
+
+        Returns None if the statement is valid, otherwise the error message.
+        """
+        try:
+            self.reader.execute(f"EXPLAIN AST {statement}")
+        except ServerException as e:
+            return e.message.strip().splitlines()[0]
+        return None
+
+    def explain_estimate(self, query: str):
+        """Estimate the rows a SELECT reads, per table, without running it."""
+        return self.reader.execute(f"EXPLAIN ESTIMATE {query}")
+
+    def get_table_sizes(self, tables):
+        """Get the active rows and bytes on disk of the given tables."""
+        if not tables:
+            return {}
+
+        rows = self.reader.execute(
+            """
+            SELECT table, sum(rows), sum(bytes_on_disk)
+            FROM system.parts
+            WHERE database = currentDatabase()
+                AND active
+                AND table IN %(tables)s
+            GROUP BY table
+            """,
+            {"tables": tuple(tables)},
+        )
+        return {
+            table: (total_rows, total_bytes) for table, total_rows, total_bytes in rows
+        }
+
+    def get_free_disk_space(self):
+        """Get the free space of the roomiest disk of every replica."""
+        source = (
+            f"clusterAllReplicas('{self.cluster}', system.disks)"
+            if self.cluster is not None
+            else "system.disks"
+        )
+        return dict(
+            self.client.execute(f"""
+                SELECT hostName(), max(free_space)
+                FROM {source}
+                GROUP BY hostName()
+            """)
+        )
+
     def get_applied_migrations(self):
         """Get list of applied migrations."""
-        return self.client.execute("""
+        return self.reader.execute("""
             SELECT version
             FROM schema_migrations FINAL
             WHERE active = 1
             ORDER BY version
         """)
 
+    def get_migration_diff(
+        self, versions, checksums: dict | None = None, replica: bool = False
+    ):
+        """Compare local migration versions with the applied ones.
+
+        The local versions and the ``checksums`` of their files are sent to
+        the server as an external table, so only the differences travel back
+        instead of the whole history. Returns ``(pending, missing, changed)``:
+        local versions that are not applied, applied versions without a local
+        file and applied versions whose file changed since, all sorted.
+        Versions applied without a checksum are never reported as changed.
+
+        The result decides which migrations run, so it is read from the
+        primary: a lagging replica would report applied versions as pending.
+        Pass ``replica=True`` to read from :attr:`reader` for reporting only.
+        """
+        checksums = checksums or {}
+        execute = (self.reader if replica else self.client).execute
+        query = """
+            SELECT version, 'pending'
+            FROM local_migrations
+            WHERE version NOT IN (
+                SELECT version FROM schema_migrations FINAL WHERE active = 1
+            )
+            UNION ALL
+            SELECT version, 'missing'
+            FROM schema_migrations FINAL
+            WHERE active = 1
+                AND version NOT IN (SELECT version FROM local_migrations)
+        """
+        changed_query = """
+            UNION ALL
+            SELECT version, 'changed'
+            FROM local_migrations
+            WHERE checksum != ''
+                AND version IN (
+                    SELECT version
+                    FROM schema_migrations FINAL
+                    WHERE active = 1 AND checksum != ''
+                )
+                AND (version, checksum) NOT IN (
+                    SELECT version, checksum
+                    FROM schema_migrations FINAL
+                    WHERE active = 1
+                )
+        """
+        external_tables = [
+            {
+                "name": "local_migrations",
+                "structure": [("version", "String"), ("checksum", "String")],
+                "data": [
+                    {"version": version, "checksum": checksums.get(version, "")}
+                    for version in versions
+                ],
+            }
+        ]
+        try:
+            rows = execute(query + changed_query, external_tables=external_tables)
+        except ServerException as e:
+            if not self._missing_checksum(e):
+                raise
+            # Tables of older versions have no checksums to compare until the
+            # next write upgrades them, so reading never changes the table
+            rows = execute(query, external_tables=external_tables)
+        pending = sorted(version for version, kind in rows if kind == "pending")
+        missing = sorted(version for version, kind in rows if kind == "missing")
+        changed = sorted(version for version, kind in rows if kind == "changed")
+        return pending, missing, changed
+
+    def get_table_columns(self, table: str) -> dict:
+        """Return the ``{name: type}`` of the columns an INSERT can write."""
+        database, _, name = table.rpartition(".")
+        return dict(
+            self.client.execute(
+                """
+                SELECT name, type
+                FROM system.columns
+                WHERE database = if(%(database)s = '', currentDatabase(), %(database)s)
+                    AND table = %(table)s
+                    AND default_kind NOT IN ('MATERIALIZED', 'ALIAS')
+                ORDER BY position
+                """,
+                {"database": database.strip("`"), "table": name.strip("`")},
+            )
+        )
+
+    def _insert_client(self):
+        """Return a connection that compresses the data it inserts."""
+        if self.transport == "http":
+            return self.client
+        try:
+            return self._connect(compression=True)
+        except UnknownCompressionMethod:
+            Console(stderr=True).print(
+                "[yellow]⚠[/yellow] Inserting uncompressed, install "
+                "'houseplant[seed]' for LZ4 compression"
+            )
+            return self.client
+
+    def insert_blocks(self, table: str, blocks, query_settings: dict = None) -> int:
+        """Insert ``(names, columns)`` blocks into ``table``, one INSERT each.
+
+        Blocks are sent in columnar form over a compressed connection, so an
+        iterator of blocks streams any amount of data with flat memory.
+        Returns the number of rows inserted.
+        """
+        self.mark_written()
+        client = self._insert_client()
+        rows = 0
+        try:
+            for names, columns in blocks:
+                if not columns or not columns[0]:
+                    continue
+                if self.lock is not None:
+                    self.lock.check()
+                client.execute(
+                    f"INSERT INTO {table} "
+                    f"({', '.join(f'`{name}`' for name in names)}) VALUES",
+                    columns,
+                    settings=query_settings,
+                    columnar=True,
+                )
+                rows += len(columns[0])
+        finally:
+            if client is not self.client:
+                client.disconnect()
+        return rows
+
     def execute_migration(self, sql: str, query_settings: dict = None):
         """Execute a migration SQL statement."""
         # Split multiple statements and execute them separately
-        statements = [stmt.strip() for stmt in sql.split(";") if stmt.strip()]
+        self.execute_statements(iter_statements([sql]), query_settings)
+
+    def execute_statements(self, statements, query_settings: dict = None):
+        """Execute already split migration statements in order."""
+        self.mark_written()
         for statement in statements:
-            self.client.execute(statement, settings=query_settings)
+            if self.lock is not None:
+                self.lock.check()
+            if self.throttle is not None:
+                self.throttle.wait(self)
+            self.retry.run(self.client, statement, settings=query_settings)
+
+    def mark_migration_applied(self, version: str, checksum: str = ""):
+        """Mark a migration as applied, with the checksum of its file."""
+        self.mark_written()
+        # Inserting a version twice is harmless, schema_migrations keeps one row
+        self._upgrading(
+            self.retry.run,
+            self.client,
+            """
+            INSERT INTO schema_migrations (version, active, checksum)
+            VALUES (%(version)s, 1, %(checksum)s)
+            """,
+            {"version": version, "checksum": checksum},
+            idempotent=True,
+        )
 
-    def mark_migration_applied(self, version: str):
-        """Mark a migration as applied."""
-        self.client.execute(
+        self.retry.run(
+            self.client,
             """
-            INSERT INTO schema_migrations (version, active)
-            VALUES (%(version)s, 1)
+            OPTIMIZE TABLE schema_migrations FINAL
             """,
-            {"version": version},
         )
 
-        self.client.execute(
+    def mark_migrations_applied(
+        self, versions: list[str], checksums: dict | None = None
+    ):
+        """Mark several migrations as applied with a single insert."""
+        self.mark_written()
+        if not versions:
+            return
+
+        checksums = checksums or {}
+        self._upgrading(
+            self.retry.run,
+            self.client,
+            "INSERT INTO schema_migrations (version, active, checksum) VALUES",
+            [(version, 1, checksums.get(version, "")) for version in versions],
+            idempotent=True,
+        )
+
+        self.retry.run(
+            self.client,
             """
             OPTIMIZE TABLE schema_migrations FINAL
+            """,
+        )
+
+    def mark_migrations_rolled_back(self, versions: list[str]):
+        """Mark several migrations as rolled back with a single insert."""
+        self.mark_written()
+        if not versions:
+            return
+
+        self.retry.run(
+            self.client,
+            "INSERT INTO schema_migrations (version, active) VALUES",
+            [(version, 0) for version in versions],
+            idempotent=True,
+        )
+
+        self.retry.run(
+            self.client,
             """
+            OPTIMIZE TABLE schema_migrations FINAL
+            """,
         )
 
     def mark_migration_rolled_back(self, version: str):
         """Mark a migration as rolled back."""
-        self.client.execute(
+        self.mark_written()
+        self.retry.run(
+            self.client,
             """
             INSERT INTO schema_migrations (version, active, created_at)
             VALUES (
@@ -273,10 +901,12 @@ class ClickHouseClient:
             )
             """,
             {"version": version},
+            idempotent=True,
         )
 
-        self.client.execute(
+        self.retry.run(
+            self.client,
             """
             OPTIMIZE TABLE schema_migrations FINAL
-            """
+            """,
         )
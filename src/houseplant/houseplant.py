@@ -1,25 +1,447 @@
 """Main module."""
 
+import difflib
+import functools
+import json
 import os
+from collections.abc import Mapping
 from datetime import datetime
+from types import MappingProxyType
 
 import yaml
+from clickhouse_driver.errors import ServerException
 from rich.console import Console
 from rich.table import Table
 
 from .clickhouse_client import ClickHouseClient
-from .utils import MIGRATIONS_DIR, get_migration_files
+from .lock import LockLost, LockNotAcquired, MigrationLock
+from .seed import DEFAULT_BLOCK_SIZE, SeedError, read_blocks, seed_format
+from .sql import (
+    SCHEMA_SECTIONS,
+    alter_scope,
+    changed_objects,
+    dependency_order,
+    iter_statements,
+    normalize_create,
+    parse_create,
+    parse_schema,
+    read_statements,
+    requalify,
+    rewritten_table,
+    schema_fingerprint,
+    schema_hash,
+    select_query,
+)
+from .utils import (
+    MIGRATIONS_DIR,
+    SCHEMA_FILE,
+    SETTINGS_FILE,
+    format_bytes,
+    get_migration_checksums,
+    get_migration_files,
+    project_env,
+)
+
+
+# Name of the migration written by migrate:squash
+SQUASHED_BASELINE = "squashed_baseline"
+
+
+class MigrationError(Exception):
+    """Raised when a migration file can't be rendered."""
+
+
+def target_drifted(target: dict) -> bool:
+    """Return whether a target of ``schema_fingerprint`` differs or failed."""
+    return "error" in target or any(
+        target.get(key) for key in ["missing", "extra", "changed"]
+    )
+
+
+def read_only(value):
+    """Return a parsed YAML value with its mappings and lists made read-only."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: read_only(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(read_only(item) for item in value)
+    return value
+
+
+def locked(method):
+    """Run a command that changes migrations while holding the migration lock.
+
+    Without a lock, or when the lock is already held by an outer command,
+    the command runs as is.
+    """
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.lock is None or self.lock.held:
+            return method(self, *args, **kwargs)
+
+        try:
+            self.lock.acquire()
+        except LockNotAcquired as e:
+            if self.lock.policy == "skip":
+                self.console.print(
+                    f"[yellow]⚠[/yellow] Skipping, migrations are running in {e.holder}"
+                )
+                return None
+            self.console.print(f"[red]✗[/red] {e}")
+            raise SystemExit(1)
+
+        try:
+            return method(self, *args, **kwargs)
+        except LockLost as e:
+            self.console.print(f"[red]✗[/red] {e}, stopping")
+            raise SystemExit(1)
+        finally:
+            self.lock.release()
+
+    return wrapper
 
 
 class Houseplant:
-    def __init__(self):
+    def __init__(self, db: ClickHouseClient | None = None, root=None):
+        """Manage the migrations of the project at ``root``.
+
+        Project files are resolved against ``root``, the working directory by
+        default, so instances for several projects can run side by side in
+        one process. With a ``root``, settings missing from the environment
+        are read from its .env file.
+        """
+        self.root = os.path.abspath(root or os.getcwd())
+        env = project_env(root and self.root)
         self.console = Console()
-        self.db = ClickHouseClient()
-        self.env = os.getenv("HOUSEPLANT_ENV", "development")
+        self.db = db or ClickHouseClient(root=root and self.root)
+        self.env = env.get("HOUSEPLANT_ENV", "development")
+        self.disk_check = env.get("HOUSEPLANT_DISK_CHECK", "warn").lower()
+        self.checksum_check = env.get("HOUSEPLANT_CHECKSUM_CHECK", "warn").lower()
+        self.seed_block_size = int(
+            env.get("HOUSEPLANT_SEED_BLOCK_SIZE", DEFAULT_BLOCK_SIZE)
+        )
+        lock_engine = env.get("HOUSEPLANT_LOCK", "off").lower()
+        self.lock = (
+            MigrationLock(
+                self.db,
+                engine=lock_engine,
+                policy=env.get("HOUSEPLANT_LOCK_POLICY", "fail").lower(),
+                lease=env.get("HOUSEPLANT_LOCK_LEASE"),
+                timeout=env.get("HOUSEPLANT_LOCK_TIMEOUT"),
+            )
+            if lock_engine != "off"
+            else None
+        )
+        # Called with a dict for each migration a command reports on
+        self.on_record = None
+        # Parsed migrations by path, only kept by long-running processes
+        self._migration_cache = None
+
+    def _path(self, *parts) -> str:
+        return os.path.join(self.root, *parts)
+
+    def _record(self, **record):
+        if self.on_record is not None:
+            self.on_record(record)
+
+    def _load_migration(self, migration_file: str) -> Mapping:
+        """Load a read-only migration file from the migrations directory.
+
+        With the migration cache enabled, parsed files are kept until they
+        are modified, so a long-running process only parses each migration
+        once.
+        """
+        path = self._path(MIGRATIONS_DIR, migration_file)
+        if self._migration_cache is None:
+            with open(path, "r") as f:
+                return read_only(yaml.safe_load(f))
+
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._migration_cache.get(path)
+        if cached is None or cached[0] != version:
+            with open(path, "r") as f:
+                cached = (version, read_only(yaml.safe_load(f)))
+            self._migration_cache[path] = cached
+        return cached[1]
+
+    def _migration_checksums(self, migration_files: list[str]) -> dict:
+        """Return the checksums of migration files, keyed by version.
+
+        Squashed baselines are rewritten on purpose, so they have none.
+        """
+        if self.checksum_check == "off":
+            return {}
+        return get_migration_checksums(
+            [f for f in migration_files if not f.endswith(f"_{SQUASHED_BASELINE}.yml")],
+            self.root,
+        )
+
+    def _migration_diff(self, versions: list[str]):
+        """Compare local versions with the applied ones on the server.
+
+        Applied migrations whose file changed since are reported depending on
+        ``HOUSEPLANT_CHECKSUM_CHECK``. Returns ``(pending, missing)``.
+        """
+        local = set(versions)
+        migration_files = [
+            f for f in get_migration_files(self.root) if f.split("_")[0] in local
+        ]
+        pending, missing, changed = self.db.get_migration_diff(
+            versions, self._migration_checksums(migration_files)
+        )
+        if changed:
+            changed = set(changed)
+            self._report_changed_migrations(
+                [f for f in migration_files if f.split("_")[0] in changed]
+            )
+        return pending, missing
+
+    def _report_changed_migrations(self, migration_files: list[str]):
+        """Warn about, or refuse, applied migrations that were edited."""
+        message = "changed after they were applied: " + ", ".join(migration_files)
+        if self.checksum_check == "error":
+            self.console.print(f"[red]✗[/red] Migrations {message}")
+            raise SystemExit(1)
+        self.console.print(f"[yellow]⚠[/yellow] Migrations {message}")
+
+    def _pending_migration_files(self, migration_files: list[str]) -> list[str]:
+        """Return the migration files that are not applied to the database."""
+        pending, _ = self._migration_diff([f.split("_")[0] for f in migration_files])
+        pending = set(pending)
+        return [f for f in migration_files if f.split("_")[0] in pending]
+
+    def _applied_versions(self, versions: list[str]) -> set[str]:
+        """Return the applied versions, including those without a local file.
+
+        The server compares them with the local ``versions``, so only the
+        differences are transferred.
+        """
+        pending, missing = self._migration_diff(versions)
+        return (set(versions) - set(pending)) | set(missing)
+
+    def _check_disk_space(self, migration_file: str, statements) -> bool:
+        """Check that every replica has room for the parts a migration rewrites.
+
+        Mutations and OPTIMIZE need free disk about equal to the size of the
+        table they rewrite. Depending on ``HOUSEPLANT_DISK_CHECK`` a shortage
+        is reported as a warning (``warn``) or refuses the migration
+        (``error``). Returns False if the migration must not run.
+        """
+        if self.disk_check == "off":
+            return True
+
+        tables = {rewritten_table(statement) for statement in statements} - {None}
+        if not tables:
+            return True
+
+        sizes = self.db.get_table_sizes(sorted(tables))
+        required = sum(table_bytes for _, table_bytes in sizes.values())
+        if not required:
+            return True
+
+        short = {
+            host: free
+            for host, free in self.db.get_free_disk_space().items()
+            if free < required
+        }
+        if not short:
+            return True
+
+        message = (
+            f"{migration_file} rewrites about {format_bytes(required)} but "
+            + ", ".join(
+                f"{host} has {format_bytes(free)} free" for host, free in short.items()
+            )
+        )
+        if self.disk_check == "error":
+            self.console.print(
+                f"[red]✗[/red] Migration [bold red]refused[/bold red]: {message}"
+            )
+            return False
+
+        self.console.print(f"[yellow]⚠[/yellow] Low disk space: {message}")
+        return True
+
+    def _render_migration(self, migration: Mapping, direction: str = "up"):
+        """Render the SQL and query settings of a migration for the environment."""
+        table = (migration.get("table") or "").strip()
+        if not table:
+            raise MigrationError("'table' field is required in migration file")
+
+        table_definition = migration.get("table_definition", "").strip()
+        table_settings = migration.get("table_settings", "").strip()
+
+        format_args = {"table": table}
+        if table_definition and table_settings:
+            format_args.update(
+                {
+                    "table_definition": table_definition,
+                    "table_settings": table_settings,
+                }
+            )
+
+        sink_table = migration.get("sink_table", "").strip()
+        view_definition = migration.get("view_definition", "").strip()
+        view_query = migration.get("view_query", "").strip()
+        if sink_table and view_definition and view_query:
+            format_args.update(
+                {
+                    "sink_table": sink_table,
+                    "view_definition": view_definition,
+                    "view_query": view_query,
+                }
+            )
+
+        # Get migration SQL based on environment
+        migration_env: Mapping = migration.get(self.env) or {}
+        try:
+            migration_sql = (
+                (migration_env.get(direction) or "").format(**format_args).strip()
+            )
+        except (KeyError, IndexError, ValueError) as e:
+            raise MigrationError(f"invalid placeholder in '{direction}' block: {e}")
+
+        return migration_sql, self._query_settings(migration, migration_env)
+
+    def _sql_file(self, migration: Mapping, direction: str):
+        """Return the path of the ``{direction}_file`` of a migration, if any.
+
+        Large migrations can keep their SQL in a file relative to ch/ instead
+        of the YAML. The file is streamed as is, without placeholders.
+        """
+        migration_env = migration.get(self.env) or {}
+        sql_file = migration_env.get(f"{direction}_file")
+        if not sql_file:
+            return None
+        if migration_env.get(direction):
+            raise MigrationError(f"use either '{direction}' or '{direction}_file'")
+        path = self._path("ch", sql_file)
+        if not os.path.exists(path):
+            raise MigrationError(f"SQL file ch/{sql_file} not found")
+        return path
+
+    def _statements(self, migration_sql: str, sql_file: str | None = None):
+        """Yield the statements of a rendered migration or of its SQL file."""
+        if sql_file:
+            return read_statements(sql_file)
+        return iter_statements([migration_sql])
+
+    def _execute(self, migration_sql: str, sql_file: str | None, query_settings):
+        """Run a rendered migration, streaming its SQL file one statement at a time."""
+        if sql_file:
+            self.db.execute_statements(read_statements(sql_file), query_settings)
+        else:
+            self.db.execute_migration(migration_sql, query_settings)
+
+    def _migration_seeds(self, migration: Mapping) -> list[dict]:
+        """Return the seed files of a migration for the environment.
+
+        ``seed`` lists files relative to ch/, each a path or a mapping with
+        ``file`` and the ``table`` to load it into, the migration's table by
+        default.
+        """
+        seeds = (migration.get(self.env) or {}).get("seed") or []
+        if isinstance(seeds, (str, Mapping)):
+            seeds = [seeds]
+
+        result = []
+        for seed in seeds:
+            if isinstance(seed, str):
+                seed = {"file": seed}
+            if not isinstance(seed, Mapping) or not seed.get("file"):
+                raise MigrationError("'seed' entries need a 'file'")
+            table = (seed.get("table") or migration.get("table") or "").strip()
+            try:
+                seed_format(seed["file"])
+            except SeedError as e:
+                raise MigrationError(f"{seed['file']}: {e}")
+            if not os.path.exists(self._path("ch", seed["file"])):
+                raise MigrationError(f"seed file ch/{seed['file']} not found")
+            result.append({"file": seed["file"], "table": table})
+        return result
+
+    def _seed(self, seeds: list[dict], query_settings: dict | None = None):
+        """Stream the seed files of a migration into their tables.
+
+        A row that can't be read raises :class:`SeedError`. Blocks inserted
+        before it are kept.
+        """
+        for seed in seeds:
+            columns = self.db.get_table_columns(seed["table"])
+            blocks = read_blocks(
+                self._path("ch", seed["file"]), columns, self.seed_block_size
+            )
+            rows = self.db.insert_blocks(seed["table"], blocks, query_settings)
+            self.console.print(
+                f"[green]✓[/green] Seeded {rows:,} rows into {seed['table']} "
+                f"from {seed['file']}"
+            )
+
+    def _seed_failed(self, version: str, migration_file: str, error: SeedError):
+        """Report a seed that stopped after its migration's statements ran."""
+        self.console.print(
+            f"[red]✗[/red] Migration [bold red]failed[/bold red]: {error}"
+        )
+        self.console.print(
+            f"[yellow]⚠[/yellow] {migration_file} ran and rows seeded before the "
+            "error were kept, clean them up before running it again"
+        )
+        self._record(
+            version=version,
+            file=migration_file,
+            direction="up",
+            status="failed",
+            error=str(error),
+        )
+
+    @functools.cached_property
+    def settings_profiles(self) -> dict:
+        """Run-level query settings and profiles from ch/settings.yml.
+
+        The ``default`` section applies to every environment and the section
+        named after the current environment overrides it, key by key.
+        """
+        if not os.path.exists(self._path(SETTINGS_FILE)):
+            return {"settings": {}, "profiles": {}}
+
+        with open(self._path(SETTINGS_FILE)) as f:
+            config = yaml.safe_load(f) or {}
+
+        default = config.get("default") or {}
+        env = config.get(self.env) or {}
+
+        profiles = {}
+        for section in [default, env]:
+            for name, profile in (section.get("profiles") or {}).items():
+                profiles.setdefault(name, {}).update(profile or {})
+
+        return {
+            "settings": {
+                **(default.get("settings") or {}),
+                **(env.get("settings") or {}),
+            },
+            "profiles": profiles,
+        }
+
+    def _query_settings(self, migration: Mapping, migration_env: Mapping):
+        """Merge run-level settings, the migration's profile and its own settings."""
+        settings = dict(self.settings_profiles["settings"])
+
+        profile = migration_env.get("settings_profile") or migration.get(
+            "settings_profile"
+        )
+        if profile:
+            if profile not in self.settings_profiles["profiles"]:
+                raise MigrationError(f"unknown settings profile '{profile}'")
+            settings.update(self.settings_profiles["profiles"][profile])
+
+        settings.update(migration_env.get("query_settings") or {})
+        return settings or None
 
     def _check_migrations_dir(self):
         """Check if migrations directory exists and raise formatted error if not."""
-        if not os.path.exists(MIGRATIONS_DIR):
+        if not os.path.exists(self._path(MIGRATIONS_DIR)):
             self.console.print("[red]Error:[/red] Migrations directory not found")
             self.console.print(
                 "\nPlease run [bold]houseplant init[/bold] to create a new project "
@@ -30,60 +452,94 @@ class Houseplant:
     def init(self):
         """Initialize a new houseplant project."""
         with self.console.status("[bold green]Initializing new houseplant project..."):
-            os.makedirs("ch/migrations", exist_ok=True)
-            open("ch/schema.sql", "a").close()
+            os.makedirs(self._path(MIGRATIONS_DIR), exist_ok=True)
+            open(self._path(SCHEMA_FILE), "a").close()
 
             self.db.init_migrations_table()
 
         self.console.print("✨ Project initialized successfully!")
 
+    def status(self):
+        """Yield the status of every local migration without printing anything.
+
+        Each record has the ``version``, ``name`` and ``file`` of a migration,
+        its ``status`` (``up`` or ``down``) and whether its file ``changed``
+        since it was applied.
+        """
+        migration_files = get_migration_files(self.root)
+        versions = [f.split("_")[0] for f in migration_files]
+        pending, _, changed = self.db.get_migration_diff(
+            versions, self._migration_checksums(migration_files), replica=True
+        )
+        pending, changed = set(pending), set(changed)
+
+        for migration_file, version in zip(migration_files, versions):
+            yield {
+                "version": version,
+                "name": " ".join(migration_file.split("_")[1:]).replace(".yml", ""),
+                "file": migration_file,
+                "status": "down" if version in pending else "up",
+                "changed": version in changed,
+            }
+
     def migrate_status(self):
-        """Show status of database migrations."""
-        # Get applied migrations from database
-        applied_migrations = {
-            version[0] for version in self.db.get_applied_migrations()
-        }
+        """Show status of database migrations.
 
-        migration_files = get_migration_files()
+        With ``on_record`` set, each migration is passed to it as soon as its
+        status is known instead of being rendered in a table.
+        """
+        migration_files = get_migration_files(self.root)
         if not migration_files:
             self.console.print("[yellow]No migrations found.[/yellow]")
             return
 
-        self.console.print(f"\nDatabase: {self.db.client.connection.database}\n")
+        changed = []
+        if self.on_record is not None:
+            for record in self.status():
+                self.on_record(record)
+                if record["changed"]:
+                    changed.append(record["file"])
+        else:
+            self.console.print(f"\nDatabase: {self.db.client.connection.database}\n")
+
+            table = Table()
+            table.add_column("Status", justify="center", style="cyan", no_wrap=True)
+            table.add_column("Migration ID", justify="left", style="magenta")
+            table.add_column("Migration Name", justify="left", style="green")
+
+            for record in self.status():
+                status = (
+                    "[green]up[/green]"
+                    if record["status"] == "up"
+                    else "[red]down[/red]"
+                )
+                table.add_row(status, record["version"], record["name"])
+                if record["changed"]:
+                    changed.append(record["file"])
 
-        table = Table()
-        table.add_column("Status", justify="center", style="cyan", no_wrap=True)
-        table.add_column("Migration ID", justify="left", style="magenta")
-        table.add_column("Migration Name", justify="left", style="green")
-
-        for migration_file in migration_files:
-            version = migration_file.split("_")[0]
-            status = (
-                "[green]up[/green]"
-                if version in applied_migrations
-                else "[red]down[/red]"
-            )
-            name = " ".join(migration_file.split("_")[1:]).replace(".yml", "")
-            table.add_row(status, version, name)
+            self.console.print(table)
+            self.console.print("")
 
-        self.console.print(table)
-        self.console.print("")
+        if changed:
+            self._report_changed_migrations(changed)
 
+    @locked
     def migrate_up(self, version: str | None = None):
         """Run migrations up to specified version."""
         # Remove VERSION= prefix if present
         if version and version.startswith("VERSION="):
             version = version.replace("VERSION=", "")
 
-        migration_files = get_migration_files()
+        migration_files = get_migration_files(self.root)
         if not migration_files:
             self.console.print("[yellow]No migrations found.[/yellow]")
             return
 
         # Get applied migrations from database
-        applied_migrations = {
-            version[0] for version in self.db.get_applied_migrations()
-        }
+        applied_migrations = self._applied_versions(
+            [f.split("_")[0] for f in migration_files]
+        )
+        checksums = self._migration_checksums(migration_files)
 
         # If specific version requested, verify it exists
         if version:
@@ -104,148 +560,636 @@ class Houseplant:
                 if migration_version in applied_migrations:
                     continue
 
-                # Load and execute migration
-                with open(os.path.join(MIGRATIONS_DIR, migration_file), "r") as f:
-                    migration = yaml.safe_load(f)
-
-                table = migration.get("table", "").strip()
-                if not table:
-                    self.console.print(
-                        "[red]✗[/red] Migration [bold red]failed[/bold red]: "
-                        "'table' field is required in migration file"
+                # Load and render migration
+                migration = self._load_migration(migration_file)
+                try:
+                    migration_sql, query_settings = self._render_migration(
+                        migration, "up"
                     )
-                    return
-
-                table_definition = migration.get("table_definition", "").strip()
-                table_settings = migration.get("table_settings", "").strip()
-
-                format_args = {"table": table}
-                if table_definition and table_settings:
-                    format_args.update(
-                        {
-                            "table_definition": table_definition,
-                            "table_settings": table_settings,
-                        }
+                    sql_file = self._sql_file(migration, "up")
+                    seeds = self._migration_seeds(migration)
+                except MigrationError as e:
+                    self.console.print(
+                        f"[red]✗[/red] Migration [bold red]failed[/bold red]: {e}"
                     )
-
-                sink_table = migration.get("sink_table", "").strip()
-                view_definition = migration.get("view_definition", "").strip()
-                view_query = migration.get("view_query", "").strip()
-                if sink_table and view_definition and view_query:
-                    format_args.update(
-                        {
-                            "sink_table": sink_table,
-                            "view_definition": view_definition,
-                            "view_query": view_query,
-                        }
+                    self._record(
+                        version=migration_version,
+                        file=migration_file,
+                        direction="up",
+                        status="failed",
+                        error=str(e),
                     )
+                    return
 
-                # Get migration SQL based on environment
-                migration_env: dict = migration.get(self.env, {})
-                migration_sql = (
-                    migration_env.get("up", "").format(**format_args).strip()
-                )
-
-                if migration_sql:
-                    self.db.execute_migration(
-                        migration_sql, migration_env.get("query_settings")
+                if migration_sql or sql_file or seeds:
+                    if not self._check_disk_space(
+                        migration_file, self._statements(migration_sql, sql_file)
+                    ):
+                        self._record(
+                            version=migration_version,
+                            file=migration_file,
+                            direction="up",
+                            status="refused",
+                        )
+                        return
+
+                    self._execute(migration_sql, sql_file, query_settings)
+                    try:
+                        self._seed(seeds, query_settings)
+                    except SeedError as e:
+                        self._seed_failed(migration_version, migration_file, e)
+                        return
+                    self.db.mark_migration_applied(
+                        migration_version, checksums.get(migration_version, "")
                     )
-                    self.db.mark_migration_applied(migration_version)
                     self.console.print(
                         f"[green]✓[/green] Applied migration {migration_file}"
                     )
+                    self._record(
+                        version=migration_version,
+                        file=migration_file,
+                        direction="up",
+                        status="applied",
+                    )
                 else:
                     self.console.print(
                         f"[yellow]⚠[/yellow] Empty migration {migration_file}"
                     )
+                    self._record(
+                        version=migration_version,
+                        file=migration_file,
+                        direction="up",
+                        status="empty",
+                    )
 
                 if version and migration_version == version:
                     self.update_schema()
                     break
 
-    def migrate_down(self, version: str | None = None):
-        """Roll back migrations to specified version."""
-        # Remove VERSION= prefix if present
+    @locked
+    def migrate_down(self, version: str | None = None, step: int | str | None = None):
+        """Roll back migrations to specified version.
+
+        Without a version, the latest ``step`` migrations are rolled back
+        (one by default). With a version, every applied migration from that
+        version on is rolled back, newest first. All down migrations are
+        rendered before the first one runs, and the rolled back versions are
+        recorded in a single batch followed by one schema dump.
+        """
+        # Remove VERSION= and STEP= prefixes if present
         if version and version.startswith("VERSION="):
             version = version.replace("VERSION=", "")
+        if isinstance(step, str) and step.startswith("STEP="):
+            step = step.replace("STEP=", "")
+        step = int(step) if step else (None if version else 1)
+
+        migration_files = {
+            migration_file.split("_")[0]: migration_file
+            for migration_file in get_migration_files(self.root)
+        }
 
         # Get applied migrations from database
         applied_migrations = sorted(
-            [version[0] for version in self.db.get_applied_migrations()], reverse=True
+            self._applied_versions(list(migration_files)), reverse=True
         )
 
         if not applied_migrations:
             self.console.print("[yellow]No migrations to roll back.[/yellow]")
             return
 
-        with self.console.status(f"[bold green]Rolling back to version: {version}..."):
-            for migration_version in applied_migrations:
-                if version and migration_version < version:
-                    break
+        if version:
+            applied_migrations = [v for v in applied_migrations if v >= version]
+        if step:
+            applied_migrations = applied_migrations[:step]
+
+        # Skipping a version without a file would roll back older migrations
+        # while a newer one stays applied
+        unknown = [v for v in applied_migrations if v not in migration_files]
+        if unknown:
+            self.console.print(
+                "[red]✗[/red] Cannot roll back, no migration file for version "
+                + ", ".join(unknown)
+            )
+            return
 
-                # Find corresponding migration file
-                migration_file = next(
-                    (
-                        f
-                        for f in os.listdir(MIGRATIONS_DIR)
-                        if f.startswith(migration_version) and f.endswith(".yml")
-                    ),
-                    None,
+        # Build the whole plan first so a broken migration stops the rollback
+        # before anything has changed
+        plan = []
+        for migration_version in applied_migrations:
+            migration_file = migration_files[migration_version]
+            migration = self._load_migration(migration_file)
+            try:
+                migration_sql, query_settings = self._render_migration(
+                    migration, "down"
                 )
+                sql_file = self._sql_file(migration, "down")
+            except MigrationError as e:
+                self.console.print(
+                    f"[red]✗[/red] [bold red] Migration failed[/bold red]: {migration_file}: {e}"
+                )
+                self._record(
+                    version=migration_version,
+                    file=migration_file,
+                    direction="down",
+                    status="failed",
+                    error=str(e),
+                )
+                return
 
-                if not migration_file:
-                    self.console.print(
-                        f"[red]Warning: Migration file for version {migration_version} not found[/red]"
-                    )
-                    continue
+            if not migration_sql and not sql_file:
+                self.console.print(
+                    f"[yellow]⚠[/yellow] Empty down migration {migration_file}"
+                )
+                self._record(
+                    version=migration_version,
+                    file=migration_file,
+                    direction="down",
+                    status="empty",
+                )
+                continue
 
-                # Load and execute down migration
-                with open(os.path.join(MIGRATIONS_DIR, migration_file), "r") as f:
-                    migration = yaml.safe_load(f)
+            plan.append(
+                (
+                    migration_version,
+                    migration_file,
+                    migration_sql,
+                    sql_file,
+                    query_settings,
+                )
+            )
 
-                table = migration.get("table", "").strip()
-                if not table:
+        if not plan:
+            return
+
+        rolled_back = []
+        error = None
+        try:
+            with self.console.status(
+                f"[bold green]Rolling back {len(plan)} migration(s)..."
+            ):
+                for (
+                    migration_version,
+                    migration_file,
+                    sql,
+                    sql_file,
+                    query_settings,
+                ) in plan:
+                    self._execute(sql, sql_file, query_settings)
+                    rolled_back.append(migration_version)
                     self.console.print(
-                        "[red]✗[/red] [bold red] Migration failed[/bold red]: "
-                        "'table' field is required in migration file"
+                        f"[green]✓[/green] Rolled back migration {migration_file}"
                     )
-                    return
-
-                # Get migration SQL based on environment
-                migration_env = migration.get(self.env, {})
-                migration_sql = (
-                    migration_env.get("down", {}).format(table=table).strip()
-                )
-
-                if migration_sql:
-                    self.db.execute_migration(
-                        migration_sql, migration_env.get("query_settings")
+                    self._record(
+                        version=migration_version,
+                        file=migration_file,
+                        direction="down",
+                        status="rolled_back",
                     )
-                    self.db.mark_migration_rolled_back(migration_version)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            # Record whatever was rolled back, even if a later migration failed,
+            # without hiding the error of that migration
+            if rolled_back:
+                try:
+                    self.db.mark_migrations_rolled_back(rolled_back)
                     self.update_schema()
+                except Exception as e:
+                    if error is None:
+                        raise
                     self.console.print(
-                        f"[green]✓[/green] Rolled back migration {migration_file}"
+                        f"[red]✗[/red] Could not record rolled back migrations "
+                        f"{', '.join(rolled_back)}: {e}"
                     )
 
-                    return
+    def migrate_check(self) -> bool:
+        """Validate every pending migration without applying any of them.
 
+        Each migration is rendered for the current environment and each of
+        its statements is parsed by the server with EXPLAIN AST, over a pool
+        of connections. Returns True if all pending migrations are valid.
+        """
+        migration_files = get_migration_files(self.root)
+        if not migration_files:
+            self.console.print("[yellow]No migrations found.[/yellow]")
+            return True
+
+        pending_files = self._pending_migration_files(migration_files)
+
+        errors = {}
+        statements = []
+        for migration_file in pending_files:
+            try:
+                migration = self._load_migration(migration_file)
+                for direction in ["up", "down"]:
+                    migration_sql, _ = self._render_migration(migration, direction)
+                    sql_file = self._sql_file(migration, direction)
+                    statements.extend(
+                        (migration_file, statement)
+                        for statement in self._statements(migration_sql, sql_file)
+                    )
+                self._migration_seeds(migration)
+            except (yaml.YAMLError, AttributeError, MigrationError) as e:
+                errors.setdefault(migration_file, []).append(str(e))
+
+        with self.console.status(
+            f"[bold green]Checking {len(pending_files)} pending migrations..."
+        ):
+            results = self.db.map_parallel(
+                lambda client, item: client.explain_ast(item[1]), statements
+            )
+
+        for (migration_file, _), error in zip(statements, results):
+            if error:
+                errors.setdefault(migration_file, []).append(error)
+
+        for migration_file in pending_files:
+            for error in errors.get(migration_file, []):
+                self.console.print(f"[red]✗[/red] {migration_file}: {error}")
+
+        if errors:
+            self.console.print(
+                f"[red]{len(errors)} of {len(pending_files)} pending migrations "
+                "are invalid[/red]"
+            )
+            return False
+
+        self.console.print(
+            f"[green]✓[/green] {len(pending_files)} pending migrations are valid"
+        )
+        return True
+
+    def migrate_plan(self, output: str | None = None) -> dict:
+        """Estimate the cost of every pending migration.
+
+        SELECTs feeding INSERTs and populated views are estimated with
+        EXPLAIN ESTIMATE. ALTERs are sized from the active parts of their
+        target table. The plan is printed ranked by estimated bytes and, with
+        ``output``, written to a file that ``apply_plan`` can run later.
+        """
+        migration_files = get_migration_files(self.root)
+        pending_files = self._pending_migration_files(migration_files)
+
+        migrations = []
+        for migration_file in pending_files:
+            migration = self._load_migration(migration_file)
+            try:
+                migration_sql, query_settings = self._render_migration(migration, "up")
+                sql_file = self._sql_file(migration, "up")
+                seeds = self._migration_seeds(migration)
+            except MigrationError as e:
                 self.console.print(
-                    f"[yellow]⚠[/yellow] Empty down migration {migration_file}"
+                    f"[red]✗[/red] Migration [bold red]failed[/bold red]: {e}"
                 )
+                return {}
+
+            migrations.append(
+                {
+                    "version": migration_file.split("_")[0],
+                    "file": migration_file,
+                    "query_settings": query_settings,
+                    "statements": [
+                        {"sql": statement}
+                        for statement in self._statements(migration_sql, sql_file)
+                    ],
+                    "seeds": seeds,
+                }
+            )
+
+        statements = [s for migration in migrations for s in migration["statements"]]
+
+        def estimate(client, statement):
+            query = select_query(statement["sql"])
+            if query is None:
+                return False
+            try:
+                return client.explain_estimate(query)
+            except ServerException:
+                # The tables it reads may be created by an earlier migration
+                return None
+
+        with self.console.status("[bold green]Estimating pending migrations..."):
+            estimates = self.db.map_parallel(estimate, statements)
+
+            sized_tables = set()
+            for statement, estimate_rows in zip(statements, estimates):
+                alter = alter_scope(statement["sql"])
+                if alter:
+                    statement["table"], statement["scope"] = alter
+                    sized_tables.add(alter[0])
+                elif estimate_rows is False:
+                    statement["scope"] = "metadata"
+                else:
+                    statement["scope"] = "read"
+                    statement["reads"] = estimate_rows
+                    sized_tables.update(row[1] for row in estimate_rows or [])
+
+            sizes = self.db.get_table_sizes(sorted(sized_tables))
+
+        for statement in statements:
+            rows, size = None, None
+            if statement["scope"] == "read" and statement["reads"] is not None:
+                rows, size = 0, 0
+                for _, table, _, read_rows, _ in statement["reads"]:
+                    table_rows, table_bytes = sizes.get(table, (0, 0))
+                    rows += read_rows
+                    size += read_rows * table_bytes // table_rows if table_rows else 0
+            elif statement["scope"] in ("rewrite", "partition"):
+                rows, size = sizes.get(statement["table"], (0, 0))
+            elif statement["scope"] == "metadata":
+                rows, size = 0, 0
+            statement.pop("reads", None)
+            statement["rows"], statement["bytes"] = rows, size
+
+        plan = {
+            "database": self.db.database,
+            "env": self.env,
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "migrations": migrations,
+        }
+
+        if output:
+            with open(output, "w") as f:
+                json.dump(plan, f, indent=2)
+
+        self._print_plan(plan)
+        if output:
+            self.console.print(f"✨ Plan written to {output}")
+        return plan
+
+    def _print_plan(self, plan: dict):
+        """Print the statements of a plan ranked by estimated bytes."""
+        if not plan["migrations"]:
+            self.console.print("[green]No pending migrations.[/green]")
+            return
+
+        table = Table()
+        table.add_column("Migration ID", justify="left", style="magenta")
+        table.add_column("Scope", justify="left", style="cyan")
+        table.add_column("Est. Rows", justify="right")
+        table.add_column("Est. Bytes", justify="right")
+        table.add_column("Statement", justify="left", style="green")
+
+        rows = [
+            (migration["version"], statement)
+            for migration in plan["migrations"]
+            for statement in migration["statements"]
+        ]
+        # Seeds are sized by their file, their row count is unknown
+        rows.extend(
+            (
+                migration["version"],
+                {
+                    "scope": "seed",
+                    "rows": None,
+                    "bytes": os.path.getsize(self._path("ch", seed["file"])),
+                    "sql": f"{seed['file']} into {seed['table']}",
+                },
+            )
+            for migration in plan["migrations"]
+            for seed in migration.get("seeds", [])
+        )
+        rows.sort(
+            key=lambda row: -1 if row[1]["bytes"] is None else row[1]["bytes"],
+            reverse=True,
+        )
+        for version, statement in rows:
+            table.add_row(
+                version,
+                statement["scope"],
+                "?" if statement["rows"] is None else f"{statement['rows']:,}",
+                "?" if statement["bytes"] is None else format_bytes(statement["bytes"]),
+                " ".join(statement["sql"].split())[:60],
+            )
+
+        self.console.print(table)
+
+    @locked
+    def apply_plan(self, path: str):
+        """Apply the pending migrations of a plan written by ``migrate_plan``."""
+        with open(path) as f:
+            plan = json.load(f)
+
+        if plan["database"] != self.db.database or plan["env"] != self.env:
+            self.console.print(
+                f"[red]✗[/red] Plan was made for database {plan['database']} "
+                f"in {plan['env']}"
+            )
+            return
+
+        applied_migrations = self._applied_versions(
+            [migration["version"] for migration in plan["migrations"]]
+        )
+        checksums = self._migration_checksums(
+            [
+                migration["file"]
+                for migration in plan["migrations"]
+                if os.path.exists(self._path(MIGRATIONS_DIR, migration["file"]))
+            ]
+        )
+
+        with self.console.status("[bold green]Applying migration plan..."):
+            for migration in plan["migrations"]:
+                if migration["version"] in applied_migrations:
+                    continue
+
+                statements = [s["sql"] for s in migration["statements"]]
+                seeds = migration.get("seeds", [])
+                if statements or seeds:
+                    if not self._check_disk_space(migration["file"], statements):
+                        self._record(
+                            version=migration["version"],
+                            file=migration["file"],
+                            direction="up",
+                            status="refused",
+                        )
+                        return
+
+                    self.db.execute_statements(statements, migration["query_settings"])
+                    try:
+                        self._seed(seeds, migration["query_settings"])
+                    except SeedError as e:
+                        self._seed_failed(migration["version"], migration["file"], e)
+                        return
+                    self.db.mark_migration_applied(
+                        migration["version"], checksums.get(migration["version"], "")
+                    )
+                    self.console.print(
+                        f"[green]✓[/green] Applied migration {migration['file']}"
+                    )
+                    self._record(
+                        version=migration["version"],
+                        file=migration["file"],
+                        direction="up",
+                        status="applied",
+                    )
+                else:
+                    self.console.print(
+                        f"[yellow]⚠[/yellow] Empty migration {migration['file']}"
+                    )
+                    self._record(
+                        version=migration["version"],
+                        file=migration["file"],
+                        direction="up",
+                        status="empty",
+                    )
 
     def migrate(self, version: str | None = None):
         """Run migrations up to specified version."""
         self.migrate_up(version)
 
+    @locked
+    def migrate_squash(self, before: str | None = None):
+        """Fold all migrations up to a version into a single baseline migration.
+
+        The baseline is generated from the live definitions of the objects the
+        squashed migrations created. It keeps the version of the last squashed
+        migration, so databases where it was applied see it as applied.
+        """
+        # Remove BEFORE= prefix if present
+        if before and before.startswith("BEFORE="):
+            before = before.replace("BEFORE=", "")
+
+        if not before:
+            self.console.print("[red]A BEFORE version is required to squash[/red]")
+            return
+
+        migration_files = get_migration_files(self.root)
+        squashed_files = [f for f in migration_files if f.split("_")[0] <= before]
+        if len(squashed_files) < 2:
+            self.console.print("[yellow]No migrations to squash.[/yellow]")
+            return
+
+        pending = self._pending_migration_files(squashed_files)
+        if pending:
+            self.console.print(
+                "[red]✗[/red] Migrations must be applied before they are squashed: "
+                + ", ".join(pending)
+            )
+            return
+
+        # Collect the objects created by the squashed migrations, in order.
+        # The baseline holds the live definitions of this environment, so the
+        # other environments must have run the same SQL
+        objects = []
+        envs = [self.env]
+        for migration_file in squashed_files:
+            with open(self._path(MIGRATIONS_DIR, migration_file), "r") as f:
+                migration = yaml.safe_load(f)
+            table = migration.get("table")
+            for name in migration.get("objects", [table] if table else []):
+                if name not in objects:
+                    objects.append(name)
+            for env, section in migration.items():
+                if not isinstance(section, dict):
+                    continue
+                if section != migration.get(self.env):
+                    self.console.print(
+                        f"[red]✗[/red] Cannot squash: {migration_file} has SQL "
+                        f"specific to {env}"
+                    )
+                    return
+                if env not in envs:
+                    envs.append(env)
+
+        # Live definitions only match the baseline if nothing changed them
+        # later, so refuse when a later migration alters, drops, renames or
+        # exchanges a squashed object
+        for migration_file in migration_files[len(squashed_files) :]:
+            with open(self._path(MIGRATIONS_DIR, migration_file), "r") as f:
+                migration = yaml.safe_load(f)
+            try:
+                migration_sql, _ = self._render_migration(migration, "up")
+                sql_file = self._sql_file(migration, "up")
+            except MigrationError as e:
+                self.console.print(f"[red]✗[/red] Cannot squash: {migration_file}: {e}")
+                return
+            statements = (
+                read_statements(sql_file)
+                if sql_file
+                else iter_statements([migration_sql])
+            )
+            changed = next(
+                (
+                    name
+                    for statement in statements
+                    for name in changed_objects(statement)
+                    if name in objects
+                ),
+                None,
+            )
+            if changed:
+                self.console.print(
+                    f"[red]✗[/red] Cannot squash: {migration_file} changes "
+                    f"{changed} after version {before}"
+                )
+                return
+
+        live = self.db.get_create_statements()
+        baseline_objects = [name for name in objects if name in live]
+        if not baseline_objects:
+            self.console.print("[yellow]No live objects to squash.[/yellow]")
+            return
+
+        kinds = {
+            "tables": "TABLE",
+            "dictionaries": "DICTIONARY",
+            "materialized_views": "VIEW",
+        }
+        statements = dependency_order(
+            [requalify(live[name][1], self.db.database) for name in baseline_objects]
+        )
+        drops = []
+        for statement in statements:
+            _, name = parse_create(statement)
+            drops.insert(0, f"DROP {kinds[live[name][0]]} {name}")
+
+        def block(sql):
+            # Escape braces so the SQL survives the placeholder formatting
+            sql = sql.replace("{", "{{").replace("}", "}}")
+            return "\n".join(f"    {line}" for line in sql.splitlines())
+
+        # Databases that applied the squashed migrations have this version
+        version = squashed_files[-1].split("_")[0]
+        baseline_name = SQUASHED_BASELINE
+        baseline_file = f"{MIGRATIONS_DIR}/{version}_{baseline_name}.yml"
+        objects_list = "\n".join(f"  - {name}" for name in baseline_objects)
+        up_sql = block(";\n\n".join(statements))
+        down_sql = block(";\n".join(drops))
+        aliases = "".join(f"\n{env}:\n  <<: *{self.env}\n" for env in envs[1:])
+
+        with self.console.status("[bold green]Squashing migrations..."):
+            for migration_file in squashed_files:
+                os.remove(self._path(MIGRATIONS_DIR, migration_file))
+
+            with open(self._path(baseline_file), "w") as f:
+                f.write(f"""version: "{version}"
+name: {baseline_name}
+table: {baseline_objects[0]}
+objects:
+{objects_list}
+
+{self.env}: &{self.env}
+  up: |
+{up_sql}
+  down: |
+{down_sql}
+{aliases}""")
+
+        self.console.print(
+            f"✨ Squashed {len(squashed_files)} migrations into {baseline_file}"
+        )
+
     def generate(self, name: str):
         """Generate a new migration."""
         with self.console.status("[bold green]Generating migration..."):
             timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
 
             migration_name = name.replace(" ", "_").replace("-", "_").lower()
-            migration_file = f"ch/migrations/{timestamp}_{migration_name}.yml"
+            migration_file = f"{MIGRATIONS_DIR}/{timestamp}_{migration_name}.yml"
 
-            with open(migration_file, "w") as f:
+            with open(self._path(migration_file), "w") as f:
                 f.write(f"""version: "{timestamp}"
 name: {migration_name}
 table:
@@ -266,54 +1210,273 @@ production:
 
             self.console.print(f"✨ Generated migration: {migration_file}")
 
-    def db_schema_load(self):
-        """Load schema migrations from migration files without applying them."""
-        migration_files = get_migration_files()
+    @locked
+    def db_schema_load(self, bootstrap: bool = False):
+        """Load schema migrations from migration files without applying them.
+
+        With ``bootstrap``, the objects in ch/schema.sql are created first and
+        only the migrations included in the schema are marked as applied.
+        """
+        migration_files = get_migration_files(self.root)
         if not migration_files:
             self.console.print("[yellow]No migrations found.[/yellow]")
             return
 
+        if bootstrap:
+            schema_version = self._bootstrap_schema()
+            migration_files = [
+                f for f in migration_files if f.split("_")[0] <= schema_version
+            ]
+
         with self.console.status("[bold green]Loading schema migrations..."):
+            self.db.mark_migrations_applied(
+                [migration_file.split("_")[0] for migration_file in migration_files],
+                self._migration_checksums(migration_files),
+            )
             for migration_file in migration_files:
-                migration_version = migration_file.split("_")[0]
-                self.db.mark_migration_applied(migration_version)
                 self.console.print(
                     f"[green]✓[/green] Loaded migration {migration_file}"
                 )
 
         self.console.print("✨ Schema migrations loaded successfully!")
 
+    def _bootstrap_schema(self) -> str:
+        """Create every object in ch/schema.sql and return the schema version."""
+        with open(self._path(SCHEMA_FILE)) as f:
+            schema = parse_schema(f.read())
+
+        def unqualified(statement):
+            database, _ = parse_create(statement) or (None, None)
+            return requalify(statement, database) if database else statement
+
+        with self.console.status("[bold green]Creating schema objects..."):
+            self.db.init_migrations_table()
+
+            # Tables don't depend on each other, so they are created concurrently
+            self.db.map_parallel(
+                lambda client, statement: client.client.execute(statement),
+                [unqualified(statement) for statement in schema["tables"]],
+            )
+
+            # Views and dictionaries may read from tables and from each other,
+            # so each one is created after the objects it references
+            for statement in dependency_order(
+                schema["dictionaries"] + schema["materialized_views"]
+            ):
+                self.db.client.execute(unqualified(statement))
+
+        self.console.print(
+            f"[green]✓[/green] Created {len(schema['tables'])} tables, "
+            f"{len(schema['materialized_views'])} materialized views and "
+            f"{len(schema['dictionaries'])} dictionaries"
+        )
+        return schema["version"]
+
+    def _expected_schema(self) -> dict:
+        """Return ``{name: (category, statement, database)}`` of ch/schema.sql."""
+        with open(self._path(SCHEMA_FILE)) as f:
+            schema = parse_schema(f.read())
+
+        expected = {}
+        for category in SCHEMA_SECTIONS.values():
+            for statement in schema[category]:
+                database, name = parse_create(statement) or (None, None)
+                if name:
+                    expected[name] = (category, statement, database)
+        return expected
+
+    def _diff_objects(self, expected: dict, hashes: dict, client, database=None):
+        """Compare the objects of ch/schema.sql with the hashes of a database.
+
+        The full statement is only read from ``client`` for objects whose
+        hashes differ.
+        """
+        changed = []
+        for name in sorted(expected.keys() & hashes.keys()):
+            category, statement, schema_database = expected[name]
+            normalized = normalize_create(statement, schema_database)
+            if schema_hash(normalized) == hashes[name][1]:
+                continue
+
+            live = client.get_create_statement(name, hashes[name][0], database)
+            live_database, _ = parse_create(live) or (None, None)
+            if normalize_create(live, live_database) == normalized:
+                continue
+
+            diff = difflib.unified_diff(
+                (
+                    requalify(statement, schema_database)
+                    if schema_database
+                    else statement
+                )
+                .strip()
+                .splitlines(),
+                (requalify(live, live_database) if live_database else live)
+                .strip()
+                .splitlines(),
+                fromfile="ch/schema.sql",
+                tofile=database or client.client.connection.database,
+                lineterm="",
+            )
+            changed.append(
+                {"name": name, "category": category, "diff": "\n".join(diff)}
+            )
+
+        return {
+            "missing": [
+                {"name": name, "category": expected[name][0]}
+                for name in sorted(expected.keys() - hashes.keys())
+            ],
+            "extra": [
+                {"name": name, "category": hashes[name][0]}
+                for name in sorted(hashes.keys() - expected.keys())
+            ],
+            "changed": changed,
+        }
+
+    def schema_diff(self) -> dict:
+        """Compare the live database with ch/schema.sql.
+
+        Only the hash of each normalized CREATE statement is fetched from the
+        server, the full statement is read for objects whose hashes differ.
+        Returns the objects ``missing`` from the database, the ``extra`` ones
+        not in ch/schema.sql and the ``changed`` ones with a unified diff.
+        """
+        expected = self._expected_schema()
+
+        with self.console.status("[bold green]Comparing schema..."):
+            hashes = self.db.get_schema_hashes()
+            result = self._diff_objects(expected, hashes, self.db)
+
+        self._print_schema_diff(result)
+        return result
+
+    def schema_fingerprint(self, databases: list[str] | None = None) -> dict:
+        """Compare many databases on every host with ch/schema.sql.
+
+        Each host returns one fingerprint per database, computed from the
+        hashes of its objects, and hosts are queried concurrently. Object
+        hashes and then full statements are only read for databases whose
+        fingerprint differs from the one of ch/schema.sql. ``databases``
+        may contain ``*`` wildcards and default to the configured database.
+        """
+        expected = self._expected_schema()
+        fingerprint = schema_fingerprint(
+            {
+                name: schema_hash(normalize_create(statement, database))
+                for name, (_, statement, database) in expected.items()
+            }
+        )
+        databases = databases or [self.db.database]
+
+        def check(client):
+            fingerprints = client.get_schema_fingerprints(databases)
+            # Databases named explicitly are reported even without objects
+            for database in databases:
+                if "*" not in database:
+                    fingerprints.setdefault(database, None)
+
+            targets = []
+            for database, digest in sorted(fingerprints.items()):
+                target = {"database": database, "fingerprint": digest}
+                if digest != fingerprint:
+                    hashes = client.get_schema_hashes(database)
+                    target.update(
+                        self._diff_objects(expected, hashes, client, database)
+                    )
+                targets.append(target)
+            return targets
+
+        with self.console.status("[bold green]Fingerprinting schemas..."):
+            results = self.db.map_hosts(check)
+
+        targets = []
+        for host, result in results.items():
+            if isinstance(result, Exception):
+                targets.append({"host": host, "error": str(result).strip()})
+                continue
+            targets.extend({"host": host, **target} for target in result)
+
+        result = {"fingerprint": fingerprint, "targets": targets}
+        self._print_schema_fingerprint(result)
+        return result
+
+    def _print_schema_fingerprint(self, result: dict):
+        self.console.print(f"\nch/schema.sql: {result['fingerprint'][:12]}\n")
+
+        table = Table()
+        table.add_column("Host", justify="left", style="cyan", no_wrap=True)
+        table.add_column("Database", justify="left", style="magenta")
+        table.add_column("Fingerprint", justify="left")
+        table.add_column("Status", justify="left")
+
+        drifted = [target for target in result["targets"] if target_drifted(target)]
+        for target in result["targets"]:
+            if "error" in target:
+                status = f"[red]{target['error'].splitlines()[0]}[/red]"
+            elif target_drifted(target):
+                count = sum(len(target[key]) for key in ["missing", "extra", "changed"])
+                status = f"[red]{count} objects differ[/red]"
+            else:
+                status = "[green]match[/green]"
+            table.add_row(
+                target["host"],
+                target.get("database", ""),
+                (target.get("fingerprint") or "")[:12],
+                status,
+            )
+        self.console.print(table)
+
+        for target in drifted:
+            if "error" in target:
+                continue
+            self.console.print(f"\n{target['host']} {target['database']}:")
+            self._print_schema_diff(target)
+
+    def _print_schema_diff(self, result: dict):
+        result = {key: result[key] for key in ["missing", "extra", "changed"]}
+        if not any(result.values()):
+            self.console.print("[green]✓[/green] Database matches ch/schema.sql")
+            return
+
+        for item in result["missing"]:
+            self.console.print(f"[red]- {item['name']}[/red] missing from database")
+        for item in result["extra"]:
+            self.console.print(f"[green]+ {item['name']}[/green] not in ch/schema.sql")
+        for item in result["changed"]:
+            self.console.print(f"[yellow]~ {item['name']}[/yellow] differs")
+            self.console.print(item["diff"], markup=False, highlight=False)
+
+        drifted = sum(len(items) for items in result.values())
+        self.console.print(f"[red]{drifted} objects differ from ch/schema.sql[/red]")
+
     def update_schema(self):
         """Update the schema file with the current database schema."""
 
         # Get all applied migrations in order
-        applied_migrations = self.db.get_applied_migrations()
-        migration_files = get_migration_files()
-        latest_version = applied_migrations[-1][0] if applied_migrations else "0"
+        migration_files = {
+            migration_file.split("_")[0]: migration_file
+            for migration_file in get_migration_files(self.root)
+        }
+        applied_migrations = sorted(self._applied_versions(list(migration_files)))
+        latest_version = applied_migrations[-1] if applied_migrations else "0"
 
-        # Get all database objects
-        tables = self.db.get_database_tables()
-        materialized_views = self.db.get_database_materialized_views()
-        dictionaries = self.db.get_database_dictionaries()
+        # Get the CREATE statements of all database objects at once
+        objects = self.db.get_create_statements()
 
         # Track processed tables to ensure first migration takes precedence
         processed_tables = set()
 
         # Group statements by type
-        table_statements = []
-        mv_statements = []
-        dict_statements = []
+        statements = {category: [] for category in SCHEMA_SECTIONS.values()}
 
         for migration_version in applied_migrations:
-            matching_file = next(
-                (f for f in migration_files if f.startswith(migration_version[0])), None
-            )
+            matching_file = migration_files.get(migration_version)
 
             if not matching_file:
                 continue
 
-            migration_file = f"ch/migrations/{matching_file}"
-            with open(migration_file) as f:
+            with open(self._path(MIGRATIONS_DIR, matching_file)) as f:
                 migration_data = yaml.safe_load(f)
 
             # Extract table name from migration
@@ -321,41 +1484,22 @@ production:
             if not table_name:
                 continue
 
-            # Skip if we've already processed this table
-            if table_name in processed_tables:
-                continue
+            # Squashed baselines create several objects
+            for table_name in migration_data.get("objects", [table_name]):
+                # Skip if we've already processed this table
+                if table_name in processed_tables or table_name not in objects:
+                    continue
+
+                category, create_stmt = objects[table_name]
+                statements[category].append(create_stmt)
+                processed_tables.add(table_name)
 
-            # Check tables first
-            for table in tables:
-                if table[0] == table_name:
-                    create_stmt = self.db.client.execute(
-                        f"SHOW CREATE TABLE {table_name}"
-                    )[0][0]
-                    table_statements.append(create_stmt)
-                    processed_tables.add(table_name)
-
-            # Then materialized views
-            for mv in materialized_views:
-                if mv[0] == table_name:
-                    mv_name = mv[0]
-                    create_stmt = self.db.client.execute(f"SHOW CREATE VIEW {mv_name}")[
-                        0
-                    ][0]
-                    mv_statements.append(create_stmt)
-                    processed_tables.add(table_name)
-
-            # Finally dictionaries
-            for ch_dict in dictionaries:
-                if ch_dict[0] == table_name:
-                    dict_name = ch_dict[0]
-                    create_stmt = self.db.client.execute(
-                        f"SHOW CREATE DICTIONARY {dict_name}"
-                    )[0][0]
-                    dict_statements.append(create_stmt)
-                    processed_tables.add(table_name)
+        table_statements = statements["tables"]
+        mv_statements = statements["materialized_views"]
+        dict_statements = statements["dictionaries"]
 
         # Write schema file
-        with open("ch/schema.sql", "w") as f:
+        with open(self._path(SCHEMA_FILE), "w") as f:
             f.write(f"-- version: {latest_version}\n\n")
             if table_statements:
                 f.write("-- TABLES\n\n")
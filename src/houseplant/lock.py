@@ -0,0 +1,329 @@
+"""Lease-based lock that lets one process at a time run migrations."""
+
+import os
+import socket
+import threading
+import time
+import uuid
+
+from clickhouse_driver.errors import ServerException
+from rich.console import Console
+
+LOCK_TABLE = "houseplant_locks"
+LOCK_ENGINES = ("off", "table", "keeper")
+LOCK_POLICIES = ("fail", "skip", "wait")
+
+UNKNOWN_TABLE = 60
+# Raised by a strict KeeperMap insert of a key that already exists
+KEEPER_EXCEPTION = 999
+
+
+class LockNotAcquired(Exception):
+    """Raised when another process holds the migration lock."""
+
+    def __init__(self, holder):
+        self.holder = holder
+        super().__init__(f"Migrations are locked by {holder}")
+
+
+class LockLost(Exception):
+    """Raised when the lease of the lock ran out while migrations were running."""
+
+    def __init__(self, holder):
+        self.holder = holder
+        super().__init__(f"Lost the migration lock to {holder}")
+
+
+class MigrationLock:
+    """Hold a lease on the ``houseplant_locks`` row of a database.
+
+    The lease expires ``lease`` seconds after it was last renewed, so a
+    process that dies never blocks migrations for longer than that. While
+    the lock is held a background thread renews it over its own connection.
+
+    With the ``keeper`` engine the row lives in a KeeperMap table written in
+    strict mode, so only one insert of the row can succeed. The ``table``
+    engine needs no Keeper: a contender that finds no live lease inserts its
+    own row and the oldest live lease wins. It is enough to keep deploys that start together
+    from running the same DDL, but two inserts that commit at the very same
+    time may both win.
+
+    ``policy`` decides what happens while another process holds the lock:
+    ``fail`` and ``skip`` give up at once, ``wait`` polls until the lock is
+    free or ``timeout`` seconds have passed.
+
+    After each renewal the holder is read back. Once the lease was taken
+    over, or couldn't be renewed before it ran out, :meth:`check` raises
+    :class:`LockLost`, so the client stops before its next statement.
+    """
+
+    def __init__(
+        self,
+        db,
+        engine="table",
+        policy="fail",
+        lease=None,
+        timeout=None,
+        name="migrations",
+        poll=1.0,
+        sleep=time.sleep,
+        clock=time.monotonic,
+    ):
+        if engine not in LOCK_ENGINES[1:]:
+            raise ValueError(
+                f"Unknown HOUSEPLANT_LOCK '{engine}', "
+                f"expected one of {', '.join(LOCK_ENGINES)}"
+            )
+        if policy not in LOCK_POLICIES:
+            raise ValueError(
+                f"Unknown HOUSEPLANT_LOCK_POLICY '{policy}', "
+                f"expected one of {', '.join(LOCK_POLICIES)}"
+            )
+
+        self.db = db
+        self.engine = engine
+        self.policy = policy
+        self.lease = float(lease or 60)
+        self.timeout = float(timeout or 600)
+        self.name = name
+        self.poll = poll
+        self.sleep = sleep
+        self.clock = clock
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = False
+        self.lost = None
+        self.console = Console(stderr=True)
+        self._stop = threading.Event()
+        self._renewer = None
+
+    @property
+    def _params(self):
+        return {
+            "name": self.name,
+            "owner": self.owner,
+            "lease": int(self.lease * 1000),
+        }
+
+    def _execute(self, query, params=None, settings=None, client=None):
+        client = client or self.db.client
+        try:
+            return client.execute(query, params, settings=settings)
+        except ServerException as e:
+            if e.code != UNKNOWN_TABLE or LOCK_TABLE not in e.message:
+                raise
+        self.create_table()
+        return client.execute(query, params, settings=settings)
+
+    def create_table(self):
+        cluster_clause = (
+            f"ON CLUSTER '{self.db.cluster}'" if self.db.cluster is not None else ""
+        )
+        if self.engine == "keeper":
+            engine = f"KeeperMap('/houseplant/{self.db.database}/{LOCK_TABLE}')"
+            key = "PRIMARY KEY name"
+        else:
+            engine = (
+                "ReplicatedReplacingMergeTree(updated_at)"
+                if self.db.cluster is not None
+                else "ReplacingMergeTree(updated_at)"
+            )
+            # Every attempt writes rows under a new owner, released and expired
+            # leases are dropped by merges
+            key = (
+                "ORDER BY (name, owner)\n"
+                "            TTL toDateTime(expires_at) + INTERVAL 1 DAY"
+            )
+
+        self.db.client.execute(f"""
+            CREATE TABLE IF NOT EXISTS {LOCK_TABLE} {cluster_clause} (
+                name String,
+                owner String,
+                acquired_at DateTime64(3, 'UTC'),
+                expires_at DateTime64(3, 'UTC'),
+                updated_at DateTime64(6, 'UTC')
+            )
+            ENGINE = {engine}
+            {key}
+        """)
+
+    def _insert(self):
+        self._execute(
+            f"""
+            INSERT INTO {LOCK_TABLE}
+            SELECT
+                %(name)s,
+                %(owner)s,
+                now64(3),
+                now64(3) + toIntervalMillisecond(%(lease)s),
+                now64(6)
+            """,
+            self._params,
+            settings={"keeper_map_strict_mode": 1} if self.engine == "keeper" else None,
+        )
+
+    def _holder(self, client=None):
+        """Return ``(owner, live)`` of the lease that holds the lock, if any."""
+        final = "FINAL" if self.engine == "table" else ""
+        rows = self._execute(
+            f"""
+            SELECT owner, expires_at > now64(3) AS live
+            FROM {LOCK_TABLE} {final}
+            WHERE name = %(name)s
+            ORDER BY live DESC, acquired_at, owner
+            LIMIT 1
+            """,
+            {"name": self.name},
+            client=client,
+        )
+        return (rows[0][0], bool(rows[0][1])) if rows else None
+
+    def _delete(self, owner, expired=False):
+        params = {"name": self.name, "owner": owner}
+        if self.engine == "keeper":
+            condition = "name = %(name)s AND owner = %(owner)s"
+            if expired:
+                condition += " AND expires_at <= now64(3)"
+            self._execute(f"ALTER TABLE {LOCK_TABLE} DELETE WHERE {condition}", params)
+        else:
+            self._execute(
+                f"""
+                INSERT INTO {LOCK_TABLE}
+                SELECT %(name)s, %(owner)s, now64(3), toDateTime64(0, 3, 'UTC'), now64(6)
+                """,
+                params,
+            )
+
+    def try_acquire(self):
+        """Take the lock if it's free and return None, else return its holder."""
+        self.db.mark_written()
+
+        if self.engine == "table":
+            # Waiting only reads, rows are written when the lock looks free
+            holder = self._holder()
+            if holder and holder[1] and holder[0] != self.owner:
+                return holder[0]
+            self._insert()
+            owner, live = self._holder() or (None, False)
+            if owner == self.owner and live:
+                return None
+            self._delete(self.owner)
+            return owner or "another process"
+
+        holder = None
+        for _ in range(3):
+            try:
+                self._insert()
+                return None
+            except ServerException as e:
+                if e.code != KEEPER_EXCEPTION:
+                    raise
+            holder = self._holder()
+            if holder is None:
+                continue
+            owner, live = holder
+            if live:
+                return owner
+            # The lease of a process that died has run out
+            self._delete(owner, expired=True)
+        return holder[0] if holder else "another process"
+
+    def acquire(self):
+        """Take the lock according to ``policy``, then keep renewing it.
+
+        Raises :class:`LockNotAcquired` when the lock is held elsewhere and
+        the policy gives up.
+        """
+        deadline = self.clock() + self.timeout
+        holder = self.try_acquire()
+        waiting = None
+        while holder is not None:
+            if self.policy != "wait" or self.clock() >= deadline:
+                raise LockNotAcquired(holder)
+            if holder != waiting:
+                self.console.print(
+                    f"[yellow]⏸[/yellow] Waiting for the migration lock held by {holder}"
+                )
+                waiting = holder
+            self.sleep(self.poll)
+            holder = self.try_acquire()
+
+        self.held = True
+        self.lost = None
+        self.db.lock = self
+        self._stop.clear()
+        self._renewer = threading.Thread(target=self._heartbeat, daemon=True)
+        self._renewer.start()
+
+    def renew(self, client):
+        """Extend the lease by ``lease`` seconds from now."""
+        if self.engine == "keeper":
+            query = f"""
+                ALTER TABLE {LOCK_TABLE}
+                UPDATE expires_at = now64(3) + toIntervalMillisecond(%(lease)s)
+                WHERE name = %(name)s AND owner = %(owner)s
+            """
+        else:
+            query = f"""
+                INSERT INTO {LOCK_TABLE}
+                SELECT
+                    name,
+                    owner,
+                    acquired_at,
+                    now64(3) + toIntervalMillisecond(%(lease)s),
+                    now64(6)
+                FROM {LOCK_TABLE} FINAL
+                WHERE name = %(name)s AND owner = %(owner)s
+            """
+        client.execute(query, self._params)
+
+    def _heartbeat(self):
+        # Connections are not thread-safe, so renewals get their own
+        client = self.db.clone().client
+        renewed_at = self.clock()
+        try:
+            while not self._stop.wait(self.lease / 3):
+                try:
+                    self.renew(client)
+                    owner, live = self._holder(client) or (None, False)
+                except Exception as e:
+                    self.console.print(
+                        f"[yellow]⚠[/yellow] Failed to renew the migration lock: {e}"
+                    )
+                    if self.clock() - renewed_at >= self.lease:
+                        self.lost = "another process"
+                        return
+                    continue
+
+                # Renewals of a lease that was taken over change nothing
+                if owner != self.owner or not live:
+                    taken = owner not in (None, self.owner)
+                    self.lost = owner if taken else "another process"
+                    return
+                renewed_at = self.clock()
+        finally:
+            client.disconnect()
+
+    def check(self):
+        """Raise :class:`LockLost` if the lease is no longer held."""
+        if self.lost is not None:
+            raise LockLost(self.lost)
+
+    def release(self):
+        """Stop renewing the lease and free the lock."""
+        if not self.held:
+            return
+        self._stop.set()
+        if self._renewer is not None:
+            self._renewer.join()
+            self._renewer = None
+        self.held = False
+        if self.db.lock is self:
+            self.db.lock = None
+        self._delete(self.owner)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,46 @@
+"""Machine-readable output of houseplant commands."""
+
+import json
+import sys
+from enum import Enum
+
+
+class OutputFormat(str, Enum):
+    text = "text"
+    json = "json"
+    ndjson = "ndjson"
+
+
+class RecordWriter:
+    """Write records to a stream as soon as they are produced.
+
+    ``ndjson`` writes one JSON object per line. ``json`` writes a single
+    array, whose elements are still written one by one so nothing is
+    buffered in memory.
+    """
+
+    def __init__(self, output_format: str = "ndjson", stream=None):
+        self.format = OutputFormat(output_format)
+        self.stream = stream or sys.stdout
+        self._count = 0
+
+    def write(self, record: dict):
+        line = json.dumps(record, default=str)
+        if self.format == OutputFormat.json:
+            line = ("[" if not self._count else ",") + "\n  " + line
+        else:
+            line += "\n"
+        self.stream.write(line)
+        self.stream.flush()
+        self._count += 1
+
+    def close(self):
+        if self.format == OutputFormat.json:
+            self.stream.write("[]\n" if not self._count else "\n]\n")
+            self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,143 @@
+"""Pytest plugin providing migrated ClickHouse databases to tests.
+
+The plugin is registered automatically when houseplant is installed. It
+builds a template database from ``ch/schema.sql`` once per session and
+gives every test that requests the ``houseplant_db`` fixture its own clone
+of it, so tests never replay migrations.
+
+Tables are cloned with ``CREATE TABLE ... AS`` and their data is copied by
+attaching the template partitions, which only hardlinks parts on the
+server. Each pytest-xdist worker builds its own template, so clones never
+collide between workers.
+
+The schema file can be changed with the ``houseplant_schema`` ini option.
+"""
+
+import itertools
+import os
+import time
+
+import pytest
+
+from .clickhouse_client import ClickHouseClient
+from .sql import dependency_order, parse_create, parse_schema, requalify
+
+_clone_counter = itertools.count()
+
+
+def pytest_addoption(parser):
+    parser.addini(
+        "houseplant_schema",
+        "Schema file used to build the houseplant template database.",
+        default="ch/schema.sql",
+    )
+
+
+def build_template(template: str, schema_path, migrations_dir) -> ClickHouseClient:
+    """Create ``template`` from a schema file and mark its migrations applied."""
+    with open(schema_path) as f:
+        schema = parse_schema(f.read())
+
+    admin = ClickHouseClient(database="default")
+    admin.client.execute(f"CREATE DATABASE IF NOT EXISTS {template}")
+
+    client = ClickHouseClient(database=template)
+    client.init_migrations_table()
+
+    for statement in schema["tables"] + dependency_order(
+        schema["dictionaries"] + schema["materialized_views"]
+    ):
+        database, _ = parse_create(statement) or (None, None)
+        if database:
+            statement = requalify(statement, database, template)
+        client.client.execute(statement)
+
+    if os.path.exists(migrations_dir):
+        versions = sorted(
+            f.split("_")[0] for f in os.listdir(migrations_dir) if f.endswith(".yml")
+        )
+        client.mark_migrations_applied(
+            [version for version in versions if version <= schema["version"]]
+        )
+
+    return client
+
+
+def clone_database(client, template: str, clone: str):
+    """Clone every object of ``template`` into a new ``clone`` database."""
+    client.execute(f"CREATE DATABASE `{clone}`")
+
+    # Views without TO create their own .inner table
+    objects = client.execute(
+        """
+        SELECT name, engine, create_table_query
+        FROM system.tables
+        WHERE database = %(database)s AND NOT startsWith(name, '.inner')
+        ORDER BY name
+        """,
+        {"database": template},
+    )
+    partitions = dict(
+        client.execute(
+            """
+            SELECT table, groupUniqArray(partition_id)
+            FROM system.parts
+            WHERE database = %(database)s AND active
+            GROUP BY table
+            """,
+            {"database": template},
+        )
+    )
+
+    tables = [obj for obj in objects if "MergeTree" in obj[1]]
+    dictionaries = [obj for obj in objects if obj[1] == "Dictionary"]
+    views = [obj for obj in objects if obj[1] in ("MaterializedView", "View")]
+
+    for name, _, _ in tables:
+        source = f"`{template}`.`{name}`"
+        target = f"`{clone}`.`{name}`"
+        client.execute(f"CREATE TABLE {target} AS {source}")
+        for partition_id in partitions.get(name, []):
+            client.execute(
+                f"ALTER TABLE {target} "
+                f"ATTACH PARTITION ID '{partition_id}' FROM {source}"
+            )
+
+    for create_query in dependency_order(
+        [create_query for _, _, create_query in dictionaries + views]
+    ):
+        client.execute(requalify(create_query, template, clone))
+
+
+@pytest.fixture(scope="session")
+def houseplant_template(request):
+    """Name of a template database built from the project schema."""
+    worker = os.getenv("PYTEST_XDIST_WORKER", "main")
+    template = f"houseplant_template_{worker}_{time.time_ns()}"
+    schema_path = request.config.rootpath / request.config.getini("houseplant_schema")
+    migrations_dir = schema_path.parent / "migrations"
+
+    client = build_template(template, schema_path, migrations_dir)
+    client.client.disconnect()
+
+    yield template
+
+    admin = ClickHouseClient(database="default")
+    admin.client.execute(f"DROP DATABASE IF EXISTS {template}")
+    admin.client.disconnect()
+
+
+@pytest.fixture
+def houseplant_db(houseplant_template):
+    """ClickHouseClient connected to a fresh clone of the template database."""
+    clone = f"{houseplant_template}_{next(_clone_counter)}"
+
+    admin = ClickHouseClient(database="default")
+    clone_database(admin.client, houseplant_template, clone)
+
+    client = ClickHouseClient(database=clone)
+    yield client
+
+    client.client.disconnect()
+    admin.client.execute(f"DROP DATABASE IF EXISTS {clone}")
+    admin.client.disconnect()
@@ -0,0 +1,83 @@
+"""Thin client for the ``houseplant serve`` daemon.
+
+Only the standard library is imported so that a command answered by the
+daemon doesn't pay for loading the ClickHouse driver, Rich or YAML.
+"""
+
+import json
+import os
+import shutil
+import socket
+import sys
+
+DEFAULT_SOCKET = "ch/.houseplant.sock"
+
+USAGE = """Usage: houseplant-remote COMMAND [VERSION | STEP=n]
+
+Send a command to the daemon started by 'houseplant serve'.
+
+Commands: migrate:status, migrate, migrate:up, migrate:down, migrate:check,
+ping, shutdown
+"""
+
+
+def socket_path(path=None, root=None) -> str:
+    """Return the socket of the daemon, by default in the ch/ of ``root``."""
+    return str(
+        path
+        or os.getenv("HOUSEPLANT_SOCKET")
+        or os.path.join(root or "", DEFAULT_SOCKET)
+    )
+
+
+def request(command: str, args: dict | None = None, path=None, **options) -> dict:
+    """Send one command to the daemon and return its response.
+
+    ``options`` are passed along with the request, e.g. the ``width`` and
+    ``color`` of the terminal the output is rendered for.
+    """
+    message = {"command": command, "args": args or {}, **options}
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path(path))
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+
+    if not line:
+        raise ConnectionError("The houseplant daemon closed the connection")
+    return json.loads(line)
+
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ("-h", "--help"):
+        sys.stderr.write(USAGE)
+        return 2
+
+    command, *rest = argv
+    version = rest[0] if rest else os.getenv("VERSION")
+    step = os.getenv("STEP")
+    if version and version.startswith("STEP="):
+        version, step = None, version
+
+    try:
+        response = request(
+            command,
+            {"version": version, "step": step},
+            width=shutil.get_terminal_size().columns,
+            color=sys.stdout.isatty(),
+        )
+    except (FileNotFoundError, ConnectionRefusedError):
+        sys.stderr.write(
+            f"No houseplant daemon is listening on {socket_path()}, "
+            "start one with 'houseplant serve'\n"
+        )
+        return 1
+
+    sys.stdout.write(response["output"])
+    return response["exit_code"]
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+"""Retries of migration statements after transient failures."""
+
+import os
+import time
+
+from clickhouse_driver.errors import NetworkError, ServerException
+from rich.console import Console
+
+from .sql import is_idempotent
+
+# Server error codes that say nothing about the statement itself
+RETRYABLE_CODES = {
+    159,  # TIMEOUT_EXCEEDED
+    202,  # TOO_MANY_SIMULTANEOUS_QUERIES
+    203,  # NO_FREE_CONNECTION
+    209,  # SOCKET_TIMEOUT
+    210,  # NETWORK_ERROR
+    242,  # TABLE_IS_READ_ONLY, while a replica reconnects to Keeper
+    252,  # TOO_MANY_PARTS
+    285,  # TOO_FEW_LIVE_REPLICAS
+    319,  # UNKNOWN_STATUS_OF_INSERT
+    425,  # SYSTEM_ERROR
+    999,  # KEEPER_EXCEPTION
+}
+
+
+class RetryPolicy:
+    """Retry statements that failed for reasons unrelated to their SQL.
+
+    A failure is retried when the error is transient (a network error or
+    one of ``RETRYABLE_CODES``) and the statement is safe to run twice,
+    since a statement that timed out may still have been applied. Before
+    each retry the connection is dropped so the next attempt reconnects.
+    Settings missing from the arguments are read from ``env``, the process
+    environment by default.
+    """
+
+    def __init__(
+        self,
+        attempts=None,
+        backoff=None,
+        max_backoff=None,
+        retryable_codes=RETRYABLE_CODES,
+        sleep=time.sleep,
+        env=None,
+    ):
+        env = os.environ if env is None else env
+        self.attempts = int(attempts or env.get("HOUSEPLANT_RETRY_ATTEMPTS", 3))
+        self.backoff = float(backoff or env.get("HOUSEPLANT_RETRY_BACKOFF", 1.0))
+        self.max_backoff = float(
+            max_backoff or env.get("HOUSEPLANT_RETRY_MAX_BACKOFF", 30.0)
+        )
+        self.retryable_codes = retryable_codes
+        self.sleep = sleep
+        self.console = Console(stderr=True)
+
+    def is_retryable(self, error: Exception) -> bool:
+        """Return whether an error is worth another attempt."""
+        if isinstance(error, ServerException):
+            return error.code in self.retryable_codes
+        return isinstance(error, (NetworkError, EOFError, OSError))
+
+    def run(self, client, query, params=None, settings=None, idempotent=None):
+        """Execute ``query`` on the driver ``client``, retrying if it's safe.
+
+        ``idempotent`` defaults to what :func:`houseplant.sql.is_idempotent`
+        infers from the query.
+        """
+        if idempotent is None:
+            idempotent = is_idempotent(query)
+
+        backoff = self.backoff
+        for attempt in range(1, self.attempts + 1):
+            try:
+                if params is None:
+                    return client.execute(query, settings=settings)
+                return client.execute(query, params, settings=settings)
+            except Exception as e:
+                if (
+                    attempt == self.attempts
+                    or not idempotent
+                    or not self.is_retryable(e)
+                ):
+                    raise
+
+                delay = min(backoff, self.max_backoff)
+                message = str(getattr(e, "message", e)).strip().splitlines()
+                self.console.print(
+                    f"[yellow]↻[/yellow] {type(e).__name__}: "
+                    f"{message[0] if message else ''}, retrying in {delay:.0f}s "
+                    f"({attempt}/{self.attempts - 1})"
+                )
+                client.disconnect()
+                self.sleep(delay)
+                backoff *= 2
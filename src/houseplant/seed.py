@@ -0,0 +1,188 @@
+"""Reading of seed files in bounded blocks of columns."""
+
+import csv
+import datetime
+import decimal
+import json
+import os
+import re
+
+SEED_FORMATS = {
+    ".csv": "csv",
+    ".ndjson": "ndjson",
+    ".jsonl": "ndjson",
+    ".parquet": "parquet",
+}
+
+# Rows per INSERT, so memory stays flat whatever the size of the file
+DEFAULT_BLOCK_SIZE = 65536
+
+TRUE_VALUES = ("true", "t", "yes", "y", "1")
+
+
+class SeedError(ValueError):
+    """Raised when a seed file can't be read into its table."""
+
+
+def seed_format(path: str) -> str:
+    """Return the format of a seed file from its extension."""
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in SEED_FORMATS:
+        raise SeedError(
+            f"unknown seed format '{extension}', "
+            f"expected one of {', '.join(sorted(SEED_FORMATS))}"
+        )
+    return SEED_FORMATS[extension]
+
+
+def _unwrap(type_: str, wrapper: str):
+    match = re.match(rf"^{wrapper}\((.*)\)$", type_)
+    return match.group(1) if match else None
+
+
+def _decimal(value: str):
+    # Decimal raises InvalidOperation, an ArithmeticError, on bad input
+    try:
+        return decimal.Decimal(value)
+    except decimal.InvalidOperation:
+        raise ValueError(f"invalid literal for Decimal: {value!r}")
+
+
+def converter(type_: str):
+    """Return a function turning the text of a value into its ClickHouse type.
+
+    ``\\N`` is NULL. So is an empty value of a Nullable column that isn't a
+    string. Arrays, maps and tuples are parsed as JSON.
+    """
+    type_ = _unwrap(type_, "LowCardinality") or type_
+    inner = _unwrap(type_, "Nullable")
+    if inner is not None:
+        convert = converter(inner)
+        is_string = re.match(r"^(String|FixedString|Enum)", inner) is not None
+
+        def nullable(value):
+            if value == "\\N" or (value == "" and not is_string):
+                return None
+            return convert(value)
+
+        return nullable
+
+    if re.match(r"^U?Int\d+$", type_):
+        return int
+    if re.match(r"^(Float|BFloat)\d+$", type_):
+        return float
+    if type_.startswith("Decimal"):
+        return _decimal
+    if type_ == "Bool":
+        return lambda value: value.lower() in TRUE_VALUES
+    if type_ in ("Date", "Date32"):
+        return datetime.date.fromisoformat
+    if type_.startswith("DateTime"):
+        return datetime.datetime.fromisoformat
+    if re.match(r"^(Array|Map|Tuple)\(", type_):
+        return json.loads
+    return str
+
+
+def _check_columns(path, names, columns):
+    unknown = [name for name in names if name not in columns]
+    if unknown:
+        raise SeedError(f"{path}: unknown columns {', '.join(unknown)}")
+
+
+def _csv_blocks(path, columns, block_size):
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        names = next(reader, None)
+        if not names:
+            return
+        _check_columns(path, names, columns)
+        converters = [converter(columns[name]) for name in names]
+
+        block = [[] for _ in names]
+        for line, row in enumerate(reader, start=2):
+            if not row:
+                continue
+            if len(row) != len(names):
+                raise SeedError(
+                    f"{path}:{line}: expected {len(names)} values, got {len(row)}"
+                )
+            try:
+                for values, convert, value in zip(block, converters, row):
+                    values.append(convert(value))
+            except ValueError as e:
+                raise SeedError(f"{path}:{line}: {e}")
+            if len(block[0]) == block_size:
+                yield names, block
+                block = [[] for _ in names]
+        if block[0]:
+            yield names, block
+
+
+def _ndjson_block(path, records, columns):
+    keys = set().union(*(record for _, record in records))
+    _check_columns(path, sorted(keys), columns)
+    # Keys missing from a record are inserted as NULL
+    names = [name for name in columns if name in keys]
+    converters = {name: converter(columns[name]) for name in names}
+
+    block = [[] for _ in names]
+    for line, record in records:
+        try:
+            for values, name in zip(block, names):
+                value = record.get(name)
+                if isinstance(value, str):
+                    value = converters[name](value)
+                values.append(value)
+        except ValueError as e:
+            raise SeedError(f"{path}:{line}: {e}")
+    return names, block
+
+
+def _ndjson_blocks(path, columns, block_size):
+    with open(path) as f:
+        records = []
+        for line, text in enumerate(f, start=1):
+            if not text.strip():
+                continue
+            try:
+                record = json.loads(text)
+            except ValueError as e:
+                raise SeedError(f"{path}:{line}: {e}")
+            if not isinstance(record, dict):
+                raise SeedError(f"{path}:{line}: expected a JSON object")
+            records.append((line, record))
+            if len(records) == block_size:
+                yield _ndjson_block(path, records, columns)
+                records = []
+        if records:
+            yield _ndjson_block(path, records, columns)
+
+
+def _parquet_blocks(path, columns, block_size):
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise SeedError(
+            "Parquet seeds need pyarrow, install it with 'pip install houseplant[seed]'"
+        )
+
+    parquet = pyarrow.parquet.ParquetFile(path)
+    names = parquet.schema_arrow.names
+    _check_columns(path, names, columns)
+    for batch in parquet.iter_batches(batch_size=block_size):
+        yield names, [column.to_pylist() for column in batch.columns]
+
+
+READERS = {"csv": _csv_blocks, "ndjson": _ndjson_blocks, "parquet": _parquet_blocks}
+
+
+def read_blocks(path: str, columns: dict, block_size: int = DEFAULT_BLOCK_SIZE):
+    """Yield ``(names, block)`` for every ``block_size`` rows of a seed file.
+
+    ``columns`` maps the columns of the target table to their types. Each
+    block holds one list of values per column in ``names``, converted to the
+    Python types ``clickhouse_driver`` inserts. Only one block is held in
+    memory at a time.
+    """
+    return READERS[seed_format(path)](path, columns, block_size)
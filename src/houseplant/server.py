@@ -0,0 +1,128 @@
+"""Local daemon that answers houseplant commands over a Unix socket."""
+
+import io
+import json
+import os
+import socket
+import socketserver
+import threading
+
+from rich.console import Console
+
+from .houseplant import Houseplant
+from .remote import socket_path
+from .utils import SETTINGS_FILE
+
+COMMANDS = {
+    "ping": lambda houseplant, args: "pong",
+    "migrate:status": lambda houseplant, args: houseplant.migrate_status(),
+    "migrate": lambda houseplant, args: houseplant.migrate(args.get("version")),
+    "migrate:up": lambda houseplant, args: houseplant.migrate_up(args.get("version")),
+    "migrate:down": lambda houseplant, args: houseplant.migrate_down(
+        args.get("version"), args.get("step")
+    ),
+    "migrate:check": lambda houseplant, args: houseplant.migrate_check(),
+}
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {"output": "Invalid request\n", "exit_code": 2}
+            else:
+                response = self.server.dispatch(request)
+
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class HouseplantServer(socketserver.UnixStreamServer):
+    """Answer commands from ``houseplant-remote`` with a warm Houseplant.
+
+    The connection to ClickHouse stays open between commands and parsed
+    migrations are cached until their files change, so a command only costs
+    the queries it needs. Commands run one at a time.
+    """
+
+    def __init__(self, houseplant: Houseplant, path=None):
+        self.houseplant = houseplant
+        houseplant._migration_cache = {}
+        self.path = socket_path(path, houseplant.root)
+        self._settings_mtime = self._mtime(houseplant._path(SETTINGS_FILE))
+
+        if os.path.exists(self.path):
+            if self._is_listening(self.path):
+                raise RuntimeError(f"A daemon is already listening on {self.path}")
+            os.unlink(self.path)
+
+        super().__init__(self.path, RequestHandler)
+
+    @staticmethod
+    def _mtime(path):
+        return os.stat(path).st_mtime_ns if os.path.exists(path) else None
+
+    @staticmethod
+    def _is_listening(path) -> bool:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            try:
+                sock.connect(path)
+            except OSError:
+                return False
+        return True
+
+    def _refresh(self):
+        """Forget settings profiles when ch/settings.yml changed."""
+        mtime = self._mtime(self.houseplant._path(SETTINGS_FILE))
+        if mtime != self._settings_mtime:
+            self.houseplant.__dict__.pop("settings_profiles", None)
+            self._settings_mtime = mtime
+
+    def dispatch(self, request: dict) -> dict:
+        """Run one command and return its output and exit code."""
+        command = request.get("command")
+        if command == "shutdown":
+            threading.Thread(target=self.shutdown).start()
+            return {"output": "", "exit_code": 0}
+        if command not in COMMANDS:
+            return {"output": f"Unknown command '{command}'\n", "exit_code": 2}
+
+        self._refresh()
+
+        # Render for the terminal of the client, not the one of the daemon
+        output = io.StringIO()
+        console = self.houseplant.console
+        self.houseplant.console = Console(
+            file=output,
+            force_terminal=request.get("color", False),
+            width=request.get("width", 80),
+        )
+        try:
+            result = COMMANDS[command](self.houseplant, request.get("args") or {})
+            exit_code = 1 if result is False else 0
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            self.houseplant.console.print(f"[red]Error:[/red] {e}")
+            exit_code = 1
+        finally:
+            self.houseplant.console = console
+
+        return {"output": output.getvalue(), "exit_code": exit_code}
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def serve(houseplant: Houseplant, path=None):
+    """Serve commands until interrupted or sent ``shutdown``."""
+    with HouseplantServer(houseplant, path) as server:
+        houseplant.console.print(f"🌱 Listening on {server.path}, press Ctrl+C to stop")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,406 @@
+"""Helpers for working with ClickHouse SQL text."""
+
+import hashlib
+import itertools
+import re
+
+SCHEMA_SECTIONS = {
+    "-- TABLES": "tables",
+    "-- MATERIALIZED VIEWS": "materialized_views",
+    "-- DICTIONARIES": "dictionaries",
+}
+
+CREATE_PATTERN = re.compile(
+    r"^\s*CREATE\s+(?:OR\s+REPLACE\s+)?"
+    r"(TABLE|MATERIALIZED\s+VIEW|VIEW|DICTIONARY)\s+"
+    r"(?:IF\s+NOT\s+EXISTS\s+)?"
+    r"(?:`?(\w+)`?\.)?`?(\w+)`?",
+    re.IGNORECASE,
+)
+
+
+SQL_QUOTES = ("'", '"', "`")
+# What ends the current state of the splitter, by state
+SPLITTER_TOKENS = {
+    None: re.compile(r"[;'\"`]|--|/\*"),
+    "'": re.compile(r"\\[\s\S]|''|'"),
+    '"': re.compile(r'\\[\s\S]|""|"'),
+    "`": re.compile(r"\\[\s\S]|``|`"),
+    "--": re.compile(r"\n"),
+    "/*": re.compile(r"\*/"),
+}
+# Trailing characters that may start a token continued in the next chunk
+SPLITTER_CARRY = {None: "-/", "'": "\\'", '"': '\\"', "`": "\\`", "/*": "*"}
+
+SQL_CHUNK_SIZE = 65536
+
+
+def iter_statements(chunks):
+    """Yield the statements of SQL text given as an iterable of chunks.
+
+    Semicolons inside string literals, quoted identifiers and comments don't
+    end a statement. Comments before a statement are dropped. Only the
+    statement being read is kept in memory, so the text can be streamed.
+    """
+    state = None
+    parts = []
+    has_code = False
+    carry = ""
+
+    def finish():
+        nonlocal parts, has_code
+        statement = "".join(parts).strip() if has_code else ""
+        parts, has_code = [], False
+        return statement
+
+    for chunk in itertools.chain(chunks, [None]):
+        final = chunk is None
+        text = carry + (chunk or "")
+        carry = ""
+        pos = 0
+        while pos < len(text):
+            match = SPLITTER_TOKENS[state].search(text, pos)
+            end = match.start() if match else len(text)
+
+            # A token may be cut in two at the end of the chunk, like a quote
+            # that is doubled by the first character of the next chunk
+            if match is None:
+                cut = text[-1] in SPLITTER_CARRY.get(state, "")
+            else:
+                cut = (
+                    state in SQL_QUOTES
+                    and match.group() == state
+                    and match.end() == len(text)
+                )
+            if cut and not final:
+                end = len(text) - 1
+                match = None
+                carry = text[end]
+
+            segment = text[pos:end]
+            if state is None or state in SQL_QUOTES:
+                has_code = has_code or bool(segment.strip()) or state is not None
+            if has_code:
+                parts.append(segment)
+            if match is None:
+                break
+
+            token = match.group()
+            pos = match.end()
+            if state is None and token == ";":
+                statement = finish()
+                if statement:
+                    yield statement
+                continue
+
+            if state is None:
+                state = token
+                has_code = has_code or token not in ("--", "/*")
+            elif token in ("\n", "*/") or token == state:
+                state = None
+            if has_code:
+                parts.append(token)
+
+        if final:
+            statement = finish()
+            if statement:
+                yield statement
+
+
+def read_statements(path, chunk_size: int = SQL_CHUNK_SIZE):
+    """Yield the statements of a SQL file, reading it ``chunk_size`` at a time."""
+    with open(path) as f:
+        yield from iter_statements(iter(lambda: f.read(chunk_size), ""))
+
+
+def split_statements(sql: str) -> list[str]:
+    """Split a migration body into its individual statements."""
+    return list(iter_statements([sql]))
+
+
+def parse_schema(text: str) -> dict:
+    """Parse the contents of ch/schema.sql written by ``update_schema``.
+
+    Returns the schema version and the CREATE statements of each section,
+    in the same shape as ``ClickHouseClient.get_database_schema``.
+    """
+    schema = {
+        "version": "0",
+        "tables": [],
+        "materialized_views": [],
+        "dictionaries": [],
+    }
+    sections = {}
+    current = None
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("-- version:"):
+            schema["version"] = stripped.split(":", 1)[1].strip()
+        elif stripped in SCHEMA_SECTIONS:
+            current = SCHEMA_SECTIONS[stripped]
+            sections[current] = []
+        elif current is not None:
+            sections[current].append(line)
+
+    for category, lines in sections.items():
+        body = "\n".join(lines).strip()
+        statements = re.split(r"\n;\n", body)
+        schema[category] = [
+            statement.strip().rstrip(";").strip()
+            for statement in statements
+            if statement.strip().rstrip(";").strip()
+        ]
+
+    return schema
+
+
+def parse_create(statement: str):
+    """Return the ``(database, name)`` created by a CREATE statement.
+
+    ``database`` is None for unqualified names. Returns None if the
+    statement is not a CREATE statement.
+    """
+    match = CREATE_PATTERN.match(statement)
+    if not match:
+        return None
+    return match.group(2), match.group(3)
+
+
+def dependency_order(statements: list[str]) -> list[str]:
+    """Order CREATE statements so that each one follows the objects it reads.
+
+    A statement is taken to read every other object whose name it mentions
+    after its own name, like the source table of a dictionary. Statements
+    without dependencies, or caught in a cycle, keep their order.
+    """
+    bodies = []
+    names = []
+    for statement in statements:
+        match = CREATE_PATTERN.match(statement)
+        bodies.append(statement[match.end() :] if match else statement)
+        names.append(match.group(3) if match else None)
+
+    def reads(i, j):
+        pattern = rf"(?<!\w){re.escape(names[j])}(?!\w)"
+        return names[j] != names[i] and re.search(pattern, bodies[i]) is not None
+
+    remaining = list(range(len(statements)))
+    ordered = []
+    while remaining:
+        ready = next(
+            (
+                i
+                for i in remaining
+                if not any(names[j] and reads(i, j) for j in remaining if j != i)
+            ),
+            remaining[0],
+        )
+        remaining.remove(ready)
+        ordered.append(statements[ready])
+    return ordered
+
+
+def requalify(statement: str, database: str, new_database: str | None = None):
+    """Replace references to ``database`` with ``new_database``.
+
+    Without ``new_database`` the qualifier is dropped so the statement
+    applies to the current database of the connection.
+    """
+    pattern = re.compile(r"(?<![\w.`])(`?)" + re.escape(database) + r"\1\.")
+    replacement = f"{new_database}." if new_database else ""
+    return pattern.sub(replacement, statement)
+
+
+def normalize_create(statement: str, database: str | None = None) -> str:
+    """Normalize a CREATE statement so that only its meaning is compared.
+
+    Whitespace is collapsed, spaces around parentheses and commas are dropped
+    and references to ``database`` are removed, so the pretty output of SHOW
+    CREATE and the one-line ``create_table_query`` of system.tables match.
+    ``ClickHouseClient.get_schema_hashes`` runs the same steps on the server.
+    """
+    statement = statement.strip().rstrip(";")
+    if database:
+        statement = statement.replace(f"`{database}`.", "")
+        statement = statement.replace(f"{database}.", "")
+    statement = re.sub(r"\s+", " ", statement)
+    return re.sub(r" ?([(),]) ?", r"\1", statement).strip()
+
+
+def schema_hash(statement: str) -> str:
+    """Return the SHA256 of a normalized CREATE statement, as hex."""
+    return hashlib.sha256(statement.encode()).hexdigest()
+
+
+def like_pattern(name: str) -> str:
+    """Turn a name with ``*`` wildcards into a pattern for LIKE.
+
+    ``%``, ``_`` and backslashes in the name are escaped, so only ``*``
+    matches anything.
+    """
+    return re.sub(r"([\\%_])", r"\\\1", name).replace("*", "%")
+
+
+def schema_fingerprint(hashes: dict) -> str:
+    """Combine the ``{name: hash}`` of every object into one schema hash."""
+    return schema_hash(
+        "\n".join(sorted(f"{name} {digest}" for name, digest in hashes.items()))
+    )
+
+
+INSERT_SELECT_PATTERN = re.compile(
+    r"^\s*INSERT\s+INTO\s+.*?\b(SELECT|WITH)\b", re.IGNORECASE | re.DOTALL
+)
+CREATE_SELECT_PATTERN = re.compile(
+    r"^\s*CREATE\s+(?:TABLE|MATERIALIZED\s+VIEW)\b.*?\bAS\s+(SELECT|WITH)\b",
+    re.IGNORECASE | re.DOTALL,
+)
+ALTER_PATTERN = re.compile(
+    r"^\s*ALTER\s+TABLE\s+(?:`?(?:\w+)`?\.)?`?(\w+)`?"
+    r"(?:\s+ON\s+CLUSTER\s+\S+)?\s+(.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+
+# ALTER commands that only touch metadata or whole partitions
+METADATA_COMMANDS = re.compile(
+    r"^(ADD|DROP|RENAME|COMMENT)\s+(COLUMN|INDEX|PROJECTION|CONSTRAINT)\b"
+    r"|^MODIFY\s+(TTL|SETTING|COMMENT|ORDER\s+BY|QUERY)\b"
+    r"|^RESET\s+SETTING\b"
+    r"|^MODIFY\s+COLUMN\s+\S+\s+(COMMENT|REMOVE)\b",
+    re.IGNORECASE,
+)
+PARTITION_COMMANDS = re.compile(
+    r"^(DROP|DETACH|ATTACH|FREEZE|UNFREEZE|FETCH|MOVE|REPLACE)\s+"
+    r"(PARTITION|PART)\b",
+    re.IGNORECASE,
+)
+
+
+def select_query(statement: str):
+    """Return the SELECT that feeds an INSERT or a populated CREATE, if any.
+
+    A materialized view only reads existing data when it is created with
+    POPULATE, so other views return None.
+    """
+    match = INSERT_SELECT_PATTERN.match(statement)
+    if match and re.search(r"\b(VALUES|FORMAT)\b", statement[: match.start(1)], re.I):
+        return None
+    if not match:
+        match = CREATE_SELECT_PATTERN.match(statement)
+        if match and re.match(r"^\s*CREATE\s+MATERIALIZED", statement, re.I):
+            if not re.search(r"\bPOPULATE\b", statement[: match.start(1)], re.I):
+                return None
+    if not match:
+        return None
+    return statement[match.start(1) :].strip()
+
+
+def alter_scope(statement: str):
+    """Return ``(table, scope)`` for an ALTER TABLE statement, or None.
+
+    ``scope`` is ``"metadata"`` when no data is rewritten, ``"partition"``
+    when whole partitions are moved or dropped and ``"rewrite"`` when the
+    command is a mutation that rewrites the parts of the table.
+    """
+    match = ALTER_PATTERN.match(statement)
+    if not match:
+        return None
+
+    table, commands = match.groups()
+    scopes = set()
+    for command in re.split(r",(?![^()]*\))", commands):
+        command = command.strip()
+        if METADATA_COMMANDS.match(command):
+            scopes.add("metadata")
+        elif PARTITION_COMMANDS.match(command):
+            scopes.add("partition")
+        else:
+            scopes.add("rewrite")
+
+    for scope in ["rewrite", "partition", "metadata"]:
+        if scope in scopes:
+            return table, scope
+
+
+CHANGE_PATTERN = re.compile(
+    r"^\s*(ALTER|DROP|RENAME|EXCHANGE)\s+"
+    r"(?:TEMPORARY\s+)?(?:TABLES?|VIEW|DICTIONARY|DICTIONARIES)\s+"
+    r"(?:IF\s+EXISTS\s+)?(.*)$",
+    re.IGNORECASE | re.DOTALL,
+)
+NAME_PATTERN = re.compile(r"\s*(?:`?\w+`?\.)?`?(\w+)`?")
+
+
+def changed_objects(statement: str) -> list[str]:
+    """Return the objects an ALTER, DROP, RENAME or EXCHANGE statement changes.
+
+    Both sides of a RENAME or EXCHANGE are changed. Other statements change
+    nothing.
+    """
+    match = CHANGE_PATTERN.match(statement)
+    if not match:
+        return []
+
+    verb, names = match.groups()
+    if verb.upper() in ("ALTER", "DROP"):
+        parts = [names]
+    else:
+        parts = re.split(r"\s+(?:TO|AND)\s+|,", names, flags=re.IGNORECASE)
+    return [
+        name.group(1) for name in map(NAME_PATTERN.match, parts) if name is not None
+    ]
+
+
+OPTIMIZE_PATTERN = re.compile(
+    r"^\s*OPTIMIZE\s+TABLE\s+(?:`?(?:\w+)`?\.)?`?(\w+)`?", re.IGNORECASE
+)
+
+
+def rewritten_table(statement: str):
+    """Return the table whose parts a statement rewrites, if any."""
+    alter = alter_scope(statement)
+    if alter:
+        table, scope = alter
+        return table if scope == "rewrite" else None
+
+    match = OPTIMIZE_PATTERN.match(statement)
+    return match.group(1) if match else None
+
+
+IDEMPOTENT_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE | re.DOTALL)
+    for pattern in [
+        r"^\s*(SELECT|WITH|SHOW|DESCRIBE|DESC|EXISTS|EXPLAIN|CHECK)\b",
+        r"^\s*(OPTIMIZE|TRUNCATE|SYSTEM)\b",
+        r"^\s*CREATE\s+(OR\s+REPLACE\s+)?\w+(\s+\w+)?\s+IF\s+NOT\s+EXISTS\b",
+        r"^\s*CREATE\s+OR\s+REPLACE\b",
+        r"^\s*DROP\s+\w+(\s+\w+)?\s+IF\s+EXISTS\b",
+    ]
+]
+IDEMPOTENT_ALTER_COMMANDS = re.compile(
+    r"^(ADD|DROP|CLEAR|MATERIALIZE)\s+(COLUMN|INDEX|PROJECTION|CONSTRAINT)"
+    r"\s+IF\s+(NOT\s+)?EXISTS\b"
+    r"|^MODIFY\s+(COLUMN|TTL|SETTING|COMMENT|ORDER\s+BY|QUERY)\b"
+    r"|^(COMMENT\s+COLUMN|RESET\s+SETTING|REMOVE\s+TTL)\b"
+    r"|^(DROP|DETACH)\s+(PARTITION|PART)\b"
+    r"|^(FREEZE|DELETE)\b",
+    re.IGNORECASE,
+)
+
+
+def is_idempotent(statement: str) -> bool:
+    """Return whether running a statement twice has the same effect as once.
+
+    Statements that fail on a second run (a plain CREATE of an existing
+    table) or change data again (INSERT, ALTER ... UPDATE) are not.
+    """
+    if any(pattern.match(statement) for pattern in IDEMPOTENT_PATTERNS):
+        return True
+
+    match = ALTER_PATTERN.match(statement)
+    if not match:
+        return False
+
+    commands = re.split(r",(?![^()]*\))", match.group(2))
+    return all(IDEMPOTENT_ALTER_COMMANDS.match(command.strip()) for command in commands)
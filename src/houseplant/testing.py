@@ -0,0 +1,146 @@
+"""Test helpers for code that talks to ClickHouse through houseplant."""
+
+import json
+import re
+from contextlib import contextmanager
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace so queries compare equal regardless of formatting."""
+    return " ".join(query.split())
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised when a block issues more queries than its budget allows."""
+
+
+class RecordingConnection:
+    def __init__(self, database):
+        self.database = database
+
+
+class RecordingClient:
+    """Stand-in for ``clickhouse_driver.Client`` that records every query.
+
+    Responses are looked up in three places, in order:
+
+    * canned responses registered with :meth:`respond`, matched by regex
+      against the normalized query,
+    * recordings loaded from a cassette with :meth:`load`,
+    * the wrapped client, if one was given, whose results are recorded.
+
+    Anything else returns an empty result.
+    """
+
+    def __init__(self, database="default", wrapped=None):
+        self.connection = RecordingConnection(database)
+        self.wrapped = wrapped
+        self.queries = []
+        self._responses = []
+        self._recordings = {}
+
+    @property
+    def query_count(self):
+        return len(self.queries)
+
+    def respond(self, pattern: str, rows):
+        """Answer queries matching ``pattern`` with ``rows``.
+
+        ``rows`` may be a callable taking ``(query, params)`` to compute the
+        response from the request. Later registrations take precedence.
+        """
+        self._responses.insert(0, (re.compile(pattern, re.IGNORECASE), rows))
+
+    def respond_applied(self, versions, checksums=None):
+        """Answer migration bookkeeping queries as if ``versions`` were applied.
+
+        ``checksums`` maps versions to the checksum they were applied with.
+        """
+        applied = set(versions)
+        checksums = checksums or {}
+
+        def diff(query, params):
+            local = {
+                row["version"]: row.get("checksum", "")
+                for table in self.queries[-1]["external_tables"]
+                for row in table["data"]
+            }
+            changed = [
+                version
+                for version, checksum in sorted(local.items())
+                if checksum and checksums.get(version) not in (None, "", checksum)
+            ]
+            return (
+                [(version, "pending") for version in sorted(local.keys() - applied)]
+                + [(version, "missing") for version in sorted(applied - local.keys())]
+                + [(version, "changed") for version in changed if version in applied]
+            )
+
+        self.respond(
+            r"^SELECT version FROM schema_migrations",
+            [(version,) for version in sorted(applied)],
+        )
+        self.respond(r"FROM local_migrations", diff)
+
+    def execute(self, query, params=None, settings=None, **kwargs):
+        normalized = normalize_query(query)
+        record = {"query": normalized, "params": params, "settings": settings}
+        if kwargs.get("external_tables"):
+            record["external_tables"] = kwargs["external_tables"]
+        self.queries.append(record)
+
+        for pattern, rows in self._responses:
+            if pattern.search(normalized):
+                return rows(normalized, params) if callable(rows) else rows
+
+        recorded = self._recordings.get(normalized)
+        if recorded:
+            return recorded.pop(0) if len(recorded) > 1 else recorded[0]
+
+        if self.wrapped is not None:
+            rows = self.wrapped.execute(query, params, settings=settings, **kwargs)
+            self._recordings.setdefault(normalized, []).append(rows)
+            return rows
+
+        return []
+
+    def disconnect(self):
+        if self.wrapped is not None:
+            self.wrapped.disconnect()
+
+    def reset(self):
+        """Forget recorded queries, keeping responses and recordings."""
+        self.queries = []
+
+    def save(self, path):
+        """Write recorded responses to a JSON cassette."""
+        with open(path, "w") as f:
+            json.dump(
+                [
+                    {"query": query, "rows": [list(row) for row in rows]}
+                    for query, responses in self._recordings.items()
+                    for rows in responses
+                ],
+                f,
+                indent=2,
+            )
+
+    def load(self, path):
+        """Replay responses from a JSON cassette written by :meth:`save`."""
+        with open(path) as f:
+            for recording in json.load(f):
+                self._recordings.setdefault(recording["query"], []).append(
+                    [tuple(row) for row in recording["rows"]]
+                )
+
+    @contextmanager
+    def query_budget(self, budget: int):
+        """Fail if the block issues more than ``budget`` queries."""
+        start = self.query_count
+        yield
+        issued = self.queries[start:]
+        if len(issued) > budget:
+            raise QueryBudgetExceeded(
+                f"Expected at most {budget} queries, {len(issued)} were issued:\n"
+                + "\n".join(f"  {query['query']}" for query in issued)
+            )
@@ -0,0 +1,115 @@
+"""Load-adaptive throttling of migration statements."""
+
+import os
+import time
+
+from rich.console import Console
+
+MERGE_METRICS = ("BackgroundMergesAndMutationsPoolTask", "BackgroundPoolTask")
+
+
+class Throttle:
+    """Pause between statements while the server is under load.
+
+    Before each statement the server's merge pool, parts count and memory
+    usage are sampled. While any of them is over its threshold the throttle
+    sleeps with exponential backoff. After ``max_wait`` seconds it lets the
+    statement run anyway, so a migration is slowed down but never stuck.
+    Thresholds missing from the arguments are read from ``env``, the process
+    environment by default.
+    """
+
+    def __init__(
+        self,
+        max_merges=None,
+        max_parts=None,
+        max_memory=None,
+        max_wait=None,
+        backoff=1.0,
+        max_backoff=60.0,
+        sleep=time.sleep,
+        env=None,
+    ):
+        env = os.environ if env is None else env
+        self.max_merges = int(
+            max_merges or env.get("HOUSEPLANT_THROTTLE_MAX_MERGES", 16)
+        )
+        self.max_parts = int(max_parts or env.get("HOUSEPLANT_THROTTLE_MAX_PARTS", 300))
+        self.max_memory = float(
+            max_memory or env.get("HOUSEPLANT_THROTTLE_MAX_MEMORY", 0.8)
+        )
+        self.max_wait = float(max_wait or env.get("HOUSEPLANT_THROTTLE_MAX_WAIT", 600))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.sleep = sleep
+        self.console = Console(stderr=True)
+
+    def sample(self, db) -> dict:
+        """Read the load metrics, taking the busiest replica of a cluster."""
+
+        def source(table):
+            if db.cluster is not None:
+                return f"clusterAllReplicas('{db.cluster}', {table})"
+            return table
+
+        rows = db.client.execute(f"""
+            SELECT metric, max(value)
+            FROM (
+                SELECT hostName() AS host, metric, toFloat64(value) AS value
+                FROM {source("system.metrics")}
+                WHERE metric IN ('MemoryTracking', {", ".join(f"'{m}'" for m in MERGE_METRICS)})
+                UNION ALL
+                SELECT hostName() AS host, metric, value
+                FROM {source("system.asynchronous_metrics")}
+                WHERE metric IN ('MaxPartCountForPartition', 'OSMemoryTotal')
+            )
+            GROUP BY metric
+        """)
+        return dict(rows)
+
+    def reasons(self, sample: dict) -> list[str]:
+        """Return why the server is considered overloaded, if it is."""
+        reasons = []
+
+        merges = sum(sample.get(metric, 0) for metric in MERGE_METRICS)
+        if merges > self.max_merges:
+            reasons.append(f"{merges:.0f} background merges")
+
+        parts = sample.get("MaxPartCountForPartition", 0)
+        if parts > self.max_parts:
+            reasons.append(f"{parts:.0f} parts in a partition")
+
+        memory_total = sample.get("OSMemoryTotal", 0)
+        memory_used = sample.get("MemoryTracking", 0)
+        if memory_total and memory_used / memory_total > self.max_memory:
+            reasons.append(f"{memory_used / memory_total:.0%} memory used")
+
+        return reasons
+
+    def wait(self, db) -> float:
+        """Block until the server is below every threshold.
+
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0.0
+        backoff = self.backoff
+
+        while True:
+            reasons = self.reasons(self.sample(db))
+            if not reasons:
+                return waited
+
+            if waited >= self.max_wait:
+                self.console.print(
+                    f"[yellow]⚠[/yellow] Still throttled after {waited:.0f}s "
+                    f"({', '.join(reasons)}), continuing"
+                )
+                return waited
+
+            delay = min(backoff, self.max_backoff, self.max_wait - waited)
+            self.console.print(
+                f"[yellow]⏸[/yellow] Throttling for {delay:.0f}s: {', '.join(reasons)}"
+            )
+            self.sleep(delay)
+            waited += delay
+            backoff *= 2
@@ -0,0 +1,337 @@
+"""HTTP(S) transport for ClickHouse with connection pooling."""
+
+import gzip
+import http.client
+import json
+import queue
+import re
+import select
+import ssl
+import uuid
+from urllib.parse import urlencode
+
+from clickhouse_driver.errors import NetworkError, ServerException
+from clickhouse_driver.util.escape import escape_param, escape_params
+
+from .sql import is_idempotent
+
+ERROR_CODE_PATTERN = re.compile(r"^Code: (\d+)")
+INSERT_VALUES_PATTERN = re.compile(r"^\s*INSERT\s+INTO\s.*\bVALUES\s*$", re.I | re.S)
+SET_PATTERN = re.compile(r"^\s*SET\s+(.*?)\s*;?\s*$", re.I | re.S)
+SETTING_PATTERN = re.compile(
+    r"^\s*(\w+)\s*=\s*(?:'((?:[^'\\]|\\.|'')*)'|(\S+))\s*$", re.S
+)
+
+# Errors raised when the server closed an idle keep-alive connection
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+TSV_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n"})
+
+
+def parse_set(query):
+    """Return the settings changed by a ``SET name = value, ...`` query, or None."""
+    match = SET_PATTERN.match(query)
+    if not match:
+        return None
+
+    settings = {}
+    for assignment in re.split(r",(?=(?:[^']*'[^']*')*[^']*$)", match.group(1)):
+        setting = SETTING_PATTERN.match(assignment)
+        if not setting:
+            return None
+        name, quoted, value = setting.groups()
+        if quoted is not None:
+            value = re.sub(r"\\(.)|''", lambda m: m.group(1) or "'", quoted)
+        settings[name] = value
+    return settings
+
+
+def escape_tsv(value) -> str:
+    """Format a value for the TabSeparated input format."""
+    if value is None:
+        return "\\N"
+    return str(value).translate(TSV_ESCAPES)
+
+
+class _ServerInfo:
+    def get_timezone(self):
+        return "UTC"
+
+
+class _EscapeContext:
+    server_info = _ServerInfo()
+
+
+class HttpConnection:
+    def __init__(self, database):
+        self.database = database
+
+
+class HttpClient:
+    """Stand-in for ``clickhouse_driver.Client`` over the HTTP interface.
+
+    Supports the subset of ``Client.execute`` houseplant uses: queries with
+    ``%(name)s`` parameters, ``INSERT ... VALUES`` with a list of rows or
+    columns and per-query settings. Connections are kept alive in a pool and
+    request and response bodies are gzip-compressed, so repeated queries skip
+    the TCP and TLS handshake.
+    When a host can't be reached, new connections fail over to ``alt_hosts``
+    like the native client does. The client is safe to share between threads.
+
+    Every HTTP request is its own server session, so ``SET`` statements are
+    kept by the client and sent as settings with the queries that follow,
+    the way they carry over on a native connection.
+    """
+
+    def __init__(
+        self,
+        host,
+        port,
+        database,
+        user,
+        password,
+        secure=False,
+        verify=True,
+        compression=True,
+        pool_size=4,
+        timeout=300,
+        connect_timeout=10,
+        alt_hosts=None,
+    ):
+        self.host = host
+        self.port = port
+        # Hosts to fail over to, in order, when a new connection can't be made
+        self.hosts = [(host, port)]
+        for entry in (alt_hosts or "").split(","):
+            if entry.strip():
+                alt_host, _, alt_port = entry.strip().partition(":")
+                self.hosts.append((alt_host, int(alt_port or port)))
+        self.connection = HttpConnection(database)
+        self.user = user
+        self.password = password
+        self.secure = secure
+        self.compression = compression
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        # Settings changed with SET, sent with every later query
+        self._session_settings = {}
+
+        self._ssl_context = None
+        if secure:
+            self._ssl_context = ssl.create_default_context()
+            if not verify:
+                self._ssl_context.check_hostname = False
+                self._ssl_context.verify_mode = ssl.CERT_NONE
+
+    def _new_connection(self):
+        if self.secure:
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout, context=self._ssl_context
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _failover(self):
+        """Switch to the next host."""
+        self.hosts.append(self.hosts.pop(0))
+        self.host, self.port = self.hosts[0]
+
+    @staticmethod
+    def _is_open(connection):
+        """Return whether the server kept an idle connection open.
+
+        A connection closed by the server reads as end of file before anything
+        is sent on it, so it can be dropped without losing a query.
+        """
+        if connection.sock is None:
+            return False
+        try:
+            readable, _, _ = select.select([connection.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def _checkout(self):
+        while True:
+            try:
+                connection = self._pool.get_nowait()
+            except queue.Empty:
+                break
+            if self._is_open(connection):
+                return connection, True
+            connection.close()
+
+        # Nothing is sent before the connection is up, so failing over is safe
+        for attempt in range(len(self.hosts)):
+            connection = self._new_connection()
+            connection.timeout = self.connect_timeout
+            try:
+                connection.connect()
+                connection.sock.settimeout(self.timeout)
+                return connection, False
+            except OSError as e:
+                connection.close()
+                if attempt == len(self.hosts) - 1:
+                    raise NetworkError(f"{e} ({self.host}:{self.port})")
+                self._failover()
+
+    def _checkin(self, connection):
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def render(self, query, params=None, columnar=False):
+        """Substitute parameters the same way clickhouse_driver does."""
+        if params is None:
+            return query
+
+        context = _EscapeContext()
+        if INSERT_VALUES_PATTERN.match(query) and not isinstance(params, dict):
+            if columnar:
+                params = zip(*params)
+            rows = (
+                "(" + ", ".join(str(escape_param(v, context)) for v in row) + ")"
+                for row in params
+            )
+            return f"{query.rstrip()} " + ", ".join(rows)
+
+        return query % escape_params(params, context)
+
+    def execute(
+        self,
+        query,
+        params=None,
+        settings=None,
+        with_column_types=False,
+        columnar=False,
+        external_tables=None,
+        **kwargs,
+    ):
+        body = self.render(query, params, columnar).encode()
+        response = self._request(
+            body,
+            {**self._session_settings, **(settings or {})},
+            external_tables or [],
+            is_idempotent(query),
+        )
+        # The server checks the SET before the client keeps its settings
+        self._session_settings.update(parse_set(query) or {})
+
+        rows, columns = [], []
+        if response.strip():
+            result = json.loads(response)
+            rows = [tuple(row) for row in result.get("data", [])]
+            columns = [(column["name"], column["type"]) for column in result["meta"]]
+
+        if columnar:
+            rows = [tuple(column) for column in zip(*rows)]
+        return (rows, columns) if with_column_types else rows
+
+    def _request(self, body, settings, external_tables=(), resend=True):
+        url_params = {
+            "database": self.connection.database,
+            "default_format": "JSONCompact",
+            "output_format_json_quote_64bit_integers": 0,
+            # Errors raised while streaming the result fail with a status code
+            "wait_end_of_query": 1,
+            **settings,
+        }
+        headers = {
+            "X-ClickHouse-User": self.user,
+            "X-ClickHouse-Key": self.password,
+            "Connection": "keep-alive",
+        }
+        if self.compression:
+            url_params["enable_http_compression"] = 1
+            headers["Accept-Encoding"] = "gzip"
+
+        if external_tables:
+            # The query moves to the URL and the tables are uploaded as files
+            url_params["query"] = body.decode()
+            body, content_type = self._external_tables_body(external_tables, url_params)
+            headers["Content-Type"] = content_type
+        elif self.compression and len(body) > 1024:
+            body = gzip.compress(body)
+            headers["Content-Encoding"] = "gzip"
+
+        url = "/?" + urlencode(url_params)
+
+        while True:
+            connection, reused = self._checkout()
+            try:
+                connection.request("POST", url, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except STALE_CONNECTION_ERRORS as e:
+                connection.close()
+                # The server may have received the query before the connection
+                # broke, so only queries that can run twice are sent again
+                if reused and resend:
+                    continue
+                raise NetworkError(f"{e} ({self.host}:{self.port})")
+            except OSError as e:
+                connection.close()
+                raise NetworkError(f"{e} ({self.host}:{self.port})")
+            break
+
+        if response.getheader("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+
+        if response.will_close:
+            connection.close()
+        else:
+            self._checkin(connection)
+
+        text = data.decode()
+        if response.status != 200:
+            code = response.getheader("X-ClickHouse-Exception-Code")
+            match = ERROR_CODE_PATTERN.match(text)
+            if code is None and match:
+                code = match.group(1)
+            raise ServerException(
+                text.strip(), code=int(code) if code is not None else None
+            )
+
+        return text
+
+    @staticmethod
+    def _external_tables_body(external_tables, url_params):
+        """Encode external tables as a multipart form of TSV files."""
+        boundary = uuid.uuid4().hex
+        parts = []
+        for table in external_tables:
+            name = table["name"]
+            columns = [column for column, _ in table["structure"]]
+            url_params[f"{name}_structure"] = ", ".join(
+                f"{column} {type_}" for column, type_ in table["structure"]
+            )
+            url_params[f"{name}_format"] = "TabSeparated"
+
+            rows = (
+                "\t".join(
+                    escape_tsv(row[column] if isinstance(row, dict) else row[index])
+                    for index, column in enumerate(columns)
+                )
+                for row in table["data"]
+            )
+            data = "".join(f"{row}\n" for row in rows)
+            parts.append(
+                f"--{boundary}\r\n"
+                f'Content-Disposition: form-data; name="{name}"; filename="{name}"\r\n'
+                "Content-Type: application/octet-stream\r\n\r\n"
+                f"{data}\r\n"
+            )
+        parts.append(f"--{boundary}--\r\n")
+        return "".join(parts).encode(), f"multipart/form-data; boundary={boundary}"
+
+    def disconnect(self):
+        """Close every pooled connection."""
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
@@ -1,8 +1,86 @@
+import hashlib
+import json
 import os
+import tempfile
 
+from dotenv import dotenv_values
+
+# Paths relative to the root of a project
 MIGRATIONS_DIR = "ch/migrations"
+SETTINGS_FILE = "ch/settings.yml"
+SCHEMA_FILE = "ch/schema.sql"
+CHECKSUMS_FILE = "ch/.checksums.json"
 
 
-def get_migration_files():
+def get_migration_files(root=None):
     # Get all local migration files
-    return sorted([f for f in os.listdir(MIGRATIONS_DIR) if f.endswith(".yml")])
+    migrations_dir = os.path.join(root or "", MIGRATIONS_DIR)
+    return sorted([f for f in os.listdir(migrations_dir) if f.endswith(".yml")])
+
+
+def project_env(root=None) -> dict:
+    """Return the environment of a project.
+
+    Without ``root`` this is a copy of ``os.environ``. Otherwise the variables of the
+    project's ``.env`` file are added, without overriding the ones set in the
+    environment, like the CLI does, and without changing ``os.environ``.
+    """
+    if root is None:
+        return dict(os.environ)
+    values = dotenv_values(os.path.join(root, ".env"))
+    return {**{k: v for k, v in values.items() if v is not None}, **os.environ}
+
+
+def get_migration_checksums(migration_files, root=None) -> dict:
+    """Return the SHA256 of each migration file, keyed by version.
+
+    Checksums are cached in ch/.checksums.json with the size and modification
+    time of each file, so only new or modified files are read.
+    """
+    checksums_file = os.path.join(root or "", CHECKSUMS_FILE)
+    try:
+        with open(checksums_file) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+
+    checksums = {}
+    updated = False
+    for migration_file in migration_files:
+        path = os.path.join(root or "", MIGRATIONS_DIR, migration_file)
+        stat = os.stat(path)
+        entry = manifest.get(migration_file)
+        if entry is None or [entry["mtime_ns"], entry["size"]] != [
+            stat.st_mtime_ns,
+            stat.st_size,
+        ]:
+            with open(path, "rb") as f:
+                checksum = hashlib.sha256(f.read()).hexdigest()
+            entry = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "checksum": checksum,
+            }
+            manifest[migration_file] = entry
+            updated = True
+        checksums[migration_file.split("_")[0]] = entry["checksum"]
+
+    if updated:
+        # Replace the manifest at once so concurrent runs never read half of it
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(checksums_file))
+            with os.fdopen(fd, "w") as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, checksums_file)
+        except OSError:
+            pass
+    return checksums
+
+
+def format_bytes(size: int) -> str:
+    """Format a byte count for humans, e.g. ``1.5 GiB``."""
+    for unit in ["B", "KiB", "MiB", "GiB", "TiB"]:
+        if abs(size) < 1024 or unit == "TiB":
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
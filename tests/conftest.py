@@ -4,6 +4,7 @@ import pytest
 from clickhouse_driver import Client
 
 from houseplant.clickhouse_client import ClickHouseClient
+from houseplant.testing import RecordingClient
 
 
 def check_clickhouse_connection(host="localhost", port=9000, attempts=3):
@@ -49,3 +50,9 @@ def ch_client(clickhouse_service):
     yield client
 
     ch_client.execute(f"DROP DATABASE IF EXISTS {test_db}")
+
+
+@pytest.fixture
+def recording_client():
+    """Record queries instead of sending them to ClickHouse."""
+    return RecordingClient(database="houseplant_test")
@@ -0,0 +1,141 @@
+import asyncio
+import threading
+
+import pytest
+
+from houseplant.aio import AsyncClickHouseClient, AsyncHouseplant
+from houseplant.testing import RecordingClient
+from tests.test_houseplant import write_migrations
+
+
+@pytest.fixture
+def recording_clients(mocker):
+    """Give every new connection its own recording client."""
+    clients = []
+
+    def connect(**kwargs):
+        client = RecordingClient(database=kwargs["database"])
+        client.respond_applied([])
+        clients.append(client)
+        return client
+
+    mocker.patch("houseplant.clickhouse_client.Client", side_effect=connect)
+    return clients
+
+
+def test_concurrent_introspection(mocker):
+    """Test that calls run concurrently, each on its own connection."""
+    # Every query waits until the other one is in flight too
+    barrier = threading.Barrier(2, timeout=5)
+
+    def connect(**kwargs):
+        client = RecordingClient(database=kwargs["database"])
+        client.respond("system.tables", lambda query, params: [(barrier.wait(),)])
+        return client
+
+    mocker.patch("houseplant.clickhouse_client.Client", side_effect=connect)
+
+    async def main():
+        async with AsyncClickHouseClient(pool_size=2) as db:
+            return await asyncio.gather(
+                db.get_database_tables(), db.get_database_dictionaries()
+            )
+
+    tables, dictionaries = asyncio.run(main())
+
+    assert sorted(tables + dictionaries) == [(0,), (1,)]
+
+
+def test_pool_is_bounded(recording_clients):
+    """Test that no more than pool_size connections are opened."""
+
+    async def main():
+        db = AsyncClickHouseClient(pool_size=2)
+        await asyncio.gather(*[db.get_applied_migrations() for _ in range(10)])
+        await db.close()
+
+    asyncio.run(main())
+
+    assert len(recording_clients) == 2
+    assert sum(client.query_count for client in recording_clients) == 10
+
+
+def test_migrate_many_databases(recording_clients, tmp_path):
+    """Test migrating several databases concurrently from one process."""
+    write_migrations(tmp_path, 2)
+
+    async def main():
+        targets = [
+            AsyncHouseplant(database=name, root=tmp_path) for name in ["one", "two"]
+        ]
+        await asyncio.gather(*[target.migrate_up() for target in targets])
+        for target in targets:
+            await target.close()
+        return targets
+
+    targets = asyncio.run(main())
+
+    for target, database in zip(targets, ["one", "two"]):
+        queries = [q["query"] for q in target.houseplant.db.client.queries]
+        assert target.houseplant.db.client.connection.database == database
+        assert any(q.startswith("CREATE TABLE table_0") for q in queries)
+        assert any(q.startswith("CREATE TABLE table_1") for q in queries)
+
+
+def test_cancelled_call_keeps_connection(mocker):
+    """Test that a cancelled call returns its connection once its query ends."""
+    release = threading.Event()
+    running = []
+
+    def query(query, params):
+        running.append(query)
+        assert len(running) == 1, "two queries ran on one connection"
+        release.wait(5)
+        running.remove(query)
+        return []
+
+    def connect(**kwargs):
+        client = RecordingClient(database=kwargs["database"])
+        client.respond("system.tables", query)
+        return client
+
+    mocker.patch("houseplant.clickhouse_client.Client", side_effect=connect)
+
+    async def main():
+        db = AsyncClickHouseClient(pool_size=1)
+        first = asyncio.create_task(db.get_database_tables())
+        await asyncio.sleep(0.05)
+        first.cancel()
+        second = asyncio.create_task(db.get_database_dictionaries())
+        await asyncio.sleep(0.05)
+        waiting = not second.done()
+        release.set()
+        await second
+        await db.close()
+        return first, waiting
+
+    first, waiting = asyncio.run(main())
+
+    assert first.cancelled()
+    assert waiting
+
+
+def test_cancelled_command_keeps_lock(recording_clients, tmp_path):
+    """Test that a command waits for a cancelled one whose thread still runs."""
+    write_migrations(tmp_path, 1)
+    release = threading.Event()
+
+    async def main():
+        target = AsyncHouseplant(database="one", root=tmp_path)
+        first = asyncio.create_task(target._run(release.wait, 5))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        second = asyncio.create_task(target.migrate_status())
+        await asyncio.sleep(0.05)
+        waiting = not second.done()
+        release.set()
+        await second
+        await target.close()
+        return waiting
+
+    assert asyncio.run(main())
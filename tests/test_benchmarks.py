@@ -0,0 +1,25 @@
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+
+BENCHMARKS_DIR = Path(__file__).parent.parent / "benchmarks"
+
+
+@pytest.fixture
+def benchmarks():
+    spec = importlib.util.spec_from_file_location("run", BENCHMARKS_DIR / "run.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_baseline_query_counts(benchmarks):
+    """Test that every command runs on the fake with the baseline query counts."""
+    baseline = json.loads((BENCHMARKS_DIR / "baseline.json").read_text())
+    results = benchmarks.run_benchmarks([100], list(benchmarks.COMMANDS))
+
+    assert {name: result["queries"] for name, result in results["100"].items()} == {
+        name: result["queries"] for name, result in baseline["100"].items()
+    }
@@ -27,10 +27,10 @@ def mock_clickhouse(mocker):
 
 
 @pytest.fixture
-def mock_houseplant(mocker, mock_clickhouse) -> Generator[None, None, None]:
+def mock_houseplant(mocker, mock_clickhouse, tmp_path) -> Generator[None, None, None]:
     """Mock the Houseplant class to avoid actual operations during testing."""
     # Create a real instance to get access to the original init method
-    real_instance = Houseplant()
+    real_instance = Houseplant(root=tmp_path)
 
     # Create mock instance
     mock_instance = mocker.Mock(spec=Houseplant)
@@ -121,13 +121,24 @@ def test_migrate_down_command(mock_houseplant):
     # Test without version
     result = runner.invoke(app, ["migrate:down"])
     assert result.exit_code == 0
-    mock_houseplant.migrate_down.assert_called_with(None)
+    mock_houseplant.migrate_down.assert_called_with(None, None)
 
     # Test with version
     mock_houseplant.reset_mock()
     result = runner.invoke(app, ["migrate:down", "1.0"])
     assert result.exit_code == 0
-    mock_houseplant.migrate_down.assert_called_with("1.0")
+    mock_houseplant.migrate_down.assert_called_with("1.0", None)
+
+    # Test with steps
+    mock_houseplant.reset_mock()
+    result = runner.invoke(app, ["migrate:down", "STEP=3"])
+    assert result.exit_code == 0
+    mock_houseplant.migrate_down.assert_called_with(None, "STEP=3")
+
+    mock_houseplant.reset_mock()
+    result = runner.invoke(app, ["migrate:down", "--step", "2"])
+    assert result.exit_code == 0
+    mock_houseplant.migrate_down.assert_called_with(None, "2")
 
 
 def test_migrate_command(mock_houseplant):
@@ -163,3 +174,91 @@ def test_cli_entrypoint():
     import houseplant.cli
 
     assert hasattr(houseplant.cli, "app")
+
+
+def test_migrate_squash_command(mock_houseplant):
+    """Test the migrate:squash command."""
+    result = runner.invoke(app, ["migrate:squash", "BEFORE=20240101000000"])
+    assert result.exit_code == 0
+    mock_houseplant.migrate_squash.assert_called_with("BEFORE=20240101000000")
+
+
+def test_migrate_check_command(mock_houseplant):
+    """Test the migrate:check command exits with an error on invalid migrations."""
+    mock_houseplant.migrate_check.return_value = True
+    result = runner.invoke(app, ["migrate:check"])
+    assert result.exit_code == 0
+
+    mock_houseplant.migrate_check.return_value = False
+    result = runner.invoke(app, ["migrate:check"])
+    assert result.exit_code == 1
+
+
+def test_schema_diff_command(mock_houseplant):
+    """Test the schema:diff command exits with an error when the schema drifted."""
+    mock_houseplant.schema_diff.return_value = {
+        "missing": [],
+        "extra": [],
+        "changed": [],
+    }
+    result = runner.invoke(app, ["schema:diff"])
+    assert result.exit_code == 0
+
+    mock_houseplant.schema_diff.return_value = {
+        "missing": [{"name": "events", "category": "tables"}],
+        "extra": [],
+        "changed": [],
+    }
+    result = runner.invoke(app, ["schema:diff"])
+    assert result.exit_code == 1
+
+
+def test_schema_fingerprint_command(mock_houseplant):
+    """Test the schema:fingerprint command exits with an error on drift."""
+    mock_houseplant.schema_fingerprint.return_value = {
+        "fingerprint": "a1",
+        "targets": [{"host": "ch1:9000", "database": "tenant_a", "fingerprint": "a1"}],
+    }
+    result = runner.invoke(app, ["schema:fingerprint", "tenant_*"])
+    assert result.exit_code == 0
+    mock_houseplant.schema_fingerprint.assert_called_with(["tenant_*"])
+
+    mock_houseplant.schema_fingerprint.return_value["targets"].append(
+        {"host": "ch2:9000", "error": "Connection refused"}
+    )
+    result = runner.invoke(app, ["schema:fingerprint", "tenant_*"])
+    assert result.exit_code == 1
+
+
+def test_migrate_status_ndjson(mock_houseplant):
+    """Test that --format streams records to stdout."""
+    mock_houseplant.migrate_status.side_effect = lambda: mock_houseplant.on_record(
+        {"version": "20240101000000", "status": "up"}
+    )
+
+    result = runner.invoke(app, ["migrate:status", "--format", "ndjson"])
+
+    assert result.exit_code == 0
+    assert result.stdout == '{"version": "20240101000000", "status": "up"}\n'
+
+
+def test_migrate_up_json(mock_houseplant):
+    """Test that --format json writes a JSON array."""
+    result = runner.invoke(app, ["migrate:up", "--format", "json"])
+
+    assert result.exit_code == 0
+    assert result.stdout == "[]\n"
+
+
+def test_migrate_plan_command(mock_houseplant, tmp_path):
+    """Test the migrate:plan command and applying its plan."""
+    plan_file = tmp_path / "plan.json"
+
+    result = runner.invoke(app, ["migrate:plan", "--output", str(plan_file)])
+    assert result.exit_code == 0
+    mock_houseplant.migrate_plan.assert_called_with(plan_file)
+
+    result = runner.invoke(app, ["migrate", "--plan", str(plan_file)])
+    assert result.exit_code == 0
+    mock_houseplant.apply_plan.assert_called_with(plan_file)
+    mock_houseplant.migrate.assert_not_called()
@@ -65,6 +65,126 @@ def test_port_precedence(monkeypatch):
     assert client.port == 9440
 
 
+def test_host_list(mocker):
+    """Test that extra hosts are passed to the driver as alt_hosts."""
+    from houseplant.clickhouse_client import ClickHouseClient
+
+    client_class = mocker.patch("houseplant.clickhouse_client.Client")
+    client = ClickHouseClient(host="ch1:9000, ch2, ch3:9001")
+
+    assert client.host == "ch1"
+    assert client.hosts == [("ch1", 9000), ("ch2", 9000), ("ch3", 9001)]
+    assert client_class.call_args.kwargs["host"] == "ch1"
+    assert client_class.call_args.kwargs["alt_hosts"] == "ch2:9000,ch3:9001"
+
+
+def test_reads_go_to_least_loaded_replica(mocker):
+    """Test that introspection uses the least loaded replica until a write."""
+    from houseplant.clickhouse_client import ClickHouseClient
+    from houseplant.testing import RecordingClient
+
+    def unreachable(query, params):
+        raise NetworkError("Connection refused")
+
+    replicas = {host: RecordingClient() for host in ["ch1", "ch2", "ch3"]}
+    replicas["ch1"].respond("system.metrics", [(10.0,)])
+    replicas["ch2"].respond("system.metrics", [(2.0,)])
+    replicas["ch3"].respond("system.metrics", unreachable)
+    mocker.patch(
+        "houseplant.clickhouse_client.Client",
+        side_effect=lambda host, **kwargs: replicas[host],
+    )
+
+    client = ClickHouseClient(host="ch1,ch2,ch3")
+    client.get_applied_migrations()
+
+    assert client.reader is replicas["ch2"]
+    assert "schema_migrations" in replicas["ch2"].queries[-1]["query"]
+
+    client.mark_migration_applied("20240101000000")
+    client.get_applied_migrations()
+
+    assert client.reader is replicas["ch1"]
+    assert "schema_migrations FINAL" in replicas["ch1"].queries[-1]["query"]
+
+
+def test_migration_diff_reads_primary(mocker):
+    """Test that the migrations to run are never read from a lagging replica."""
+    from houseplant.clickhouse_client import ClickHouseClient
+    from houseplant.testing import RecordingClient
+
+    replicas = {host: RecordingClient() for host in ["ch1", "ch2"]}
+    replicas["ch1"].respond("system.metrics", [(10.0,)])
+    replicas["ch2"].respond("system.metrics", [(2.0,)])
+    mocker.patch(
+        "houseplant.clickhouse_client.Client",
+        side_effect=lambda host, **kwargs: replicas[host],
+    )
+
+    client = ClickHouseClient(host="ch1,ch2")
+    client.get_migration_diff(["20240101000000"])
+    assert "local_migrations" in replicas["ch1"].queries[-1]["query"]
+    assert replicas["ch2"].queries == []
+
+    client.get_migration_diff(["20240101000000"], replica=True)
+    assert "local_migrations" in replicas["ch2"].queries[-1]["query"]
+
+
+def test_single_host_reads_use_primary(mocker, recording_client):
+    """Test that no replica is probed with a single host."""
+    from houseplant.clickhouse_client import ClickHouseClient
+
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    client = ClickHouseClient(host="ch1")
+
+    assert client.reader is recording_client
+    assert recording_client.query_count == 0
+
+
+def test_schema_queries_skip_internal_tables(mocker, recording_client):
+    """Test that the lock and migrations tables are never part of the schema."""
+    from houseplant.clickhouse_client import ClickHouseClient
+
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    client = ClickHouseClient()
+    client.get_database_tables()
+    client.get_database_materialized_views()
+    client.get_database_dictionaries()
+    client.get_create_statements()
+    client.get_schema_hashes()
+
+    for query in recording_client.queries:
+        assert "name NOT IN ('schema_migrations', 'houseplant_locks')" in query["query"]
+
+
+def test_map_hosts(mocker):
+    """Test that every host is queried on its own connection."""
+    from houseplant.clickhouse_client import ClickHouseClient
+    from houseplant.testing import RecordingClient
+
+    def unreachable(query, params):
+        raise NetworkError("Connection refused")
+
+    replicas = {host: RecordingClient() for host in ["ch1", "ch2", "ch3"]}
+    replicas["ch1"].respond("hostName", [("ch1",)])
+    replicas["ch2"].respond("hostName", [("ch2",)])
+    replicas["ch3"].respond("hostName", unreachable)
+    mocker.patch(
+        "houseplant.clickhouse_client.Client",
+        side_effect=lambda host, **kwargs: replicas[host],
+    )
+
+    client = ClickHouseClient(host="ch1,ch2,ch3")
+    results = client.map_hosts(
+        lambda host_client: host_client.reader.execute("SELECT hostName()")[0][0]
+    )
+
+    assert list(results) == ["ch1:9000", "ch2:9000", "ch3:9000"]
+    assert results["ch1:9000"] == "ch1"
+    assert results["ch2:9000"] == "ch2"
+    assert isinstance(results["ch3:9000"], NetworkError)
+
+
 def test_connection_error(monkeypatch):
     """Test connection error handling."""
     monkeypatch.setenv("CLICKHOUSE_HOST", "invalid_host")
@@ -170,6 +290,91 @@ def test_get_applied_migrations(migrations_table, test_versions):
     assert applied_versions == test_versions
 
 
+def test_get_migration_diff(migrations_table):
+    """Test comparing local versions with the applied ones on the server."""
+    migrations_table.mark_migration_applied("20240101000000", "a1")
+    migrations_table.mark_migration_applied("20240102000000", "b2")
+    migrations_table.mark_migration_applied("20240103000000")
+
+    pending, missing, changed = migrations_table.get_migration_diff(
+        ["20240102000000", "20240103000000", "20240104000000"],
+        {"20240102000000": "c3", "20240103000000": "d4"},
+    )
+
+    assert pending == ["20240104000000"]
+    assert missing == ["20240101000000"]
+    # Versions applied without a checksum are not compared
+    assert changed == ["20240102000000"]
+
+
+def test_get_migration_diff_sends_local_versions(mocker, recording_client):
+    """Test that local versions are sent as an external table."""
+    from houseplant.clickhouse_client import ClickHouseClient
+
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    recording_client.respond_applied(["20240101000000"])
+    client = ClickHouseClient()
+
+    pending, missing, changed = client.get_migration_diff(
+        ["20240102000000"], {"20240102000000": "a1"}
+    )
+
+    assert (pending, missing, changed) == (
+        ["20240102000000"],
+        ["20240101000000"],
+        [],
+    )
+    [external_table] = recording_client.queries[-1]["external_tables"]
+    assert external_table["name"] == "local_migrations"
+    assert external_table["data"] == [{"version": "20240102000000", "checksum": "a1"}]
+
+
+def test_migrations_table_is_upgraded(mocker, recording_client):
+    """Test that writes add the checksum column to tables of older versions."""
+    from houseplant.clickhouse_client import ClickHouseClient
+
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    recording_client.respond_applied([])
+
+    def missing_column(query, params):
+        if not any("ADD COLUMN" in q["query"] for q in recording_client.queries):
+            raise ServerException("Missing columns: 'checksum'", code=47)
+        return []
+
+    recording_client.respond(r"^\s*INSERT INTO schema_migrations", missing_column)
+    client = ClickHouseClient()
+
+    client.mark_migrations_applied(["20240101000000"], {"20240101000000": "abc"})
+    assert [q["query"].split()[0] for q in recording_client.queries[:3]] == [
+        "INSERT",
+        "ALTER",
+        "INSERT",
+    ]
+    assert "ADD COLUMN IF NOT EXISTS checksum" in recording_client.queries[1]["query"]
+
+
+def test_migration_diff_without_checksums(mocker, recording_client):
+    """Test that reading the diff of an older table never alters it."""
+    from houseplant.clickhouse_client import ClickHouseClient
+
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+
+    def missing_column(query, params):
+        if "'changed'" in query:
+            raise ServerException("Missing columns: 'checksum'", code=47)
+        return [("20240101000000", "pending")]
+
+    recording_client.respond(r"FROM local_migrations", missing_column)
+    client = ClickHouseClient()
+
+    assert client.get_migration_diff(["20240101000000"], replica=True) == (
+        ["20240101000000"],
+        [],
+        [],
+    )
+    assert not any("ALTER" in q["query"] for q in recording_client.queries)
+
+
 def test_execute_migration(ch_client):
     """Test executing a migration SQL statement."""
     test_sql = """
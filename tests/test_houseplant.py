@@ -1,13 +1,41 @@
+import hashlib
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
-
-from houseplant.houseplant import Houseplant
+import yaml
+from clickhouse_driver.errors import ServerException
+
+from houseplant.houseplant import Houseplant, target_drifted
+from houseplant.sql import (
+    normalize_create,
+    parse_create,
+    parse_schema,
+    schema_fingerprint,
+    schema_hash,
+)
+from houseplant.testing import RecordingClient
+from houseplant.utils import get_migration_checksums, project_env
 
 
 @pytest.fixture
-def houseplant():
-    return Houseplant()
+def houseplant(tmp_path):
+    return Houseplant(root=tmp_path)
+
+
+def mock_applied(mocker, houseplant, versions):
+    """Answer the server-side migration diff as if ``versions`` were applied."""
+    applied = set(versions)
+    return mocker.patch.object(
+        houseplant.db,
+        "get_migration_diff",
+        side_effect=lambda local, checksums=None: (
+            sorted(set(local) - applied),
+            sorted(applied - set(local)),
+            [],
+        ),
+    )
 
 
 @pytest.fixture
@@ -46,7 +74,6 @@ production:
 """
 
     migration_file.write_text(migration_content)
-    os.chdir(tmp_path)
     return migration_content
 
 
@@ -92,7 +119,6 @@ production:
 """
 
     migration_file.write_text(migration_content)
-    os.chdir(tmp_path)
     return migration_content
 
 
@@ -141,7 +167,6 @@ production:
 """
 
     migration_file.write_text(migration_content)
-    os.chdir(tmp_path)
     return migration_content
 
 
@@ -200,7 +225,6 @@ production:
         migration2_content.format(version="20240102000000", name="second_migration")
     )
 
-    os.chdir(tmp_path)
     return ("20240101000000", "20240102000000")
 
 
@@ -223,7 +247,6 @@ development:
 """
 
     migration_file.write_text(migration_content)
-    os.chdir(tmp_path)
     return migration_content
 
 
@@ -231,15 +254,12 @@ def test_init(houseplant, tmp_path, mocker):
     # Mock database calls
     mock_init_migrations = mocker.patch.object(houseplant.db, "init_migrations_table")
 
-    # Change to temp directory
-    os.chdir(tmp_path)
-
     # Run init
     houseplant.init()
 
     # Verify directories and files were created
-    assert os.path.exists("ch/migrations")
-    assert os.path.exists("ch/schema.sql")
+    assert os.path.exists(tmp_path / "ch/migrations")
+    assert os.path.exists(tmp_path / "ch/schema.sql")
 
     # Verify migrations table was initialized
     mock_init_migrations.assert_called_once()
@@ -247,26 +267,28 @@ def test_init(houseplant, tmp_path, mocker):
 
 def test_migration_with_settings(houseplant, migration_with_settings, mocker):
     mock_execute = mocker.patch.object(houseplant.db.client, "execute")
+    mock_applied(mocker, houseplant, [])
     settings = {"settings": {"enable_dynamic_type": 1, "max_table_size_to_drop": 0}}
 
     houseplant.migrate_up()
-    assert list(mock_execute.call_args_list[1]) == [
+    assert list(mock_execute.call_args_list[0]) == [
         (
             "CREATE TABLE dynamic_type_table (d Dynamic) ENGINE = MergeTree() ORDER BY d",
         ),
         settings,
     ]
 
-    mocker.patch.object(houseplant.db, "mark_migration_rolled_back")
-    mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[("20240101000000",)]
+    mock_mark_rolled_back = mocker.patch.object(
+        houseplant.db, "mark_migrations_rolled_back"
     )
+    mock_applied(mocker, houseplant, ["20240101000000"])
 
     houseplant.migrate_down()
-    assert list(mock_execute.call_args_list[4]) == [
+    assert list(mock_execute.call_args_list[3]) == [
         ("DROP TABLE dynamic_type_table",),
         settings,
     ]
+    mock_mark_rolled_back.assert_called_once_with(["20240101000000"])
 
 
 def test_migrate_up_development(houseplant, test_migration, mocker):
@@ -274,9 +296,7 @@ def test_migrate_up_development(houseplant, test_migration, mocker):
     houseplant.env = "development"
     mock_execute = mocker.patch.object(houseplant.db, "execute_migration")
     mock_mark_applied = mocker.patch.object(houseplant.db, "mark_migration_applied")
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[]
-    )
+    mock_get_applied = mock_applied(mocker, houseplant, [])
 
     # Run migration
     houseplant.migrate_up()
@@ -289,7 +309,7 @@ def test_migrate_up_development(houseplant, test_migration, mocker):
 ORDER BY id"""
 
     mock_execute.assert_called_once_with(expected_sql, None)
-    mock_mark_applied.assert_called_once_with("20240101000000")
+    mock_mark_applied.assert_called_once_with("20240101000000", mocker.ANY)
     mock_get_applied.assert_called_once()
 
 
@@ -298,9 +318,7 @@ def test_migrate_up_production(houseplant, test_migration, mocker):
     houseplant.env = "production"
     mock_execute = mocker.patch.object(houseplant.db, "execute_migration")
     mock_mark_applied = mocker.patch.object(houseplant.db, "mark_migration_applied")
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[]
-    )
+    mock_get_applied = mock_applied(mocker, houseplant, [])
 
     # Run migration
     houseplant.migrate_up()
@@ -313,7 +331,7 @@ def test_migrate_up_production(houseplant, test_migration, mocker):
 ORDER BY id"""
 
     mock_execute.assert_called_once_with(expected_sql, None)
-    mock_mark_applied.assert_called_once_with("20240101000000")
+    mock_mark_applied.assert_called_once_with("20240101000000", mocker.ANY)
     mock_get_applied.assert_called_once()
 
 
@@ -324,9 +342,7 @@ def test_migrate_up_with_development_table(
     houseplant.env = "development"
     mock_execute = mocker.patch.object(houseplant.db, "execute_migration")
     mock_mark_applied = mocker.patch.object(houseplant.db, "mark_migration_applied")
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[]
-    )
+    mock_get_applied = mock_applied(mocker, houseplant, [])
 
     # Run migration
     houseplant.migrate_up()
@@ -341,7 +357,7 @@ ORDER BY (id, created_at)
 PARTITION BY toYYYYMM(created_at)"""
 
     mock_execute.assert_called_once_with(expected_sql, None)
-    mock_mark_applied.assert_called_once_with("20240101000000")
+    mock_mark_applied.assert_called_once_with("20240101000000", mocker.ANY)
     mock_get_applied.assert_called_once()
 
 
@@ -352,9 +368,7 @@ def test_migrate_up_with_production_table(
     houseplant.env = "production"
     mock_execute = mocker.patch.object(houseplant.db, "execute_migration")
     mock_mark_applied = mocker.patch.object(houseplant.db, "mark_migration_applied")
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[]
-    )
+    mock_get_applied = mock_applied(mocker, houseplant, [])
 
     # Run migration
     houseplant.migrate_up()
@@ -369,7 +383,7 @@ ORDER BY (id, created_at)
 PARTITION BY toYYYYMM(created_at)"""
 
     mock_execute.assert_called_once_with(expected_sql, None)
-    mock_mark_applied.assert_called_once_with("20240101000000")
+    mock_mark_applied.assert_called_once_with("20240101000000", mocker.ANY)
     mock_get_applied.assert_called_once()
 
 
@@ -378,9 +392,7 @@ def test_migrate_up_with_development_view(houseplant, test_migration_with_view,
     houseplant.env = "development"
     mock_execute = mocker.patch.object(houseplant.db, "execute_migration")
     mock_mark_applied = mocker.patch.object(houseplant.db, "mark_migration_applied")
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[]
-    )
+    mock_get_applied = mock_applied(mocker, houseplant, [])
 
     # Run migration
     houseplant.migrate_up()
@@ -395,7 +407,7 @@ created_at DateTime
 AS SELECT * FROM events"""
 
     mock_execute.assert_called_once_with(expected_sql, None)
-    mock_mark_applied.assert_called_once_with("20240101000000")
+    mock_mark_applied.assert_called_once_with("20240101000000", mocker.ANY)
     mock_get_applied.assert_called_once()
 
 
@@ -404,9 +416,7 @@ def test_migrate_up_with_production_view(houseplant, test_migration_with_view, m
     houseplant.env = "production"
     mock_execute = mocker.patch.object(houseplant.db, "execute_migration")
     mock_mark_applied = mocker.patch.object(houseplant.db, "mark_migration_applied")
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[]
-    )
+    mock_get_applied = mock_applied(mocker, houseplant, [])
 
     # Run migration
     houseplant.migrate_up()
@@ -422,43 +432,33 @@ created_at DateTime
 AS SELECT * FROM events"""
 
     mock_execute.assert_called_once_with(expected_sql, None)
-    mock_mark_applied.assert_called_once_with("20240101000000")
+    mock_mark_applied.assert_called_once_with("20240101000000", mocker.ANY)
     mock_get_applied.assert_called_once()
 
 
-def test_update_schema_no_duplicates(houseplant, duplicate_migrations, mocker):
+def test_update_schema_no_duplicates(
+    houseplant, duplicate_migrations, tmp_path, mocker
+):
     versions = duplicate_migrations
 
     # Mock database calls
+    mock_applied(mocker, houseplant, [versions[0], versions[1]])
     mocker.patch.object(
         houseplant.db,
-        "get_applied_migrations",
-        return_value=[(versions[0],), (versions[1],)],
-    )
-    mocker.patch.object(
-        houseplant.db, "get_database_tables", return_value=[("events",)]
-    )
-    mocker.patch.object(
-        houseplant.db, "get_database_materialized_views", return_value=[]
-    )
-    mocker.patch.object(houseplant.db, "get_database_dictionaries", return_value=[])
-
-    # Mock the SHOW CREATE TABLE call
-    mocker.patch.object(
-        houseplant.db.client,
-        "execute",
-        return_value=[
-            [
-                "CREATE TABLE events (id UInt32, name String) ENGINE = MergeTree() ORDER BY id"
-            ]
-        ],
+        "get_create_statements",
+        return_value={
+            "events": (
+                "tables",
+                "CREATE TABLE events (id UInt32, name String) ENGINE = MergeTree() ORDER BY id",
+            )
+        },
     )
 
     # Update schema
     houseplant.update_schema()
 
     # Read the generated schema file
-    with open("ch/schema.sql", "r") as f:
+    with open(tmp_path / "ch/schema.sql", "r") as f:
         schema_content = f.read()
 
     # Verify the table appears only once in the schema
@@ -470,40 +470,73 @@ def test_update_schema_no_duplicates(houseplant, duplicate_migrations, mocker):
 
 def test_db_schema_load(houseplant, test_migration, mocker):
     # Mock database calls
-    mock_mark_applied = mocker.patch.object(houseplant.db, "mark_migration_applied")
+    mock_mark_applied = mocker.patch.object(houseplant.db, "mark_migrations_applied")
 
     # Run schema load
     houseplant.db_schema_load()
 
     # Verify migration was marked as applied without executing SQL
-    mock_mark_applied.assert_called_once_with("20240101000000")
+    mock_mark_applied.assert_called_once_with(["20240101000000"], mocker.ANY)
+
+
+def test_db_schema_load_bootstrap(
+    houseplant, test_migration, tmp_path, mocker, recording_client
+):
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    houseplant.db.client = recording_client
+
+    with open(tmp_path / "ch/migrations/20240201000000_not_in_schema.yml", "w") as f:
+        f.write(test_migration)
+    with open(tmp_path / "ch/schema.sql", "w") as f:
+        f.write(
+            "-- version: 20240101000000\n\n"
+            "-- TABLES\n\n"
+            "CREATE TABLE development.events (id UInt32) ENGINE = MergeTree\n;\n\n"
+            "CREATE TABLE development.users (id UInt32) ENGINE = MergeTree;\n\n"
+            "-- MATERIALIZED VIEWS\n\n"
+            "CREATE MATERIALIZED VIEW development.users_mv TO development.users\n"
+            "AS SELECT id FROM development.events;\n\n"
+            "-- DICTIONARIES\n\n"
+            "CREATE DICTIONARY development.users_dict (id UInt64) PRIMARY KEY id;"
+        )
+
+    houseplant.db_schema_load(bootstrap=True)
+
+    queries = [query["query"] for query in recording_client.queries]
+    assert queries[0].startswith("CREATE TABLE IF NOT EXISTS schema_migrations")
+    assert sorted(queries[1:3]) == [
+        "CREATE TABLE events (id UInt32) ENGINE = MergeTree",
+        "CREATE TABLE users (id UInt32) ENGINE = MergeTree",
+    ]
+    assert queries[3:5] == [
+        "CREATE DICTIONARY users_dict (id UInt64) PRIMARY KEY id",
+        "CREATE MATERIALIZED VIEW users_mv TO users AS SELECT id FROM events",
+    ]
+    [(version, active, checksum)] = recording_client.queries[5]["params"]
+    assert (version, active, len(checksum)) == ("20240101000000", 1, 64)
 
 
-@pytest.mark.skip
 def test_migrate_down(houseplant, test_migration, mocker):
     # Mock database calls
     mock_execute = mocker.patch.object(houseplant.db, "execute_migration")
     mock_mark_rolled_back = mocker.patch.object(
-        houseplant.db, "mark_migration_rolled_back"
-    )
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[("20240101000000",)]
+        houseplant.db, "mark_migrations_rolled_back"
     )
+    mocker.patch.object(houseplant, "update_schema")
+    mock_get_applied = mock_applied(mocker, houseplant, ["20240101000000"])
 
     # Roll back migration
     houseplant.migrate_down()
 
     # Verify correct SQL was executed
-    mock_execute.assert_called_once_with("DROP TABLE events")
-    mock_mark_rolled_back.assert_called_once_with("20240101000000")
+    mock_execute.assert_called_once_with("DROP TABLE events", None)
+    mock_mark_rolled_back.assert_called_once_with(["20240101000000"])
     mock_get_applied.assert_called_once()
 
 
 def test_migrate_up_missing_version(houseplant, test_migration, mocker):
     # Mock database calls
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[]
-    )
+    mock_get_applied = mock_applied(mocker, houseplant, [])
 
     # Run migration with non-existent version
     houseplant.migrate_up("99999999999999")
@@ -516,9 +549,7 @@ def test_migrate_up_missing_table_field(houseplant, tmp_path, mocker):
     # Mock database calls
     mocker.patch.object(houseplant.db, "execute_migration")
     mocker.patch.object(houseplant.db, "mark_migration_applied")
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[]
-    )
+    mock_get_applied = mock_applied(mocker, houseplant, [])
 
     # Set up test environment with invalid migration
     migrations_dir = tmp_path / "ch/migrations"
@@ -546,8 +577,6 @@ production:
 """
 
     migration_file.write_text(migration_content)
-    os.chdir(tmp_path)
-
     # Run migration
     houseplant.migrate_up()
 
@@ -555,11 +584,10 @@ production:
     mock_get_applied.assert_called_once()
 
 
-def test_migrate_down_no_migrations(houseplant, mocker):
+def test_migrate_down_no_migrations(houseplant, tmp_path, mocker):
+    (tmp_path / "ch/migrations").mkdir(parents=True)
     # Mock database calls
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[]
-    )
+    mock_get_applied = mock_applied(mocker, houseplant, [])
 
     # Run migration down
     houseplant.migrate_down()
@@ -568,11 +596,10 @@ def test_migrate_down_no_migrations(houseplant, mocker):
     mock_get_applied.assert_called_once()
 
 
-def test_migrate_down_missing_migration_file(houseplant, mocker):
+def test_migrate_down_missing_migration_file(houseplant, tmp_path, mocker):
+    (tmp_path / "ch/migrations").mkdir(parents=True)
     # Mock database calls to return a version with no corresponding file
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[("99999999999999",)]
-    )
+    mock_get_applied = mock_applied(mocker, houseplant, ["99999999999999"])
 
     # Run migration down
     houseplant.migrate_down()
@@ -608,12 +635,8 @@ production:
 """
 
     migration_file.write_text(migration_content)
-    os.chdir(tmp_path)
-
     # Mock database calls
-    mock_get_applied = mocker.patch.object(
-        houseplant.db, "get_applied_migrations", return_value=[("20240101000000",)]
-    )
+    mock_get_applied = mock_applied(mocker, houseplant, ["20240101000000"])
 
     # Run migration down
     houseplant.migrate_down()
@@ -623,9 +646,1075 @@ production:
 
 
 def test_check_migrations_dir_not_found(houseplant, tmp_path):
-    # Change to empty directory
-    os.chdir(tmp_path)
-
     # Verify SystemExit is raised when migrations dir not found
     with pytest.raises(SystemExit):
         houseplant._check_migrations_dir()
+
+
+def write_migrations(tmp_path, count):
+    migrations_dir = tmp_path / "ch/migrations"
+    migrations_dir.mkdir(parents=True)
+    (tmp_path / "ch/schema.sql").touch()
+
+    versions = [str(20240101000000 + index) for index in range(count)]
+    for index, version in enumerate(versions):
+        (migrations_dir / f"{version}_create_table_{index}.yml").write_text(
+            f"""version: "{version}"
+name: create_table_{index}
+table: table_{index}
+
+development:
+  up: CREATE TABLE {{table}} (id UInt32) ENGINE = MergeTree() ORDER BY id
+  down: DROP TABLE {{table}}
+"""
+        )
+
+    return versions
+
+
+@pytest.fixture
+def recorded_houseplant(houseplant, recording_client, mocker):
+    # Connections opened for concurrent work record into the same client
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    houseplant.db.client = recording_client
+    houseplant.db.database = recording_client.connection.database
+    recording_client.respond_applied([])
+    return houseplant
+
+
+@pytest.mark.parametrize("count", [1, 50])
+def test_migrate_status_query_budget(recorded_houseplant, tmp_path, count):
+    versions = write_migrations(tmp_path, count)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions[::2])
+
+    with client.query_budget(1):
+        recorded_houseplant.migrate_status()
+
+
+@pytest.mark.parametrize("count", [1, 50])
+def test_migrate_up_query_budget(recorded_houseplant, tmp_path, count):
+    write_migrations(tmp_path, count)
+    client = recorded_houseplant.db.client
+
+    # One read, then the statement and two bookkeeping queries per migration
+    with client.query_budget(1 + 3 * count):
+        recorded_houseplant.migrate_up()
+
+
+@pytest.mark.parametrize("count", [1, 50])
+def test_migrate_down_query_budget(recorded_houseplant, tmp_path, count):
+    versions = write_migrations(tmp_path, count)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions)
+
+    # Rollback, bookkeeping and a schema dump without any live objects
+    with client.query_budget(8):
+        recorded_houseplant.migrate_down()
+
+
+@pytest.mark.parametrize("count", [1, 50])
+def test_db_schema_load_query_budget(recorded_houseplant, tmp_path, count):
+    write_migrations(tmp_path, count)
+    client = recorded_houseplant.db.client
+
+    # One insert for every version and one OPTIMIZE
+    with client.query_budget(2):
+        recorded_houseplant.db_schema_load()
+
+
+@pytest.mark.parametrize("count", [1, 50])
+def test_update_schema_query_budget(recorded_houseplant, tmp_path, count):
+    versions = write_migrations(tmp_path, count)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions)
+    client.respond(
+        r"formatQuery\(create_table_query\)",
+        [
+            (f"table_{index}", "tables", f"CREATE TABLE table_{index} (id UInt32)")
+            for index in range(count)
+        ],
+    )
+
+    # The migration diff and the CREATE statements of every object
+    with client.query_budget(2):
+        recorded_houseplant.update_schema()
+
+    with open(tmp_path / "ch/schema.sql") as f:
+        assert f.read().count("CREATE TABLE") == count
+
+
+def test_update_schema_without_format_query(recorded_houseplant, tmp_path):
+    """Test that servers without formatQuery get one SHOW CREATE per object."""
+    versions = write_migrations(tmp_path, 2)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions)
+
+    def unknown_function(query, params):
+        raise ServerException("Unknown function formatQuery", code=46)
+
+    client.respond(r"formatQuery", unknown_function)
+    client.respond(r"''\s+FROM system\.tables", [("table_0", "tables", "")])
+    client.respond(r"^SHOW CREATE TABLE", [("CREATE TABLE table_0 (id UInt32)",)])
+
+    recorded_houseplant.update_schema()
+
+    with open(tmp_path / "ch/schema.sql") as f:
+        assert "CREATE TABLE table_0 (id UInt32);" in f.read()
+
+
+def squashable(tmp_path, client, count=3, statements=None):
+    """Write applied migrations whose first two tables are live."""
+    versions = write_migrations(tmp_path, count)
+    client.respond_applied(versions)
+    client.respond(
+        r"formatQuery\(create_table_query\)",
+        statements
+        or [
+            (
+                name,
+                "tables",
+                f"CREATE TABLE houseplant_test.{name}\n(\n"
+                "    `id` UInt32\n)\nENGINE = ReplicatedMergeTree("
+                "'/clickhouse/tables/{shard}/events', '{replica}')\nORDER BY id",
+            )
+            for name in ["table_0", "table_1"]
+        ],
+    )
+    return versions
+
+
+def test_migrate_squash(recorded_houseplant, tmp_path):
+    versions = squashable(tmp_path, recorded_houseplant.db.client)
+
+    recorded_houseplant.migrate_squash(f"BEFORE={versions[1]}")
+
+    assert sorted(os.listdir(tmp_path / "ch/migrations")) == [
+        f"{versions[1]}_squashed_baseline.yml",
+        f"{versions[2]}_create_table_2.yml",
+    ]
+
+    with open(tmp_path / f"ch/migrations/{versions[1]}_squashed_baseline.yml") as f:
+        baseline = yaml.safe_load(f)
+
+    assert baseline["version"] == versions[1]
+    assert baseline["objects"] == ["table_0", "table_1"]
+    assert "test" not in baseline
+
+    up = baseline["development"]["up"].format(table=baseline["table"])
+    assert up.startswith("CREATE TABLE table_0\n(\n")
+    assert "'/clickhouse/tables/{shard}/events'" in up
+    assert ";\n\nCREATE TABLE table_1\n" in up
+    assert baseline["development"]["down"] == (
+        "DROP TABLE table_1;\nDROP TABLE table_0\n"
+    )
+
+
+def test_migrate_squash_dependency_order(recorded_houseplant, tmp_path):
+    """Test that the baseline creates objects after the objects they read."""
+    versions = squashable(
+        tmp_path,
+        recorded_houseplant.db.client,
+        statements=[
+            (
+                "table_0",
+                "dictionaries",
+                "CREATE DICTIONARY table_0 (id UInt32) PRIMARY KEY id "
+                "SOURCE(CLICKHOUSE(TABLE 'table_1'))",
+            ),
+            ("table_1", "tables", "CREATE TABLE table_1 (id UInt32)"),
+        ],
+    )
+
+    recorded_houseplant.migrate_squash(versions[1])
+
+    with open(tmp_path / f"ch/migrations/{versions[1]}_squashed_baseline.yml") as f:
+        baseline = yaml.safe_load(f)
+
+    assert baseline["development"]["up"].startswith("CREATE TABLE table_1")
+    assert baseline["development"]["down"] == (
+        "DROP DICTIONARY table_0;\nDROP TABLE table_1\n"
+    )
+
+
+def test_migrate_squash_environments(recorded_houseplant, tmp_path):
+    """Test that environments running the same SQL share the baseline."""
+    versions = squashable(tmp_path, recorded_houseplant.db.client)
+    for path in (tmp_path / "ch/migrations").iterdir():
+        path.write_text(
+            path.read_text().replace("development:", "development: &development")
+            + "\nproduction:\n  <<: *development\n"
+        )
+
+    recorded_houseplant.migrate_squash(versions[1])
+
+    with open(tmp_path / f"ch/migrations/{versions[1]}_squashed_baseline.yml") as f:
+        baseline = yaml.safe_load(f)
+
+    assert baseline["production"] == baseline["development"]
+
+
+def test_migrate_squash_environment_specific(recorded_houseplant, tmp_path):
+    """Test that squash refuses when environments ran different SQL."""
+    versions = squashable(tmp_path, recorded_houseplant.db.client)
+    with open(tmp_path / f"ch/migrations/{versions[1]}_create_table_1.yml", "a") as f:
+        f.write("production:\n  up: CREATE TABLE {table} (id UInt64)\n")
+
+    recorded_houseplant.migrate_squash(versions[1])
+
+    assert len(os.listdir(tmp_path / "ch/migrations")) == 3
+
+
+def test_migrate_squash_between_versions(recorded_houseplant, tmp_path):
+    """Test that the baseline keeps the version of the last squashed migration."""
+    versions = squashable(tmp_path, recorded_houseplant.db.client)
+
+    # A BEFORE that sorts between the second and the third version
+    recorded_houseplant.migrate_squash(f"{versions[1]}5")
+
+    baseline_file = f"{versions[1]}_squashed_baseline.yml"
+    assert baseline_file in os.listdir(tmp_path / "ch/migrations")
+    with open(tmp_path / "ch/migrations" / baseline_file) as f:
+        assert yaml.safe_load(f)["version"] == versions[1]
+
+    # The baseline is applied on databases that ran the squashed migrations
+    assert (
+        recorded_houseplant._pending_migration_files(
+            [baseline_file, f"{versions[2]}_create_table_2.yml"]
+        )
+        == []
+    )
+
+
+def test_migrate_squash_pending(recorded_houseplant, tmp_path):
+    versions = write_migrations(tmp_path, 3)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions[:1])
+
+    recorded_houseplant.migrate_squash(versions[1])
+
+    assert len(os.listdir(tmp_path / "ch/migrations")) == 3
+
+
+@pytest.mark.parametrize(
+    "up, squashed",
+    [
+        ("ALTER TABLE table_1 ADD COLUMN x UInt8", False),
+        ("DROP TABLE IF EXISTS houseplant_test.table_0", False),
+        ("RENAME TABLE events TO table_1", False),
+        ("EXCHANGE TABLES events AND table_0", False),
+        ("INSERT INTO events SELECT id FROM table_0", True),
+        ("CREATE TABLE events AS table_1", True),
+    ],
+)
+def test_migrate_squash_changed_later(recorded_houseplant, tmp_path, up, squashed):
+    """Test that squash refuses only when a later migration changes an object."""
+    versions = squashable(tmp_path, recorded_houseplant.db.client)
+    with open(tmp_path / f"ch/migrations/{versions[2]}_create_table_2.yml", "w") as f:
+        f.write(
+            f'version: "{versions[2]}"\nname: later\ntable: events\n'
+            f"development:\n  up: {up}\n"
+        )
+
+    recorded_houseplant.migrate_squash(versions[1])
+
+    assert (len(os.listdir(tmp_path / "ch/migrations")) == 2) is squashed
+
+
+def test_migrate_check(recorded_houseplant, tmp_path):
+    versions = write_migrations(tmp_path, 5)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions[:1])
+
+    assert recorded_houseplant.migrate_check()
+
+    explained = sorted(q["query"] for q in client.queries if "EXPLAIN" in q["query"])
+    assert len(explained) == 8
+    assert explained[0] == "EXPLAIN AST CREATE TABLE table_1 (id UInt32) " + (
+        "ENGINE = MergeTree() ORDER BY id"
+    )
+
+
+def test_migrate_check_invalid(recorded_houseplant, tmp_path):
+    from clickhouse_driver.errors import ServerException
+
+    versions = write_migrations(tmp_path, 3)
+    client = recorded_houseplant.db.client
+
+    def syntax_error(query, params):
+        raise ServerException("DB::Exception: Syntax error\nStack trace", code=62)
+
+    client.respond(r"^EXPLAIN AST DROP TABLE table_1", syntax_error)
+    with open(tmp_path / f"ch/migrations/{versions[2]}_create_table_2.yml", "a") as f:
+        f.write("test:\n  up: SELECT {missing}\n")
+
+    recorded_houseplant.env = "test"
+    assert not recorded_houseplant.migrate_check()
+
+    recorded_houseplant.env = "development"
+    assert not recorded_houseplant.migrate_check()
+
+
+def test_migrate_plan(recorded_houseplant, tmp_path):
+    versions = write_migrations(tmp_path, 3)
+    with open(tmp_path / f"ch/migrations/{versions[1]}_create_table_1.yml", "w") as f:
+        f.write(
+            f'version: "{versions[1]}"\nname: backfill\ntable: table_0\n'
+            "development:\n  up: |\n"
+            "    ALTER TABLE {table} UPDATE id = id + 1 WHERE 1;\n"
+            "    INSERT INTO {table} SELECT id FROM source\n"
+        )
+
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions[:1])
+    client.respond(
+        r"^EXPLAIN ESTIMATE SELECT id FROM source",
+        [("houseplant_test", "source", 2, 500, 10)],
+    )
+    client.respond(
+        r"FROM system\.parts",
+        [("table_0", 1000, 10_000), ("source", 1000, 4_000)],
+    )
+
+    plan_file = tmp_path / "plan.json"
+    plan = recorded_houseplant.migrate_plan(plan_file)
+
+    assert [m["version"] for m in plan["migrations"]] == versions[1:]
+    alter, insert = plan["migrations"][0]["statements"]
+    assert alter["scope"] == "rewrite"
+    assert (alter["rows"], alter["bytes"]) == (1000, 10_000)
+    assert insert["scope"] == "read"
+    assert (insert["rows"], insert["bytes"]) == (500, 2_000)
+    assert plan["migrations"][1]["statements"][0]["scope"] == "metadata"
+
+    sizes = next(q for q in client.queries if "system.parts" in q["query"])
+    assert sizes["params"] == {"tables": ("source", "table_0")}
+
+    client.reset()
+    recorded_houseplant.apply_plan(plan_file)
+
+    queries = [q for q in client.queries if not q["query"].startswith("SELECT")]
+    assert "EXPLAIN" not in " ".join(q["query"] for q in queries)
+    assert queries[0]["query"] == "ALTER TABLE table_0 UPDATE id = id + 1 WHERE 1"
+    assert queries[1]["query"] == "INSERT INTO table_0 SELECT id FROM source"
+    assert queries[2]["params"]["version"] == versions[1]
+
+
+def test_apply_plan_other_database(recorded_houseplant, tmp_path):
+    plan_file = tmp_path / "plan.json"
+    plan_file.write_text(
+        '{"database": "other", "env": "development", "migrations": []}'
+    )
+
+    recorded_houseplant.apply_plan(plan_file)
+
+    assert recorded_houseplant.db.client.query_count == 0
+
+
+@pytest.mark.parametrize("disk_check, applied", [("warn", True), ("error", False)])
+def test_migrate_up_disk_space(recorded_houseplant, tmp_path, disk_check, applied):
+    versions = write_migrations(tmp_path, 1)
+    with open(tmp_path / f"ch/migrations/{versions[0]}_create_table_0.yml", "w") as f:
+        f.write(
+            f'version: "{versions[0]}"\nname: rewrite\ntable: events\n'
+            "development:\n  up: ALTER TABLE {table} MODIFY COLUMN id UInt64\n"
+        )
+
+    client = recorded_houseplant.db.client
+    client.respond(r"FROM system\.parts", [("events", 1000, 50 * 1024**3)])
+    client.respond(
+        r"FROM system\.disks", [("replica-1", 80 * 1024**3), ("replica-2", 1024**3)]
+    )
+
+    recorded_houseplant.disk_check = disk_check
+    recorded_houseplant.migrate_up()
+
+    executed = [q["query"] for q in client.queries]
+    assert ("ALTER TABLE events MODIFY COLUMN id UInt64" in executed) == applied
+
+
+def test_migrate_up_disk_check_off(recorded_houseplant, tmp_path):
+    write_migrations(tmp_path, 1)
+    client = recorded_houseplant.db.client
+
+    recorded_houseplant.disk_check = "off"
+    recorded_houseplant.migrate_up()
+
+    assert not any("system.disks" in q["query"] for q in client.queries)
+
+
+@pytest.fixture
+def settings_profiles(tmp_path):
+    write_migrations(tmp_path, 2)
+    with open(tmp_path / "ch/settings.yml", "w") as f:
+        f.write("""default:
+  settings:
+    max_threads: 4
+    mutations_sync: 1
+  profiles:
+    heavy:
+      max_threads: 16
+      max_insert_threads: 8
+
+production:
+  settings:
+    mutations_sync: 2
+  profiles:
+    heavy:
+      max_insert_threads: 32
+""")
+    with open(tmp_path / "ch/migrations/20240101000001_create_table_1.yml", "w") as f:
+        f.write("""version: "20240101000001"
+name: heavy_backfill
+table: events
+
+development: &development
+  settings_profile: heavy
+  query_settings:
+    max_execution_time: 0
+  up: INSERT INTO {table} SELECT * FROM source
+production:
+  <<: *development
+""")
+
+
+@pytest.mark.parametrize(
+    "env, expected",
+    [
+        (
+            "development",
+            [
+                {"max_threads": 4, "mutations_sync": 1},
+                {
+                    "max_threads": 16,
+                    "mutations_sync": 1,
+                    "max_insert_threads": 8,
+                    "max_execution_time": 0,
+                },
+            ],
+        ),
+        # The first migration has no production block
+        (
+            "production",
+            [
+                {
+                    "max_threads": 16,
+                    "mutations_sync": 2,
+                    "max_insert_threads": 32,
+                    "max_execution_time": 0,
+                },
+            ],
+        ),
+    ],
+)
+def test_settings_profiles(recorded_houseplant, settings_profiles, env, expected):
+    recorded_houseplant.env = env
+    recorded_houseplant.migrate_up()
+
+    client = recorded_houseplant.db.client
+    executed = [
+        q for q in client.queries if q["query"].startswith(("CREATE", "INSERT INTO e"))
+    ]
+    assert [q["settings"] for q in executed] == expected
+
+
+def test_unknown_settings_profile(recorded_houseplant, settings_profiles, tmp_path):
+    with open(tmp_path / "ch/settings.yml", "w") as f:
+        f.write("default:\n  settings:\n    max_threads: 4\n")
+
+    assert not recorded_houseplant.migrate_check()
+
+
+def rolled_back_versions(client):
+    return [
+        row[0]
+        for query in client.queries
+        if query["query"].startswith("INSERT INTO schema_migrations")
+        for row in query["params"]
+    ]
+
+
+def test_migrate_down_steps(recorded_houseplant, tmp_path):
+    versions = write_migrations(tmp_path, 5)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions)
+
+    recorded_houseplant.migrate_down(step="STEP=3")
+
+    drops = [q["query"] for q in client.queries if q["query"].startswith("DROP")]
+    assert drops == ["DROP TABLE table_4", "DROP TABLE table_3", "DROP TABLE table_2"]
+    assert rolled_back_versions(client) == versions[:1:-1]
+
+
+@pytest.mark.parametrize("args", [{"step": 2}, {"version": "20240101000001"}])
+def test_migrate_down_without_file(recorded_houseplant, tmp_path, args):
+    """Test that nothing is rolled back past a version without a local file."""
+    versions = write_migrations(tmp_path, 3)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions + ["20240101000009"])
+
+    recorded_houseplant.migrate_down(**args)
+
+    assert not any(q["query"].startswith("DROP") for q in client.queries)
+    assert rolled_back_versions(client) == []
+
+
+def test_migrate_down_to_version(recorded_houseplant, tmp_path):
+    versions = write_migrations(tmp_path, 5)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions[:4])
+
+    recorded_houseplant.migrate_down(f"VERSION={versions[1]}")
+
+    drops = [q["query"] for q in client.queries if q["query"].startswith("DROP")]
+    assert drops == ["DROP TABLE table_3", "DROP TABLE table_2", "DROP TABLE table_1"]
+    assert rolled_back_versions(client) == [versions[3], versions[2], versions[1]]
+
+
+def test_migrate_down_records_partial_rollback(recorded_houseplant, tmp_path):
+    versions = write_migrations(tmp_path, 3)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions)
+
+    def fail(query, params):
+        raise ServerException("Table is locked", code=473)
+
+    client.respond(r"^DROP TABLE table_1", fail)
+
+    with pytest.raises(ServerException):
+        recorded_houseplant.migrate_down(step=3)
+
+    assert rolled_back_versions(client) == [versions[2]]
+
+
+def test_migrate_down_keeps_migration_error(recorded_houseplant, tmp_path, mocker):
+    """Test that failed bookkeeping doesn't hide the error of a migration."""
+    versions = write_migrations(tmp_path, 2)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions)
+
+    def fail(query, params):
+        raise ServerException("Table is locked", code=473)
+
+    client.respond(r"^DROP TABLE table_0", fail)
+    mocker.patch.object(
+        recorded_houseplant.db,
+        "mark_migrations_rolled_back",
+        side_effect=ServerException("Too many parts", code=252),
+    )
+
+    with pytest.raises(ServerException, match="Table is locked"):
+        recorded_houseplant.migrate_down(step=2)
+
+
+def test_migrate_down_stops_on_broken_migration(recorded_houseplant, tmp_path):
+    versions = write_migrations(tmp_path, 2)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions)
+    migration = tmp_path / f"ch/migrations/{versions[0]}_create_table_0.yml"
+    migration.write_text(migration.read_text().replace("{table}", "{missing}"))
+
+    recorded_houseplant.migrate_down(step=2)
+
+    assert not [q for q in client.queries if q["query"].startswith("DROP")]
+
+
+@pytest.mark.parametrize("count", [1, 50])
+def test_migrate_down_all_query_budget(recorded_houseplant, tmp_path, count):
+    versions = write_migrations(tmp_path, count)
+    client = recorded_houseplant.db.client
+    client.respond_applied(versions)
+
+    # One statement per migration, one batch of bookkeeping, one schema dump
+    with client.query_budget(count + 7):
+        recorded_houseplant.migrate_down(versions[0])
+
+
+SCHEMA_SQL = """-- version: 20240101000000
+
+-- TABLES
+
+CREATE TABLE development.events
+(
+    `id` UInt32
+)
+ENGINE = MergeTree
+ORDER BY id
+;
+
+CREATE TABLE development.users
+(
+    `id` UInt32
+)
+ENGINE = MergeTree
+ORDER BY id
+;
+
+CREATE TABLE development.sessions
+(
+    `id` UInt32
+)
+ENGINE = MergeTree
+ORDER BY id;
+"""
+
+
+def test_schema_diff(recorded_houseplant, tmp_path):
+    (tmp_path / "ch").mkdir()
+    (tmp_path / "ch/schema.sql").write_text(SCHEMA_SQL)
+    client = recorded_houseplant.db.client
+
+    def live(name, columns="`id` UInt32"):
+        return (
+            f"CREATE TABLE houseplant_test.{name} ({columns}) "
+            "ENGINE = MergeTree ORDER BY id"
+        )
+
+    def hashed(statement):
+        return schema_hash(normalize_create(statement, "houseplant_test"))
+
+    client.respond(
+        r"SHA256",
+        [
+            ("houseplant_test", "events", "tables", hashed(live("events"))),
+            (
+                "houseplant_test",
+                "users",
+                "tables",
+                hashed(live("users", "`id` UInt64")),
+            ),
+            ("houseplant_test", "logs", "tables", hashed(live("logs"))),
+        ],
+    )
+    client.respond(r"^SHOW CREATE TABLE users", [(live("users", "`id` UInt64"),)])
+
+    result = recorded_houseplant.schema_diff()
+
+    assert result["missing"] == [{"name": "sessions", "category": "tables"}]
+    assert result["extra"] == [{"name": "logs", "category": "tables"}]
+    [changed] = result["changed"]
+    assert changed["name"] == "users"
+    assert "-    `id` UInt32" in changed["diff"]
+    assert "+CREATE TABLE users (`id` UInt64)" in changed["diff"]
+    # Full statements are only read for objects whose hashes differ
+    assert [q["query"] for q in client.queries if q["query"].startswith("SHOW")] == [
+        "SHOW CREATE TABLE users"
+    ]
+
+
+def test_schema_diff_in_sync(recorded_houseplant, tmp_path):
+    (tmp_path / "ch").mkdir()
+    (tmp_path / "ch/schema.sql").write_text(SCHEMA_SQL)
+    client = recorded_houseplant.db.client
+    statements = parse_schema(SCHEMA_SQL)["tables"]
+    client.respond(
+        r"SHA256",
+        [
+            (
+                "houseplant_test",
+                parse_create(statement)[1],
+                "tables",
+                schema_hash(normalize_create(statement, "development")),
+            )
+            for statement in statements
+        ],
+    )
+
+    result = recorded_houseplant.schema_diff()
+
+    assert not any(result.values())
+    assert client.query_count == 1
+
+
+def test_schema_fingerprint(recorded_houseplant, tmp_path):
+    (tmp_path / "ch").mkdir()
+    (tmp_path / "ch/schema.sql").write_text(SCHEMA_SQL)
+    client = recorded_houseplant.db.client
+    hashes = {
+        parse_create(statement)[1]: schema_hash(
+            normalize_create(statement, "development")
+        )
+        for statement in parse_schema(SCHEMA_SQL)["tables"]
+    }
+    rows = [("tenant_b", name, "tables", digest) for name, digest in hashes.items()]
+    rows.append(("tenant_b", "logs", "tables", "0" * 64))
+    client.respond(
+        r"SHA256",
+        lambda query, params: [row for row in rows if row[0] == params["database"]],
+    )
+    client.respond(
+        r"GROUP BY database",
+        [("tenant_a", schema_fingerprint(hashes)), ("tenant_b", "f" * 64)],
+    )
+
+    result = recorded_houseplant.schema_fingerprint(["tenant_*", "tenant_c"])
+
+    assert result["fingerprint"] == schema_fingerprint(hashes)
+    assert client.queries[0]["params"] == {"patterns": ["tenant\\_%", "tenant\\_c"]}
+    tenant_a, tenant_b, tenant_c = result["targets"]
+    assert tenant_a["database"] == "tenant_a"
+    assert not target_drifted(tenant_a)
+    assert tenant_b["extra"] == [{"name": "logs", "category": "tables"}]
+    assert tenant_c["fingerprint"] is None
+    assert len(tenant_c["missing"]) == 3
+    # Only databases with another fingerprint are inspected object by object
+    assert [q["params"] for q in client.queries[1:]] == [
+        {"database": "tenant_b"},
+        {"database": "tenant_c"},
+    ]
+
+
+def test_migrate_up_records_checksums(recorded_houseplant, tmp_path):
+    versions = write_migrations(tmp_path, 1)
+    client = recorded_houseplant.db.client
+
+    recorded_houseplant.migrate_up()
+
+    [insert] = [q for q in client.queries if q["query"].startswith("INSERT")]
+    migration = tmp_path / f"ch/migrations/{versions[0]}_create_table_0.yml"
+    assert insert["params"] == {
+        "version": versions[0],
+        "checksum": hashlib.sha256(migration.read_bytes()).hexdigest(),
+    }
+    manifest = json.loads((tmp_path / "ch/.checksums.json").read_text())
+    assert manifest[migration.name]["checksum"] == insert["params"]["checksum"]
+
+
+@pytest.mark.parametrize("checksum_check", ["warn", "error", "off"])
+def test_changed_migration(recorded_houseplant, tmp_path, capsys, checksum_check):
+    versions = write_migrations(tmp_path, 2)
+    recorded_houseplant.checksum_check = checksum_check
+    checksums = get_migration_checksums(
+        os.listdir(tmp_path / "ch/migrations"), tmp_path
+    )
+    recorded_houseplant.db.client.respond_applied(
+        versions, {versions[0]: "0" * 64, versions[1]: checksums[versions[1]]}
+    )
+
+    if checksum_check == "error":
+        with pytest.raises(SystemExit):
+            recorded_houseplant.migrate_status()
+    else:
+        recorded_houseplant.migrate_status()
+
+    output = capsys.readouterr().out
+    assert ("create_table_0.yml" in output) == (checksum_check != "off")
+    assert "create_table_1.yml" not in output
+
+
+def test_loaded_migrations_are_read_only(recorded_houseplant, tmp_path):
+    """Test that migrations are parsed on every load outside the daemon."""
+    write_migrations(tmp_path, 1)
+
+    migration = recorded_houseplant._load_migration("20240101000000_create_table_0.yml")
+
+    with pytest.raises(TypeError):
+        migration["development"]["up"] = "DROP TABLE table_0"
+    assert recorded_houseplant._migration_cache is None
+
+
+def test_migration_checksums_are_cached(tmp_path, mocker):
+    write_migrations(tmp_path, 2)
+    migration_files = sorted(os.listdir(tmp_path / "ch/migrations"))
+
+    checksums = get_migration_checksums(migration_files, tmp_path)
+    hashed = mocker.spy(hashlib, "sha256")
+    assert get_migration_checksums(migration_files, tmp_path) == checksums
+    assert hashed.call_count == 0
+
+    (tmp_path / "ch/migrations" / migration_files[1]).write_text("changed: true\n")
+    changed = get_migration_checksums(migration_files, tmp_path)
+    assert hashed.call_count == 1
+    assert (
+        changed[migration_files[0].split("_")[0]]
+        == checksums[migration_files[0].split("_")[0]]
+    )
+    assert changed != checksums
+
+
+def test_status(recorded_houseplant, tmp_path):
+    versions = write_migrations(tmp_path, 2)
+    recorded_houseplant.db.client.respond_applied(versions[:1])
+
+    assert list(recorded_houseplant.status()) == [
+        {
+            "version": versions[0],
+            "name": "create table 0",
+            "file": f"{versions[0]}_create_table_0.yml",
+            "status": "up",
+            "changed": False,
+        },
+        {
+            "version": versions[1],
+            "name": "create table 1",
+            "file": f"{versions[1]}_create_table_1.yml",
+            "status": "down",
+            "changed": False,
+        },
+    ]
+
+
+def test_migrate_status_records(recorded_houseplant, tmp_path, mocker):
+    write_migrations(tmp_path, 2)
+    records = []
+    recorded_houseplant.on_record = records.append
+    table = mocker.patch("houseplant.houseplant.Table")
+
+    recorded_houseplant.migrate_status()
+
+    assert [record["status"] for record in records] == ["down", "down"]
+    table.assert_not_called()
+
+
+def test_migrate_records(recorded_houseplant, tmp_path):
+    versions = write_migrations(tmp_path, 2)
+    records = []
+    recorded_houseplant.on_record = records.append
+
+    recorded_houseplant.migrate_up()
+    recorded_houseplant.db.client.respond_applied(versions)
+    recorded_houseplant.migrate_down(step=1)
+
+    assert records == [
+        {
+            "version": versions[0],
+            "file": f"{versions[0]}_create_table_0.yml",
+            "direction": "up",
+            "status": "applied",
+        },
+        {
+            "version": versions[1],
+            "file": f"{versions[1]}_create_table_1.yml",
+            "direction": "up",
+            "status": "applied",
+        },
+        {
+            "version": versions[1],
+            "file": f"{versions[1]}_create_table_1.yml",
+            "direction": "down",
+            "status": "rolled_back",
+        },
+    ]
+
+
+def test_projects_in_threads(mocker, tmp_path):
+    def connect(**kwargs):
+        client = RecordingClient(database=kwargs["database"])
+        client.respond_applied([])
+        return client
+
+    mocker.patch("houseplant.clickhouse_client.Client", side_effect=connect)
+    roots = [tmp_path / "one", tmp_path / "two"]
+    write_migrations(roots[0], 1)
+    write_migrations(roots[1], 2)
+    (roots[1] / ".env").write_text("CLICKHOUSE_DB=two\n")
+
+    projects = [Houseplant(root=root) for root in roots]
+    with ThreadPoolExecutor() as executor:
+        list(executor.map(lambda project: project.migrate_up(), projects))
+
+    assert projects[0].db.database == "development"
+    assert projects[1].db.database == "two"
+    for project, count in zip(projects, [1, 2]):
+        queries = [q["query"] for q in project.db.client.queries]
+        assert len([q for q in queries if q.startswith("CREATE TABLE")]) == count
+    assert (roots[0] / "ch/schema.sql").exists()
+    assert (roots[1] / "ch/schema.sql").exists()
+    assert not (tmp_path / "ch").exists()
+
+
+def test_project_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("CLICKHOUSE_USER", "from_environment")
+    monkeypatch.delenv("CLICKHOUSE_DB", raising=False)
+    (tmp_path / ".env").write_text(
+        "CLICKHOUSE_DB=from_dotenv\nCLICKHOUSE_USER=from_dotenv\n"
+    )
+
+    env = project_env(tmp_path)
+
+    assert env["CLICKHOUSE_DB"] == "from_dotenv"
+    assert env["CLICKHOUSE_USER"] == "from_environment"
+    assert "CLICKHOUSE_DB" not in os.environ
+    assert project_env() == dict(os.environ)
+
+
+def write_seed_migration(tmp_path, seed="seeds/countries.csv"):
+    migrations_dir = tmp_path / "ch/migrations"
+    migrations_dir.mkdir(parents=True)
+    (tmp_path / "ch/seeds").mkdir()
+    (tmp_path / "ch/seeds/countries.csv").write_text(
+        "code,name\nfr,France\nnz,New Zealand\nis,Iceland\n"
+    )
+    (migrations_dir / "20240101000000_seed_countries.yml").write_text(
+        f"""version: "20240101000000"
+name: seed_countries
+table: countries
+
+development:
+  up: CREATE TABLE {{table}} (code String, name String) ENGINE = MergeTree() ORDER BY code
+  seed: {seed}
+  query_settings:
+    max_insert_threads: 4
+"""
+    )
+
+
+def test_migrate_up_seed(recorded_houseplant, tmp_path):
+    write_seed_migration(tmp_path)
+    recorded_houseplant.seed_block_size = 2
+    client = recorded_houseplant.db.client
+    client.respond(r"FROM system\.columns", [("code", "String"), ("name", "String")])
+
+    recorded_houseplant.migrate_up()
+
+    queries = [q["query"] for q in client.queries]
+    create = queries.index(
+        "CREATE TABLE countries (code String, name String) "
+        "ENGINE = MergeTree() ORDER BY code"
+    )
+    inserts = [
+        q for q in client.queries if q["query"].startswith("INSERT INTO countries")
+    ]
+    assert [q["params"] for q in inserts] == [
+        [["fr", "nz"], ["France", "New Zealand"]],
+        [["is"], ["Iceland"]],
+    ]
+    assert inserts[0]["settings"] == {"max_insert_threads": 4}
+    assert create < queries.index(inserts[0]["query"])
+    assert queries.index(inserts[0]["query"]) < next(
+        i
+        for i, q in enumerate(queries)
+        if q.startswith("INSERT INTO schema_migrations")
+    )
+
+
+def test_migrate_up_seed_missing(recorded_houseplant, tmp_path):
+    write_seed_migration(tmp_path, seed="seeds/plans.csv")
+    records = []
+    recorded_houseplant.on_record = records.append
+
+    assert not recorded_houseplant.migrate_check()
+    recorded_houseplant.migrate_up()
+
+    assert records == [
+        {
+            "version": "20240101000000",
+            "file": "20240101000000_seed_countries.yml",
+            "direction": "up",
+            "status": "failed",
+            "error": "seed file ch/seeds/plans.csv not found",
+        }
+    ]
+    assert not any(
+        q["query"].startswith("CREATE TABLE countries")
+        for q in recorded_houseplant.db.client.queries
+    )
+
+
+def test_migrate_up_seed_bad_row(recorded_houseplant, tmp_path):
+    """Test that a bad seed row fails the migration without marking it applied."""
+    write_seed_migration(tmp_path)
+    (tmp_path / "ch/seeds/countries.csv").write_text("code,name\nfr,France\nnz\n")
+    recorded_houseplant.db.client.respond(
+        r"FROM system\.columns", [("code", "String"), ("name", "String")]
+    )
+    records = []
+    recorded_houseplant.on_record = records.append
+
+    recorded_houseplant.migrate_up()
+
+    assert records == [
+        {
+            "version": "20240101000000",
+            "file": "20240101000000_seed_countries.yml",
+            "direction": "up",
+            "status": "failed",
+            "error": f"{tmp_path}/ch/seeds/countries.csv:3: expected 2 values, got 1",
+        }
+    ]
+    assert not any(
+        q["query"].startswith("INSERT INTO schema_migrations")
+        for q in recorded_houseplant.db.client.queries
+    )
+
+
+def test_migrate_plan_seed(recorded_houseplant, tmp_path):
+    write_seed_migration(tmp_path)
+    recorded_houseplant.db.client.respond(
+        r"FROM system\.columns", [("code", "String"), ("name", "String")]
+    )
+
+    plan = recorded_houseplant.migrate_plan(str(tmp_path / "plan.json"))
+    assert plan["migrations"][0]["seeds"] == [
+        {"file": "seeds/countries.csv", "table": "countries"}
+    ]
+
+    recorded_houseplant.apply_plan(str(tmp_path / "plan.json"))
+    inserts = [
+        q
+        for q in recorded_houseplant.db.client.queries
+        if q["query"].startswith("INSERT INTO countries")
+    ]
+    assert inserts[0]["params"] == [
+        ["fr", "nz", "is"],
+        ["France", "New Zealand", "Iceland"],
+    ]
+
+
+def write_file_migration(tmp_path, **sql):
+    migrations_dir = tmp_path / "ch/migrations"
+    migrations_dir.mkdir(parents=True)
+    (tmp_path / "ch/sql").mkdir()
+    (tmp_path / "ch/sql/backfill.sql").write_text(
+        "-- Copy the events; in two steps\n"
+        "INSERT INTO events SELECT * FROM raw WHERE note = 'a;b';\n"
+        "OPTIMIZE TABLE events FINAL;\n"
+    )
+    lines = "".join(f"  {key}: {value}\n" for key, value in sql.items())
+    (migrations_dir / "20240101000000_backfill.yml").write_text(
+        f"""version: "20240101000000"
+name: backfill
+table: events
+
+development:
+{lines}"""
+    )
+
+
+def test_migrate_up_file(recorded_houseplant, tmp_path):
+    """Test that an up_file is run one statement at a time."""
+    write_file_migration(
+        tmp_path, up_file="sql/backfill.sql", down="TRUNCATE TABLE {table}"
+    )
+
+    recorded_houseplant.migrate_up()
+
+    queries = [q["query"] for q in recorded_houseplant.db.client.queries]
+    start = queries.index("INSERT INTO events SELECT * FROM raw WHERE note = 'a;b'")
+    assert queries[start + 1] == "OPTIMIZE TABLE events FINAL"
+    assert queries[start + 2].startswith("INSERT INTO schema_migrations")
+
+
+@pytest.mark.parametrize(
+    "sql, error",
+    [
+        (
+            {"up": "SELECT 1", "up_file": "sql/backfill.sql"},
+            "use either 'up' or 'up_file'",
+        ),
+        ({"up_file": "sql/missing.sql"}, "SQL file ch/sql/missing.sql not found"),
+    ],
+)
+def test_migrate_up_file_errors(recorded_houseplant, tmp_path, sql, error):
+    write_file_migration(tmp_path, **sql)
+    records = []
+    recorded_houseplant.on_record = records.append
+
+    recorded_houseplant.migrate_up()
+
+    assert records[0]["status"] == "failed"
+    assert records[0]["error"] == error
+    assert not any(
+        q["query"].startswith("INSERT INTO events")
+        for q in recorded_houseplant.db.client.queries
+    )
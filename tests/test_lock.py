@@ -0,0 +1,319 @@
+import time
+
+import pytest
+from clickhouse_driver.errors import ServerException
+
+from houseplant import Houseplant
+from houseplant.clickhouse_client import ClickHouseClient
+from houseplant.lock import LockLost, LockNotAcquired, MigrationLock
+from tests.test_houseplant import write_migrations
+
+
+@pytest.fixture
+def sleeps():
+    return []
+
+
+@pytest.fixture
+def db(mocker, recording_client):
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    return ClickHouseClient()
+
+
+def holders(*owners):
+    """Answer the holder query with each of ``owners`` in turn."""
+    owners = iter(owners)
+
+    def respond(query, params):
+        owner = next(owners)
+        return [(owner, 1)] if owner else []
+
+    return respond
+
+
+def taken_over(lock, owner="deploy-2"):
+    """Answer the holder query with ``lock`` once, then with ``owner``."""
+    answers = iter([lock.owner])
+
+    def respond(query, params):
+        return [(next(answers, owner), 1)]
+
+    return respond
+
+
+def wait_until_lost(lock):
+    """Block a query until the heartbeat found out the lease was lost."""
+
+    def respond(query, params):
+        deadline = time.monotonic() + 5
+        while lock.lost is None and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return []
+
+    return respond
+
+
+def keeper_conflicts(count):
+    """Fail the first ``count`` strict inserts like an existing KeeperMap key."""
+    attempts = iter(range(count + 1))
+
+    def respond(query, params):
+        if next(attempts) < count:
+            raise ServerException("Node exists", code=999)
+        return []
+
+    return respond
+
+
+def test_table_lock(db, sleeps):
+    """Test that a free lock is taken, renewed and released."""
+    lock = MigrationLock(db, engine="table", lease=0.03, sleep=sleeps.append)
+    free = iter([True])
+    db.client.respond(
+        r"SELECT owner",
+        lambda query, params: [] if next(free, False) else [(lock.owner, 1)],
+    )
+
+    lock.acquire()
+    time.sleep(0.1)
+    lock.check()
+    lock.release()
+
+    queries = [q["query"] for q in db.client.queries]
+    assert queries[0].startswith("SELECT owner")
+    assert queries[1].startswith("INSERT INTO houseplant_locks SELECT %(name)s")
+    assert queries[2].startswith("SELECT owner")
+    assert any("FROM houseplant_locks FINAL WHERE" in q for q in queries[3:-1])
+    assert "toDateTime64(0, 3, 'UTC')" in queries[-1]
+    assert db.client.queries[1]["params"] == {
+        "name": "migrations",
+        "owner": lock.owner,
+        "lease": 30,
+    }
+    assert not lock.held
+    assert sleeps == []
+
+
+def test_table_lock_held(db, sleeps):
+    """Test that a process gives up at once when another one holds the lock."""
+    lock = MigrationLock(db, engine="table", sleep=sleeps.append)
+    db.client.respond(r"SELECT owner", holders("deploy-1"))
+
+    with pytest.raises(LockNotAcquired, match="deploy-1"):
+        lock.acquire()
+
+    # A held lock is only read, nothing is written
+    assert db.client.query_count == 1
+    assert not lock.held
+    assert sleeps == []
+
+
+def test_table_lock_race(db):
+    """Test that the row of a process that lost a race is withdrawn."""
+    lock = MigrationLock(db, engine="table")
+    db.client.respond(r"SELECT owner", holders(None, "deploy-1"))
+
+    with pytest.raises(LockNotAcquired, match="deploy-1"):
+        lock.acquire()
+
+    queries = [q["query"] for q in db.client.queries]
+    assert queries[1].startswith("INSERT INTO houseplant_locks SELECT %(name)s")
+    assert "toDateTime64(0, 3, 'UTC')" in queries[-1]
+    assert len(queries) == 4
+
+
+def test_table_lock_wait_reads_only(db, sleeps):
+    """Test that waiting for a held lock writes no rows."""
+    lock = MigrationLock(
+        db,
+        engine="table",
+        policy="wait",
+        timeout=1.5,
+        sleep=sleeps.append,
+        clock=lambda: sum(sleeps),
+    )
+    db.client.respond(r"SELECT owner", holders("deploy-1", "deploy-1", "deploy-1"))
+
+    with pytest.raises(LockNotAcquired):
+        lock.acquire()
+
+    assert sleeps == [1.0, 1.0]
+    assert db.client.query_count == 3
+    assert not any(q["query"].startswith("INSERT") for q in db.client.queries)
+
+
+def test_keeper_lock_held(db):
+    """Test that a strict KeeperMap insert of a held lock fails fast."""
+    lock = MigrationLock(db, engine="keeper")
+    db.client.respond(r"^INSERT INTO houseplant_locks", keeper_conflicts(1))
+    db.client.respond(r"SELECT owner", holders("deploy-1"))
+
+    with pytest.raises(LockNotAcquired, match="deploy-1"):
+        lock.acquire()
+
+    assert db.client.queries[0]["settings"] == {"keeper_map_strict_mode": 1}
+    assert db.client.query_count == 2
+
+
+def test_keeper_lock_expired(db):
+    """Test that the lease of a dead process is taken over."""
+    lock = MigrationLock(db, engine="keeper")
+    db.client.respond(r"^INSERT INTO houseplant_locks", keeper_conflicts(1))
+    db.client.respond(r"SELECT owner", [("deploy-1", 0)])
+
+    lock.acquire()
+    lock.release()
+
+    queries = [q["query"] for q in db.client.queries]
+    assert queries[2] == (
+        "ALTER TABLE houseplant_locks DELETE WHERE name = %(name)s "
+        "AND owner = %(owner)s AND expires_at <= now64(3)"
+    )
+    assert db.client.queries[2]["params"]["owner"] == "deploy-1"
+    assert queries[3].startswith("INSERT INTO houseplant_locks")
+    assert db.client.queries[-1]["params"]["owner"] == lock.owner
+
+
+def test_wait_for_lock(db, sleeps):
+    """Test that the wait policy polls until the lock is free."""
+    lock = MigrationLock(db, engine="keeper", policy="wait", sleep=sleeps.append)
+    db.client.respond(r"^INSERT INTO houseplant_locks", keeper_conflicts(2))
+    db.client.respond(r"SELECT owner", holders("deploy-1", "deploy-1"))
+
+    with lock:
+        assert lock.held
+
+    assert sleeps == [1.0, 1.0]
+
+
+def test_lost_lock(db):
+    """Test that no statement runs once another process took the lease over."""
+    lock = MigrationLock(db, engine="keeper", lease=0.03)
+    db.client.respond(r"SELECT owner", taken_over(lock))
+
+    lock.acquire()
+    wait_until_lost(lock)(None, None)
+
+    with pytest.raises(LockLost, match="deploy-2"):
+        db.execute_statements(["CREATE TABLE events (id UInt32)"])
+    lock.release()
+
+    assert not any(q["query"].startswith("CREATE") for q in db.client.queries)
+    assert db.lock is None
+
+
+def test_lock_table_created(db):
+    """Test that the lock table is created the first time it's needed."""
+    lock = MigrationLock(db, engine="keeper")
+    missing = iter([True])
+
+    def insert(query, params):
+        if next(missing, False):
+            raise ServerException(
+                "Table houseplant_test.houseplant_locks does not exist", code=60
+            )
+        return []
+
+    db.client.respond(r"^INSERT INTO houseplant_locks", insert)
+
+    lock.try_acquire()
+
+    create = db.client.queries[1]["query"]
+    assert create.startswith("CREATE TABLE IF NOT EXISTS houseplant_locks")
+    assert f"KeeperMap('/houseplant/{db.database}/houseplant_locks')" in create
+    assert "TTL" not in create
+    assert db.client.queries[2]["query"].startswith("INSERT INTO houseplant_locks")
+
+
+def test_lock_table_ttl(db):
+    MigrationLock(db, engine="table").create_table()
+
+    create = db.client.queries[0]["query"]
+    assert "ENGINE = ReplacingMergeTree(updated_at)" in create
+    assert "TTL toDateTime(expires_at) + INTERVAL 1 DAY" in create
+
+
+def test_unknown_lock_engine(db):
+    with pytest.raises(ValueError, match="HOUSEPLANT_LOCK"):
+        MigrationLock(db, engine="zookeeper")
+
+
+@pytest.mark.parametrize("policy", ["fail", "skip"])
+def test_migrate_locked(mocker, recording_client, tmp_path, monkeypatch, policy):
+    """Test that a deploy that loses the lock runs no migration."""
+    monkeypatch.setenv("HOUSEPLANT_LOCK", "table")
+    monkeypatch.setenv("HOUSEPLANT_LOCK_POLICY", policy)
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    recording_client.respond_applied([])
+    recording_client.respond(r"SELECT owner", [("deploy-1", 1)])
+    write_migrations(tmp_path, 2)
+    houseplant = Houseplant(root=tmp_path)
+
+    if policy == "fail":
+        with pytest.raises(SystemExit):
+            houseplant.migrate()
+    else:
+        houseplant.migrate()
+
+    queries = [q["query"] for q in recording_client.queries]
+    assert not any(q.startswith("CREATE TABLE table_") for q in queries)
+    assert not any("schema_migrations" in q for q in queries)
+
+
+def test_migrate_holds_lock(mocker, recording_client, tmp_path, monkeypatch):
+    """Test that migrations run between taking and releasing the lock."""
+    monkeypatch.setenv("HOUSEPLANT_LOCK", "table")
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    recording_client.respond_applied([])
+    write_migrations(tmp_path, 1)
+    houseplant = Houseplant(root=tmp_path)
+    recording_client.respond(r"SELECT owner", [(houseplant.lock.owner, 1)])
+
+    houseplant.migrate()
+
+    queries = [q["query"] for q in recording_client.queries]
+    created = next(
+        i for i, q in enumerate(queries) if q.startswith("CREATE TABLE table_0")
+    )
+    assert queries[1].startswith("INSERT INTO houseplant_locks")
+    assert "toDateTime64(0, 3, 'UTC')" in queries[-1]
+    assert 1 < created < len(queries) - 1
+    assert not houseplant.lock.held
+
+
+def test_migrate_lost_lock(mocker, recording_client, tmp_path, monkeypatch):
+    """Test that a deploy stops before its next migration once the lock is lost."""
+    monkeypatch.setenv("HOUSEPLANT_LOCK", "table")
+    monkeypatch.setenv("HOUSEPLANT_LOCK_LEASE", "0.03")
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    recording_client.respond_applied([])
+    write_migrations(tmp_path, 2)
+    houseplant = Houseplant(root=tmp_path)
+    recording_client.respond(r"SELECT owner", taken_over(houseplant.lock))
+    recording_client.respond(r"^CREATE TABLE table_0", wait_until_lost(houseplant.lock))
+
+    with pytest.raises(SystemExit):
+        houseplant.migrate()
+
+    queries = [q["query"] for q in recording_client.queries]
+    assert not any(q.startswith("CREATE TABLE table_1") for q in queries)
+    assert not houseplant.lock.held
+
+
+@pytest.mark.parametrize(
+    "command",
+    [lambda h: h.db_schema_load(bootstrap=True), lambda h: h.migrate_squash("1")],
+)
+def test_commands_locked(mocker, recording_client, tmp_path, monkeypatch, command):
+    """Test that loading the schema and squashing wait for running migrations."""
+    monkeypatch.setenv("HOUSEPLANT_LOCK", "table")
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    recording_client.respond(r"SELECT owner", [("deploy-1", 1)])
+    write_migrations(tmp_path, 2)
+    houseplant = Houseplant(root=tmp_path)
+
+    with pytest.raises(SystemExit):
+        command(houseplant)
+
+    queries = [q["query"] for q in recording_client.queries]
+    assert not any("schema_migrations" in q for q in queries)
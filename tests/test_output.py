@@ -0,0 +1,38 @@
+import io
+import json
+
+from houseplant.output import RecordWriter
+
+
+def test_ndjson():
+    """Test that each record is written on its own line."""
+    stream = io.StringIO()
+    with RecordWriter("ndjson", stream) as writer:
+        writer.write({"version": "20240101000000", "status": "up"})
+        assert stream.getvalue().count("\n") == 1
+        writer.write({"version": "20240102000000", "status": "down"})
+
+    lines = stream.getvalue().splitlines()
+    assert [json.loads(line)["status"] for line in lines] == ["up", "down"]
+
+
+def test_json():
+    """Test that records are streamed as a single JSON array."""
+    stream = io.StringIO()
+    with RecordWriter("json", stream) as writer:
+        writer.write({"version": "20240101000000"})
+        writer.write({"version": "20240102000000"})
+
+    assert json.loads(stream.getvalue()) == [
+        {"version": "20240101000000"},
+        {"version": "20240102000000"},
+    ]
+
+
+def test_json_without_records():
+    """Test that an empty array is written when there are no records."""
+    stream = io.StringIO()
+    with RecordWriter("json", stream):
+        pass
+
+    assert json.loads(stream.getvalue()) == []
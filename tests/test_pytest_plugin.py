@@ -0,0 +1,59 @@
+from houseplant.pytest_plugin import build_template, clone_database
+
+
+def test_clone_database(recording_client):
+    """Test cloning tables with their partitions and recreating views."""
+    recording_client.respond(
+        r"FROM system\.tables",
+        [
+            ("events", "MergeTree", "CREATE TABLE template.events ..."),
+            (
+                "events_mv",
+                "MaterializedView",
+                "CREATE MATERIALIZED VIEW "
+                "template.events_mv TO template.events AS SELECT 1",
+            ),
+            ("schema_migrations", "ReplacingMergeTree", "CREATE TABLE ..."),
+        ],
+    )
+    recording_client.respond(r"FROM system\.parts", [("events", ["202401", "202402"])])
+
+    clone_database(recording_client, "template", "clone")
+
+    queries = [query["query"] for query in recording_client.queries[3:]]
+    assert recording_client.queries[0]["query"] == "CREATE DATABASE `clone`"
+    assert "NOT startsWith(name, '.inner')" in recording_client.queries[1]["query"]
+    assert queries == [
+        "CREATE TABLE `clone`.`events` AS `template`.`events`",
+        "ALTER TABLE `clone`.`events` ATTACH PARTITION ID '202401' "
+        "FROM `template`.`events`",
+        "ALTER TABLE `clone`.`events` ATTACH PARTITION ID '202402' "
+        "FROM `template`.`events`",
+        "CREATE TABLE `clone`.`schema_migrations` AS `template`.`schema_migrations`",
+        "CREATE MATERIALIZED VIEW clone.events_mv TO clone.events AS SELECT 1",
+    ]
+
+
+def test_build_template(tmp_path, mocker, recording_client):
+    """Test building a template database from the schema file."""
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+
+    migrations_dir = tmp_path / "ch/migrations"
+    migrations_dir.mkdir(parents=True)
+    (migrations_dir / "20240101000000_create_events.yml").touch()
+    (migrations_dir / "20240201000000_not_in_schema.yml").touch()
+    schema_path = tmp_path / "ch/schema.sql"
+    schema_path.write_text(
+        "-- version: 20240101000000\n\n-- TABLES\n\n"
+        "CREATE TABLE development.events\n(\n    `id` UInt32\n)\n"
+        "ENGINE = MergeTree\nORDER BY id;"
+    )
+
+    build_template("template", schema_path, migrations_dir)
+
+    queries = [query["query"] for query in recording_client.queries]
+    assert queries[0] == "CREATE DATABASE IF NOT EXISTS template"
+    assert queries[2] == (
+        "CREATE TABLE template.events ( `id` UInt32 ) ENGINE = MergeTree ORDER BY id"
+    )
+    assert recording_client.queries[3]["params"] == [("20240101000000", 1, "")]
@@ -0,0 +1,99 @@
+import pytest
+from clickhouse_driver.errors import NetworkError, ServerException
+
+from houseplant.clickhouse_client import ClickHouseClient
+from houseplant.retry import RetryPolicy
+
+
+@pytest.fixture
+def sleeps():
+    return []
+
+
+@pytest.fixture
+def retry(sleeps):
+    return RetryPolicy(attempts=3, backoff=1, max_backoff=30, sleep=sleeps.append)
+
+
+@pytest.fixture
+def db(mocker, recording_client, retry):
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    db = ClickHouseClient()
+    db.retry = retry
+    return db
+
+
+def failing(*errors):
+    """Raise each of ``errors`` in turn, then answer with no rows."""
+    errors = iter(errors)
+
+    def respond(query, params):
+        error = next(errors, None)
+        if error is not None:
+            raise error
+        return []
+
+    return respond
+
+
+def test_is_retryable(retry):
+    """Test classifying transient errors."""
+    assert retry.is_retryable(NetworkError("Connection reset"))
+    assert retry.is_retryable(EOFError())
+    assert retry.is_retryable(ServerException("Too many parts", code=252))
+    assert not retry.is_retryable(ServerException("Syntax error", code=62))
+    assert not retry.is_retryable(ValueError())
+
+
+def test_retries_idempotent_statement(db, sleeps):
+    """Test that idempotent statements are retried with backoff."""
+    db.client.respond(
+        "CREATE TABLE",
+        failing(NetworkError("Connection reset"), ServerException("", code=209)),
+    )
+    db.execute_migration("CREATE TABLE IF NOT EXISTS events (id UInt32)")
+
+    assert db.client.query_count == 3
+    assert sleeps == [1, 2]
+
+
+def test_gives_up_after_attempts(db, sleeps):
+    """Test that the last error is raised when every attempt failed."""
+    db.client.respond("CREATE TABLE", failing(*[NetworkError("down")] * 3))
+
+    with pytest.raises(NetworkError):
+        db.execute_migration("CREATE TABLE IF NOT EXISTS events (id UInt32)")
+
+    assert db.client.query_count == 3
+    assert sleeps == [1, 2]
+
+
+def test_does_not_retry_unsafe_statements(db, sleeps):
+    """Test that statements that may have been applied are not retried."""
+    db.client.respond("INSERT INTO events", failing(NetworkError("Timeout")))
+
+    with pytest.raises(NetworkError):
+        db.execute_migration("INSERT INTO events SELECT * FROM staging")
+
+    assert db.client.query_count == 1
+    assert sleeps == []
+
+
+def test_does_not_retry_statement_errors(db, sleeps):
+    """Test that errors caused by the statement itself are raised at once."""
+    db.client.respond("DROP TABLE", failing(ServerException("Syntax", code=62)))
+
+    with pytest.raises(ServerException):
+        db.execute_migration("DROP TABLE IF EXISTS events")
+
+    assert sleeps == []
+
+
+def test_retries_bookkeeping(db, sleeps):
+    """Test that marking a migration applied survives a dropped connection."""
+    db.client.respond("INSERT INTO schema_migrations", failing(EOFError()))
+    db.mark_migration_applied("20240101000000")
+
+    queries = [query["query"] for query in db.client.queries]
+    assert len([q for q in queries if "INSERT INTO schema_migrations" in q]) == 2
+    assert sleeps == [1]
@@ -0,0 +1,176 @@
+import datetime
+import decimal
+
+import pytest
+from clickhouse_driver.errors import UnknownCompressionMethod
+
+from houseplant.clickhouse_client import ClickHouseClient
+from houseplant.seed import SeedError, converter, read_blocks, seed_format
+from houseplant.testing import RecordingClient
+
+COLUMNS = {
+    "code": "LowCardinality(String)",
+    "name": "String",
+    "population": "Nullable(UInt64)",
+    "founded": "Date",
+}
+
+
+@pytest.mark.parametrize(
+    "type_, text, value",
+    [
+        ("UInt8", "42", 42),
+        ("Float64", "1.5", 1.5),
+        ("Decimal(10, 2)", "1.25", decimal.Decimal("1.25")),
+        ("Bool", "true", True),
+        ("Date", "2024-01-31", datetime.date(2024, 1, 31)),
+        (
+            "DateTime64(3, 'UTC')",
+            "2024-01-31 12:00:00",
+            datetime.datetime(2024, 1, 31, 12),
+        ),
+        ("Array(UInt8)", "[1, 2]", [1, 2]),
+        ("Nullable(Int32)", "", None),
+        ("Nullable(Int32)", "\\N", None),
+        ("Nullable(String)", "", ""),
+        ("LowCardinality(Nullable(String))", "\\N", None),
+        (
+            "UUID",
+            "61f0c404-5cb3-11e7-907b-a6006ad3dba0",
+            "61f0c404-5cb3-11e7-907b-a6006ad3dba0",
+        ),
+    ],
+)
+def test_converter(type_, text, value):
+    assert converter(type_)(text) == value
+
+
+def test_seed_format():
+    assert seed_format("seeds/countries.CSV") == "csv"
+    assert seed_format("seeds/plans.jsonl") == "ndjson"
+    with pytest.raises(SeedError, match="unknown seed format '.xlsx'"):
+        seed_format("seeds/countries.xlsx")
+
+
+def test_csv_blocks(tmp_path):
+    """Test that CSV rows are converted and grouped in blocks of columns."""
+    path = tmp_path / "countries.csv"
+    path.write_text(
+        "code,name,population\n"
+        "fr,France,68000000\n"
+        "nz,New Zealand,\n"
+        '"is","Iceland, the island",380000\n'
+    )
+
+    assert list(read_blocks(str(path), COLUMNS, block_size=2)) == [
+        (
+            ["code", "name", "population"],
+            [["fr", "nz"], ["France", "New Zealand"], [68000000, None]],
+        ),
+        (["code", "name", "population"], [["is"], ["Iceland, the island"], [380000]]),
+    ]
+
+
+def test_csv_errors(tmp_path):
+    path = tmp_path / "countries.csv"
+
+    path.write_text("code,capital\nfr,Paris\n")
+    with pytest.raises(SeedError, match="unknown columns capital"):
+        list(read_blocks(str(path), COLUMNS))
+
+    path.write_text("code,population\nfr,68000000\nnz,many\n")
+    with pytest.raises(SeedError, match="countries.csv:3: invalid literal"):
+        list(read_blocks(str(path), COLUMNS))
+
+    path.write_text("code,area\nfr,551695.5\nnz,vast\n")
+    with pytest.raises(SeedError, match="countries.csv:3: invalid literal for Decimal"):
+        list(read_blocks(str(path), {**COLUMNS, "area": "Decimal(12, 1)"}))
+
+
+def test_ndjson_blocks(tmp_path):
+    """Test that NDJSON keys become columns and text values are converted."""
+    path = tmp_path / "countries.ndjson"
+    path.write_text(
+        '{"code": "fr", "founded": "0843-08-10"}\n'
+        "\n"
+        '{"code": "nz", "population": 5100000}\n'
+        '{"name": "Iceland"}\n'
+    )
+
+    assert list(read_blocks(str(path), COLUMNS, block_size=2)) == [
+        (
+            ["code", "population", "founded"],
+            [["fr", "nz"], [None, 5100000], [datetime.date(843, 8, 10), None]],
+        ),
+        (["name"], [["Iceland"]]),
+    ]
+
+
+def test_ndjson_errors(tmp_path):
+    path = tmp_path / "countries.ndjson"
+    path.write_text('{"code": "fr"}\n\n["nz"]\n')
+
+    with pytest.raises(SeedError, match="countries.ndjson:3: expected a JSON object"):
+        list(read_blocks(str(path), COLUMNS))
+
+
+def test_parquet_blocks(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow
+    import pyarrow.parquet
+
+    path = tmp_path / "countries.parquet"
+    pyarrow.parquet.write_table(
+        pyarrow.table({"code": ["fr", "nz", "is"], "population": [68, 5, None]}),
+        path,
+    )
+
+    assert list(read_blocks(str(path), COLUMNS, block_size=2)) == [
+        (["code", "population"], [["fr", "nz"], [68, 5]]),
+        (["code", "population"], [["is"], [None]]),
+    ]
+
+
+def test_insert_blocks(mocker):
+    """Test that blocks are inserted in columnar form over a compressed connection."""
+    seeder = RecordingClient()
+    client_class = mocker.patch(
+        "houseplant.clickhouse_client.Client",
+        side_effect=lambda **kwargs: seeder
+        if kwargs["compression"]
+        else RecordingClient(),
+    )
+    db = ClickHouseClient()
+
+    blocks = iter([(["code"], [["fr", "nz"]]), (["code"], [["is"]])])
+    assert db.insert_blocks("countries", blocks, {"max_insert_threads": 4}) == 3
+
+    assert client_class.call_args.kwargs["compression"] is True
+    assert seeder.queries == [
+        {
+            "query": "INSERT INTO countries (`code`) VALUES",
+            "params": [["fr", "nz"]],
+            "settings": {"max_insert_threads": 4},
+        },
+        {
+            "query": "INSERT INTO countries (`code`) VALUES",
+            "params": [["is"]],
+            "settings": {"max_insert_threads": 4},
+        },
+    ]
+    assert db.client.queries == []
+
+
+def test_insert_blocks_uncompressed(mocker, recording_client):
+    """Test that inserts fall back to the main connection without LZ4."""
+
+    def connect(**kwargs):
+        if kwargs["compression"]:
+            raise UnknownCompressionMethod("Unknown compression method: 'lz4'")
+        return recording_client
+
+    mocker.patch("houseplant.clickhouse_client.Client", side_effect=connect)
+    db = ClickHouseClient()
+
+    assert db.insert_blocks("countries", [(["code"], [["fr"]])]) == 1
+    assert recording_client.queries[0]["params"] == [["fr"]]
@@ -0,0 +1,106 @@
+import os
+import threading
+
+import pytest
+import yaml
+
+from houseplant import Houseplant
+from houseplant import remote
+from houseplant.server import HouseplantServer
+from tests.test_houseplant import write_migrations
+
+
+@pytest.fixture
+def houseplant(mocker, recording_client, tmp_path):
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    recording_client.respond_applied([])
+    return Houseplant(root=tmp_path)
+
+
+@pytest.fixture
+def server(houseplant, tmp_path):
+    server = HouseplantServer(houseplant, tmp_path / "houseplant.sock")
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_ping(server):
+    """Test that the daemon answers over its socket."""
+    assert remote.request("ping", path=server.path) == {"output": "", "exit_code": 0}
+
+
+def test_migrate_status(server, tmp_path):
+    """Test that command output is rendered for the client."""
+    versions = write_migrations(tmp_path, 2)
+    server.houseplant.db.client.respond_applied(versions[:1])
+
+    response = remote.request("migrate:status", path=server.path, width=120)
+
+    assert response["exit_code"] == 0
+    assert "Database: houseplant_test" in response["output"]
+    assert versions[1] in response["output"]
+
+
+def test_migrations_are_parsed_once(server, tmp_path, mocker):
+    """Test that migrations are only parsed again when they change."""
+    write_migrations(tmp_path, 2)
+    load = mocker.spy(yaml, "safe_load")
+
+    remote.request("migrate:check", path=server.path)
+    remote.request("migrate:check", path=server.path)
+    assert load.call_count == 2
+
+    migration = tmp_path / "ch/migrations/20240101000000_create_table_0.yml"
+    migration.write_text(migration.read_text() + "\n")
+    remote.request("migrate:check", path=server.path)
+    assert load.call_count == 3
+
+    # The entry of a modified file is replaced, not kept next to the old one
+    assert len(server.houseplant._migration_cache) == 2
+
+
+def test_unknown_command(server):
+    """Test that unknown commands are rejected."""
+    response = remote.request("db:drop", path=server.path)
+
+    assert response["exit_code"] == 2
+    assert "Unknown command" in response["output"]
+
+
+def test_shutdown(server):
+    """Test that the daemon stops and removes its socket on shutdown."""
+    remote.request("shutdown", path=server.path)
+    server.server_close()
+
+    assert not os.path.exists(server.path)
+
+
+def test_remote_without_daemon(tmp_path, monkeypatch, capsys):
+    """Test that the thin client explains when no daemon is running."""
+    monkeypatch.setenv("HOUSEPLANT_SOCKET", str(tmp_path / "missing.sock"))
+
+    assert remote.main(["migrate:status"]) == 1
+    assert "houseplant serve" in capsys.readouterr().err
+
+
+def test_remote_main(server, monkeypatch, capsys):
+    """Test that the thin client prints the output and returns the exit code."""
+    monkeypatch.setenv("HOUSEPLANT_SOCKET", server.path)
+
+    assert remote.main(["db:drop"]) == 2
+    assert "Unknown command" in capsys.readouterr().out
+
+
+def test_default_socket_in_project(houseplant, tmp_path, monkeypatch):
+    """Test that the default socket is in the ch/ of the project, not the cwd."""
+    monkeypatch.delenv("HOUSEPLANT_SOCKET", raising=False)
+    (tmp_path / "ch").mkdir()
+    monkeypatch.chdir("/")
+
+    server = HouseplantServer(houseplant)
+    server.server_close()
+
+    assert server.path == str(tmp_path / "ch/.houseplant.sock")
@@ -0,0 +1,262 @@
+import pytest
+
+from houseplant.sql import (
+    alter_scope,
+    changed_objects,
+    dependency_order,
+    is_idempotent,
+    iter_statements,
+    like_pattern,
+    normalize_create,
+    parse_create,
+    parse_schema,
+    read_statements,
+    requalify,
+    rewritten_table,
+    schema_fingerprint,
+    select_query,
+)
+
+SCHEMA = """-- version: 20240102000000
+
+-- TABLES
+
+CREATE TABLE development.events
+(
+    `id` UInt32
+)
+ENGINE = MergeTree
+ORDER BY id
+;
+
+CREATE TABLE development.users
+(
+    `id` UInt32
+)
+ENGINE = MergeTree
+ORDER BY id;
+
+-- MATERIALIZED VIEWS
+
+CREATE MATERIALIZED VIEW development.events_mv TO development.users
+AS SELECT id FROM development.events;"""
+
+
+def test_parse_schema():
+    """Test parsing a schema file into its version and statements."""
+    schema = parse_schema(SCHEMA)
+
+    assert schema["version"] == "20240102000000"
+    assert len(schema["tables"]) == 2
+    assert schema["tables"][0].startswith("CREATE TABLE development.events")
+    assert schema["tables"][1].endswith("ORDER BY id")
+    assert schema["materialized_views"] == [
+        "CREATE MATERIALIZED VIEW development.events_mv TO development.users\n"
+        "AS SELECT id FROM development.events"
+    ]
+    assert schema["dictionaries"] == []
+
+
+def test_parse_empty_schema():
+    """Test parsing an empty schema file."""
+    assert parse_schema("") == {
+        "version": "0",
+        "tables": [],
+        "materialized_views": [],
+        "dictionaries": [],
+    }
+
+
+def test_parse_create():
+    """Test extracting the created object from CREATE statements."""
+    assert parse_create("CREATE TABLE development.events (id UInt32)") == (
+        "development",
+        "events",
+    )
+    assert parse_create("CREATE MATERIALIZED VIEW IF NOT EXISTS events_mv") == (
+        None,
+        "events_mv",
+    )
+    assert parse_create("ALTER TABLE events ADD COLUMN name String") is None
+
+
+def test_dependency_order():
+    """Test that views and dictionaries follow the objects they read."""
+    statements = [
+        "CREATE DICTIONARY plans_dict (id UInt64) PRIMARY KEY id "
+        "SOURCE(CLICKHOUSE(TABLE 'plans_mv'))",
+        "CREATE MATERIALIZED VIEW totals_mv TO totals AS SELECT * FROM `daily_mv`",
+        "CREATE MATERIALIZED VIEW plans_mv TO plans AS SELECT * FROM raw_plans",
+        "CREATE MATERIALIZED VIEW development.daily_mv TO daily AS SELECT 1",
+        "CREATE MATERIALIZED VIEW events_mv TO events AS SELECT * FROM events",
+    ]
+
+    assert dependency_order(statements) == [
+        statements[2],
+        statements[0],
+        statements[3],
+        statements[1],
+        statements[4],
+    ]
+
+
+def test_requalify():
+    """Test replacing database qualifiers."""
+    statement = (
+        "CREATE MATERIALIZED VIEW development.events_mv TO development.users "
+        "AS SELECT id FROM `development`.events JOIN development_2.other"
+    )
+
+    assert requalify(statement, "development", "clone") == (
+        "CREATE MATERIALIZED VIEW clone.events_mv TO clone.users "
+        "AS SELECT id FROM clone.events JOIN development_2.other"
+    )
+    assert requalify(statement, "development") == (
+        "CREATE MATERIALIZED VIEW events_mv TO users "
+        "AS SELECT id FROM events JOIN development_2.other"
+    )
+
+
+def test_select_query():
+    """Test extracting the SELECT that reads data for a statement."""
+    assert select_query("INSERT INTO a (x) SELECT x FROM b") == "SELECT x FROM b"
+    assert select_query("INSERT INTO a VALUES ('SELECT')") is None
+    assert select_query("CREATE TABLE a ENGINE = Log AS SELECT 1") == "SELECT 1"
+    assert select_query("CREATE MATERIALIZED VIEW v TO t AS SELECT x FROM b") is None
+    assert (
+        select_query("CREATE MATERIALIZED VIEW v ENGINE = Log POPULATE AS SELECT 1")
+        == "SELECT 1"
+    )
+
+
+def test_alter_scope():
+    """Test classifying how much data an ALTER rewrites."""
+    assert alter_scope("ALTER TABLE db.events ADD COLUMN x String") == (
+        "events",
+        "metadata",
+    )
+    assert alter_scope(
+        "ALTER TABLE events ON CLUSTER '{cluster}' DROP PARTITION 202401"
+    ) == ("events", "partition")
+    assert alter_scope(
+        "ALTER TABLE events ADD COLUMN x String, MODIFY COLUMN y UInt64"
+    ) == ("events", "rewrite")
+    assert alter_scope("ALTER TABLE events DELETE WHERE id = 1") == (
+        "events",
+        "rewrite",
+    )
+    assert alter_scope("CREATE TABLE events (id UInt32)") is None
+
+
+def test_changed_objects():
+    """Test finding the objects a statement alters, drops or renames."""
+    assert changed_objects("ALTER TABLE db.events ADD COLUMN x String") == ["events"]
+    assert changed_objects("DROP DICTIONARY IF EXISTS `users`") == ["users"]
+    assert changed_objects("RENAME TABLE a TO b, db.c TO d") == ["a", "b", "c", "d"]
+    assert changed_objects("EXCHANGE TABLES a AND b") == ["a", "b"]
+    assert changed_objects("INSERT INTO events SELECT * FROM a") == []
+
+
+def test_rewritten_table():
+    """Test finding the table whose parts a statement rewrites."""
+    assert rewritten_table("ALTER TABLE events DELETE WHERE id = 1") == "events"
+    assert rewritten_table("OPTIMIZE TABLE db.events FINAL") == "events"
+    assert rewritten_table("ALTER TABLE events ADD COLUMN x String") is None
+    assert rewritten_table("CREATE TABLE events (id UInt32)") is None
+
+
+def test_is_idempotent():
+    """Test recognizing statements that are safe to run twice."""
+    assert is_idempotent("CREATE TABLE IF NOT EXISTS events (id UInt32)")
+    assert is_idempotent("CREATE MATERIALIZED VIEW IF NOT EXISTS v AS SELECT 1")
+    assert is_idempotent("CREATE OR REPLACE VIEW v AS SELECT 1")
+    assert is_idempotent("DROP TABLE IF EXISTS events")
+    assert is_idempotent("OPTIMIZE TABLE events FINAL")
+    assert is_idempotent(
+        "ALTER TABLE events ADD COLUMN IF NOT EXISTS x String, MODIFY TTL ts"
+    )
+    assert is_idempotent("ALTER TABLE events DROP PARTITION 202401")
+    assert is_idempotent("ALTER TABLE events DELETE WHERE id = 1")
+
+    assert not is_idempotent("CREATE TABLE events (id UInt32)")
+    assert not is_idempotent("DROP TABLE events")
+    assert not is_idempotent("INSERT INTO events SELECT * FROM staging")
+    assert not is_idempotent("ALTER TABLE events DROP COLUMN x")
+    assert not is_idempotent("ALTER TABLE events UPDATE n = n + 1 WHERE 1")
+    assert not is_idempotent("RENAME TABLE events TO events_old")
+
+
+def test_normalize_create():
+    """Test that formatting and the database don't change a normalized CREATE."""
+    pretty = (
+        "CREATE TABLE development.events\n(\n    `id` UInt32,\n"
+        "    `name` String\n)\nENGINE = MergeTree\nORDER BY (id, name);"
+    )
+    one_line = (
+        "CREATE TABLE production.events (`id` UInt32, `name` String) "
+        "ENGINE = MergeTree ORDER BY (id, name)"
+    )
+
+    assert normalize_create(pretty, "development") == normalize_create(
+        one_line, "production"
+    )
+    assert normalize_create(pretty, "development") == (
+        "CREATE TABLE events(`id` UInt32,`name` String)"
+        "ENGINE = MergeTree ORDER BY(id,name)"
+    )
+    assert normalize_create(pretty) != normalize_create(
+        pretty.replace("String", "LowCardinality(String)")
+    )
+
+
+def test_like_pattern():
+    assert like_pattern("tenant_*") == "tenant\\_%"
+    assert like_pattern("100%_off\\") == "100\\%\\_off\\\\"
+    assert like_pattern("analytics") == "analytics"
+
+
+def test_schema_fingerprint():
+    """Test that a fingerprint depends on every object but not on their order."""
+    hashes = {"events": "a1", "users": "b2"}
+
+    assert schema_fingerprint(hashes) == schema_fingerprint(
+        {"users": "b2", "events": "a1"}
+    )
+    assert schema_fingerprint(hashes) != schema_fingerprint({"events": "a1"})
+    assert schema_fingerprint(hashes) != schema_fingerprint(
+        {"events": "a1", "users": "c3"}
+    )
+
+
+STATEMENTS = """-- Backfill the events table; in two steps
+INSERT INTO events VALUES ('a;b', 'it''s', 'back\\'slash;');
+/* skip; this */ INSERT INTO `odd;name` SELECT ";" -- trailing; comment
+;
+SELECT 1"""
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 8, len(STATEMENTS)])
+def test_iter_statements(chunk_size):
+    """Test that semicolons in strings and comments survive any chunking."""
+    chunks = [
+        STATEMENTS[i : i + chunk_size] for i in range(0, len(STATEMENTS), chunk_size)
+    ]
+
+    assert list(iter_statements(chunks)) == [
+        "INSERT INTO events VALUES ('a;b', 'it''s', 'back\\'slash;')",
+        'INSERT INTO `odd;name` SELECT ";" -- trailing; comment',
+        "SELECT 1",
+    ]
+
+
+def test_iter_statements_empty():
+    assert list(iter_statements(["-- nothing here;\n", " ; ;"])) == []
+
+
+def test_read_statements(tmp_path):
+    path = tmp_path / "backfill.sql"
+    path.write_text(STATEMENTS)
+
+    assert list(read_statements(path, chunk_size=4)) == list(
+        iter_statements([STATEMENTS])
+    )
@@ -0,0 +1,66 @@
+import pytest
+
+from houseplant.testing import QueryBudgetExceeded, RecordingClient
+
+
+def test_records_queries(recording_client):
+    """Test that every query is recorded with normalized whitespace."""
+    recording_client.execute(
+        """
+        SELECT version
+        FROM schema_migrations
+        """,
+        settings={"max_threads": 1},
+    )
+
+    assert recording_client.query_count == 1
+    assert recording_client.queries[0] == {
+        "query": "SELECT version FROM schema_migrations",
+        "params": None,
+        "settings": {"max_threads": 1},
+    }
+
+
+def test_canned_responses(recording_client):
+    """Test that canned responses are matched by pattern."""
+    recording_client.respond(r"FROM schema_migrations", [("20240101000000",)])
+    recording_client.respond(
+        r"^SHOW CREATE TABLE", lambda query, params: [(query.split()[-1],)]
+    )
+
+    assert recording_client.execute("SELECT version FROM schema_migrations") == [
+        ("20240101000000",)
+    ]
+    assert recording_client.execute("SHOW CREATE TABLE events") == [("events",)]
+    assert recording_client.execute("SELECT 1") == []
+
+
+def test_record_and_replay(tmp_path, mocker):
+    """Test that responses from a wrapped client can be replayed."""
+    wrapped = mocker.Mock()
+    wrapped.execute.return_value = [("events",)]
+    recorder = RecordingClient(wrapped=wrapped)
+
+    assert recorder.execute("SELECT name FROM system.tables") == [("events",)]
+
+    cassette = tmp_path / "cassette.json"
+    recorder.save(cassette)
+
+    replayer = RecordingClient()
+    replayer.load(cassette)
+
+    assert replayer.execute("SELECT  name\nFROM system.tables") == [("events",)]
+
+
+def test_query_budget(recording_client):
+    """Test that exceeding a query budget fails with the issued queries."""
+    with recording_client.query_budget(2):
+        recording_client.execute("SELECT 1")
+        recording_client.execute("SELECT 2")
+
+    with pytest.raises(QueryBudgetExceeded) as exc_info:
+        with recording_client.query_budget(1):
+            recording_client.execute("SELECT 3")
+            recording_client.execute("SELECT 4")
+
+    assert "SELECT 4" in str(exc_info.value)
@@ -0,0 +1,94 @@
+import pytest
+
+from houseplant.clickhouse_client import ClickHouseClient
+from houseplant.throttle import Throttle
+
+
+@pytest.fixture
+def sleeps():
+    return []
+
+
+@pytest.fixture
+def throttle(sleeps):
+    return Throttle(
+        max_merges=4, max_parts=100, max_memory=0.5, max_wait=10, sleep=sleeps.append
+    )
+
+
+@pytest.fixture
+def db(mocker, recording_client):
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    return ClickHouseClient()
+
+
+def test_reasons(throttle):
+    """Test that every threshold is checked."""
+    assert throttle.reasons({}) == []
+    assert throttle.reasons(
+        {
+            "BackgroundMergesAndMutationsPoolTask": 5,
+            "MaxPartCountForPartition": 150,
+            "MemoryTracking": 6,
+            "OSMemoryTotal": 10,
+        }
+    ) == ["5 background merges", "150 parts in a partition", "60% memory used"]
+
+
+def test_wait_with_backoff(throttle, db, sleeps):
+    """Test that the throttle backs off until the server is idle."""
+    samples = iter([[("BackgroundPoolTask", 8)], [("BackgroundPoolTask", 8)], []])
+    db.client.respond(r"FROM system\.metrics", lambda query, params: next(samples))
+
+    assert throttle.wait(db) == 3
+    assert sleeps == [1, 2]
+
+
+def test_wait_gives_up(throttle, db, sleeps):
+    """Test that the throttle lets statements run after the maximum wait."""
+    db.client.respond(r"FROM system\.metrics", [("MaxPartCountForPartition", 500)])
+
+    assert throttle.wait(db) == 10
+    assert sleeps == [1, 2, 4, 3]
+
+
+def test_sample_cluster(throttle, db):
+    """Test that a cluster is sampled on every replica."""
+    db.cluster = "main"
+    throttle.sample(db)
+
+    query = db.client.queries[0]["query"]
+    assert "clusterAllReplicas('main', system.metrics)" in query
+    assert "clusterAllReplicas('main', system.asynchronous_metrics)" in query
+
+
+def test_execute_migration_throttled(monkeypatch, mocker, recording_client):
+    """Test that statements wait for the throttle when it is enabled."""
+    monkeypatch.setenv("HOUSEPLANT_THROTTLE", "true")
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+
+    db = ClickHouseClient()
+    assert db.throttle is not None
+    db.execute_migration("SELECT 1; SELECT 2")
+
+    queries = [q["query"] for q in db.client.queries]
+    assert len(queries) == 4
+    assert "system.metrics" in queries[0]
+    assert queries[1] == "SELECT 1"
+    assert "system.metrics" in queries[2]
+    assert queries[3] == "SELECT 2"
+
+
+def test_project_env(tmp_path, mocker, recording_client):
+    """Test that throttle and retry settings are read from the project's .env."""
+    mocker.patch("houseplant.clickhouse_client.Client", return_value=recording_client)
+    (tmp_path / ".env").write_text(
+        "HOUSEPLANT_THROTTLE=true\n"
+        "HOUSEPLANT_THROTTLE_MAX_PARTS=50\n"
+        "HOUSEPLANT_RETRY_ATTEMPTS=7\n"
+    )
+
+    db = ClickHouseClient(root=str(tmp_path))
+
+    assert db.throttle.max_parts == 50
+    assert db.retry.attempts == 7
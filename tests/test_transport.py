@@ -0,0 +1,334 @@
+import gzip
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+from clickhouse_driver.errors import NetworkError, ServerException
+
+from houseplant.clickhouse_client import ClickHouseClient
+from houseplant.transport import HttpClient
+
+
+class FakeClickHouseHandler(BaseHTTPRequestHandler):
+    """Answer queries the way the ClickHouse HTTP interface does."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+
+        request = {
+            "query": body.decode(),
+            "params": parse_qs(urlparse(self.path).query),
+            "headers": dict(self.headers),
+            "client_port": self.client_address[1],
+        }
+        self.server.requests.append(request)
+
+        status, payload, headers = self.server.respond(request)
+        data = payload.encode()
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            data = gzip.compress(data)
+            headers = {**headers, "Content-Encoding": "gzip"}
+
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def select_response(request):
+    if not request["query"].lstrip().startswith("SELECT"):
+        return 200, "", {}
+    return (
+        200,
+        json.dumps(
+            {
+                "meta": [
+                    {"name": "version", "type": "String"},
+                    {"name": "active", "type": "UInt8"},
+                ],
+                "data": [["20240101000000", 1], ["20240102000000", 1]],
+            }
+        ),
+        {},
+    )
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeClickHouseHandler)
+    server.requests = []
+    server.respond = select_response
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    client = HttpClient(
+        host="127.0.0.1",
+        port=server.server_address[1],
+        database="houseplant_test",
+        user="default",
+        password="secret",
+    )
+    yield client
+    client.disconnect()
+
+
+def test_execute_select(client, server):
+    """Test that rows, settings and credentials go over HTTP."""
+    rows = client.execute(
+        "SELECT version, active FROM schema_migrations WHERE version = %(v)s",
+        {"v": "20240101000000"},
+        settings={"max_threads": 2},
+    )
+
+    assert rows == [("20240101000000", 1), ("20240102000000", 1)]
+
+    request = server.requests[0]
+    assert request["query"] == (
+        "SELECT version, active FROM schema_migrations "
+        "WHERE version = '20240101000000'"
+    )
+    assert request["params"]["database"] == ["houseplant_test"]
+    assert request["params"]["default_format"] == ["JSONCompact"]
+    assert request["params"]["max_threads"] == ["2"]
+    assert request["params"]["enable_http_compression"] == ["1"]
+    assert request["params"]["wait_end_of_query"] == ["1"]
+    assert request["headers"]["X-ClickHouse-User"] == "default"
+    assert request["headers"]["X-ClickHouse-Key"] == "secret"
+
+
+def test_execute_with_column_types(client):
+    """Test that column types are returned like the native client does."""
+    rows, columns = client.execute("SELECT 1", with_column_types=True)
+
+    assert len(rows) == 2
+    assert columns == [("version", "String"), ("active", "UInt8")]
+    assert client.execute("SELECT 1", columnar=True) == [
+        ("20240101000000", "20240102000000"),
+        (1, 1),
+    ]
+
+
+def test_execute_ddl(client, server):
+    """Test that statements without a result return no rows."""
+    assert client.execute("CREATE TABLE events (id UInt32) ENGINE = Memory") == []
+
+
+def test_set_carries_over(client, server):
+    """Test that settings changed with SET are sent with later queries."""
+    client.execute("SET allow_experimental_object_type = 1, format_csv_delimiter = ','")
+    client.execute("CREATE TABLE events (data Object('json')) ENGINE = Memory")
+    client.execute("SELECT 1", settings={"format_csv_delimiter": ";"})
+
+    assert server.requests[0]["query"].startswith("SET ")
+    assert server.requests[1]["params"]["allow_experimental_object_type"] == ["1"]
+    assert server.requests[1]["params"]["format_csv_delimiter"] == [","]
+    assert server.requests[2]["params"]["format_csv_delimiter"] == [";"]
+
+
+def test_failed_set_not_kept(client, server):
+    """Test that a SET rejected by the server changes no setting."""
+    server.respond = lambda request: (500, "Code: 115. Unknown setting", {})
+
+    with pytest.raises(ServerException):
+        client.execute("SET no_such_setting = 1")
+
+    server.respond = select_response
+    client.execute("SELECT 1")
+    assert "no_such_setting" not in server.requests[-1]["params"]
+
+
+def test_insert_values(client, server):
+    """Test that INSERT ... VALUES rows are rendered into the query."""
+    client.execute(
+        "INSERT INTO schema_migrations (version, active) VALUES",
+        [("20240101000000", 1), ("it's", 0)],
+    )
+
+    assert server.requests[0]["query"] == (
+        "INSERT INTO schema_migrations (version, active) VALUES "
+        "('20240101000000', 1), ('it\\'s', 0)"
+    )
+
+
+def test_insert_columnar(client, server):
+    """Test that columnar INSERT data is rendered as rows."""
+    client.execute(
+        "INSERT INTO countries (code, name) VALUES",
+        [["fr", "nz"], ["France", "New Zealand"]],
+        columnar=True,
+    )
+
+    assert server.requests[0]["query"] == (
+        "INSERT INTO countries (code, name) VALUES "
+        "('fr', 'France'), ('nz', 'New Zealand')"
+    )
+
+
+def test_external_tables(client, server):
+    """Test that external tables are uploaded as TSV files."""
+    client.execute(
+        "SELECT version FROM local_migrations",
+        external_tables=[
+            {
+                "name": "local_migrations",
+                "structure": [("version", "String")],
+                "data": [{"version": "20240101000000"}, {"version": "tab\there"}],
+            }
+        ],
+    )
+
+    request = server.requests[0]
+    assert request["params"]["query"] == ["SELECT version FROM local_migrations"]
+    assert request["params"]["local_migrations_structure"] == ["version String"]
+    assert request["headers"]["Content-Type"].startswith("multipart/form-data")
+    assert 'name="local_migrations"' in request["query"]
+    assert "20240101000000\ntab\\there\n" in request["query"]
+
+
+def test_large_queries_are_compressed(client, server):
+    """Test that large request bodies are sent gzip-compressed."""
+    query = "SELECT " + ", ".join(str(i) for i in range(1000))
+    client.execute(query)
+
+    request = server.requests[0]
+    assert request["headers"]["Content-Encoding"] == "gzip"
+    assert request["query"] == query
+
+
+def test_connections_are_reused(client, server):
+    """Test that keep-alive connections are pooled between queries."""
+    for _ in range(3):
+        client.execute("SELECT 1")
+
+    assert len({request["client_port"] for request in server.requests}) == 1
+
+
+def broken_connection(error):
+    """Return a pooled connection that looks idle but fails when used."""
+    sock, peer = socket.socketpair()
+    connection = mock.Mock(sock=sock)
+    connection.request.side_effect = error
+    connection.close.side_effect = lambda: (sock.close(), peer.close())
+    return connection
+
+
+def test_stale_connection_resent(client, server):
+    """Test that an idempotent query is resent when a reused connection broke."""
+    client._pool.put(broken_connection(ConnectionResetError()))
+
+    assert len(client.execute("SELECT 1")) == 2
+    assert len(server.requests) == 1
+
+
+def test_stale_connection_not_resent(client, server):
+    """Test that a query that may have run is not sent a second time."""
+    client._pool.put(broken_connection(BrokenPipeError()))
+
+    with pytest.raises(NetworkError):
+        client.execute("INSERT INTO events SELECT * FROM raw_events")
+
+    assert server.requests == []
+
+
+def test_closed_connection_dropped(client, server):
+    """Test that connections closed by the server are dropped before use."""
+    connection = broken_connection(BrokenPipeError())
+    client._pool.put(connection)
+    connection.sock.shutdown(socket.SHUT_RD)
+
+    client.execute("INSERT INTO events SELECT * FROM raw_events")
+
+    connection.request.assert_not_called()
+    assert len(server.requests) == 1
+
+
+def test_server_exception(client, server):
+    """Test that server errors raise ServerException with their code."""
+    server.respond = lambda request: (
+        500,
+        "Code: 60. DB::Exception: Table houseplant_test.missing does not exist.",
+        {"X-ClickHouse-Exception-Code": "60"},
+    )
+
+    with pytest.raises(ServerException) as exc_info:
+        client.execute("SELECT * FROM missing")
+
+    assert exc_info.value.code == 60
+    assert "does not exist" in exc_info.value.message
+
+
+def test_network_error():
+    """Test that connection failures raise NetworkError."""
+    client = HttpClient(
+        host="127.0.0.1", port=1, database="default", user="default", password=""
+    )
+
+    with pytest.raises(NetworkError):
+        client.execute("SELECT 1")
+
+
+def test_failover_to_alt_hosts(server):
+    """Test that new connections fail over when a host is unreachable."""
+    client = HttpClient(
+        host="127.0.0.1",
+        port=1,
+        database="default",
+        user="default",
+        password="",
+        alt_hosts=f"127.0.0.1:{server.server_address[1]}",
+    )
+
+    assert len(client.execute("SELECT 1")) == 2
+    assert client.port == server.server_address[1]
+
+
+def test_http_transport(monkeypatch, server):
+    """Test that CLICKHOUSE_TRANSPORT selects the HTTP client."""
+    monkeypatch.setenv("CLICKHOUSE_TRANSPORT", "http")
+
+    db = ClickHouseClient(host=f"127.0.0.1:{server.server_address[1]}")
+
+    assert isinstance(db.client, HttpClient)
+    assert db.get_applied_migrations()[0] == ("20240101000000", 1)
+
+    db.mark_migrations_applied(["20240103000000"], {"20240103000000": "a1"})
+    assert server.requests[-2]["query"] == (
+        "INSERT INTO schema_migrations (version, active, checksum) "
+        "VALUES ('20240103000000', 1, 'a1')"
+    )
+
+
+def test_http_default_ports(monkeypatch):
+    """Test the default ports of the HTTP transport."""
+    monkeypatch.setenv("CLICKHOUSE_TRANSPORT", "http")
+    assert ClickHouseClient().port == 8123
+
+    monkeypatch.setenv("CLICKHOUSE_SECURE", "true")
+    assert ClickHouseClient().port == 8443
+
+
+def test_unknown_transport(monkeypatch):
+    """Test that an unknown transport is rejected."""
+    monkeypatch.setenv("CLICKHOUSE_TRANSPORT", "grpc")
+
+    with pytest.raises(ValueError, match="Unknown CLICKHOUSE_TRANSPORT"):
+        ClickHouseClient()